@@ -0,0 +1,162 @@
+"""
+Avatar uploads and their resized variants.
+
+The cropper posts the avatar as a base64 data URL in an ordinary form
+field, so Django has already read the whole field into request.POST by the
+time the view runs, and DATA_UPLOAD_MAX_MEMORY_SIZE (2.5 MB by default)
+caps it: larger bodies are rejected with a bare 400 before any of this code
+runs. MAX_AVATAR_BYTES is set so that a data URL of that size, URL-encoded,
+still fits, and bigger images get a readable error instead.
+
+decode_data_url() decodes the field in fixed-size chunks into a spooled
+file, so the decoded image is not held as a second full copy next to the
+base64 text. Only the image header is read on the request path to check the
+format and dimensions.
+
+Square WebP variants (40, 80 and 256 px) are generated off the request path
+(see accounts.models.build_avatar_variants) and recorded in
+Profile.avatar_variants:
+
+    {'source': 'profile_pics/3f/3f2a...e8.png',
+     '40': 'profile_pics/variants/91/91c0...4b.webp', '80': ..., '256': ...}
+
+Templates pick a variant with {% avatar_url %}; until the variants exist they
+get the uploaded file.
+"""
+import base64
+import binascii
+import io
+import os
+import tempfile
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+from posts import media
+
+AVATAR_SIZES = (40, 80, 256)
+
+# Limits on what an upload may be before it is stored. Base64 and URL
+# encoding grow an image by about 1.42x, so 1.5 MB posts as about 2.1 MB,
+# under the default DATA_UPLOAD_MAX_MEMORY_SIZE. Raise both together.
+MAX_AVATAR_BYTES = 1536 * 1024
+MAX_AVATAR_DIMENSION = 4096
+AVATAR_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+# Base64 characters decoded at a time; a multiple of 4 so chunks decode alone
+DECODE_CHUNK_CHARS = 64 * 1024
+
+# Decoded uploads stay in memory up to this size, then spill to disk
+SPOOL_MAX_BYTES = 512 * 1024
+
+VARIANT_DIR = 'variants'
+VARIANT_QUALITY = 82
+
+
+def decode_data_url(data_url):
+    """
+    Decode a base64 image data URL into a File named after its real format.
+
+    Raises ValidationError if the data is not base64, is larger than
+    MAX_AVATAR_BYTES, is not a JPEG, PNG, WebP or GIF image, or is larger
+    than MAX_AVATAR_DIMENSION on either side.
+    """
+    header, separator, payload = data_url.partition(';base64,')
+    if not separator or not header.startswith('data:image/'):
+        raise ValidationError('Upload must be a base64 image data URL.')
+    # Each 4 characters decode to at most 3 bytes, so this rejects oversized
+    # uploads before decoding anything
+    if len(payload) // 4 * 3 > MAX_AVATAR_BYTES + 3:
+        raise ValidationError('Image is too large.')
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        size = 0
+        for start in range(0, len(payload), DECODE_CHUNK_CHARS):
+            chunk = base64.b64decode(payload[start:start + DECODE_CHUNK_CHARS], validate=True)
+            size += len(chunk)
+            if size > MAX_AVATAR_BYTES:
+                raise ValidationError('Image is too large.')
+            spool.write(chunk)
+        spool.seek(0)
+
+        # Image.open only parses the header; the pixels are decoded later,
+        # in the background
+        try:
+            with Image.open(spool) as image:
+                image_format, (width, height) = image.format, image.size
+        except (OSError, Image.DecompressionBombError):
+            raise ValidationError('Upload is not a valid image.')
+    except (binascii.Error, ValueError):
+        spool.close()
+        raise ValidationError('Upload is not valid base64 data.')
+    except ValidationError:
+        spool.close()
+        raise
+
+    if image_format not in AVATAR_FORMATS:
+        spool.close()
+        raise ValidationError('Avatars must be JPEG, PNG, WebP or GIF images.')
+    if max(width, height) > MAX_AVATAR_DIMENSION:
+        spool.close()
+        raise ValidationError(f'Avatars can be at most {MAX_AVATAR_DIMENSION} pixels on a side.')
+
+    spool.seek(0)
+    # The storage names the file by content; only the extension is kept
+    return File(spool, name=f'avatar.{AVATAR_FORMATS[image_format]}')
+
+
+def _variant_name(source_name, size):
+    directory, filename = os.path.split(source_name)
+    stem = os.path.splitext(filename)[0]
+    return f'{directory}/{VARIANT_DIR}/{stem}-{size}.webp'
+
+
+def generate_variants(avatar_file):
+    """
+    Write square WebP variants of avatar_file (a FieldFile) to its storage.
+
+    Returns the dict to store in Profile.avatar_variants.
+    """
+    storage = avatar_file.storage
+    variants = {'source': avatar_file.name}
+    with avatar_file.open('rb') as f, Image.open(f) as image:
+        # JPEGs are downscaled while decoding
+        image.draft('RGB', (AVATAR_SIZES[-1], AVATAR_SIZES[-1]))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        try:
+            for size in AVATAR_SIZES:
+                # Center-crop to a square; small uploads are never upscaled
+                side = min(size, image.width, image.height)
+                square = ImageOps.fit(image, (side, side), Image.LANCZOS)
+                buffer = io.BytesIO()
+                square.save(buffer, 'WEBP', quality=VARIANT_QUALITY)
+                variants[str(size)] = storage.save(
+                    _variant_name(avatar_file.name, size), ContentFile(buffer.getvalue())
+                )
+        except Exception:
+            # Files may be shared, so leave what was written to gc_media
+            media.register(variant_files(variants))
+            raise
+    return variants
+
+
+def variant_files(variants):
+    """Storage names of every variant listed in an avatar_variants dict"""
+    for size in AVATAR_SIZES:
+        name = (variants or {}).get(str(size))
+        if name:
+            yield name
+
+
+def variant_url(profile, size):
+    """URL of the smallest avatar variant at least size px wide, else the upload"""
+    variants = profile.avatar_variants
+    if variants.get('source') == profile.avatar.name:
+        for variant_size in AVATAR_SIZES:
+            if variant_size >= size and variants.get(str(variant_size)):
+                return profile.avatar.storage.url(variants[str(variant_size)])
+    return profile.avatar.url
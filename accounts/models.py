@@ -1,12 +1,24 @@
+import logging
+
 from django.db import models
+from django.db.models import Sum
 from django.contrib.auth.models import User
 from django.urls import reverse
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
+from PIL import Image
+from freespaces import background
+from posts import card_cache, media, page_cache
+from posts.tracking import ChangeTrackingMixin
+from . import avatars
 import re
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_AVATAR = 'profile_pics/default.jpg'
+
 # Username validation
 PROHIBITED_USERNAMES = [
     'admin', 'root', 'system', 'support', 'api', 'www', 'mail', 'ftp',
@@ -35,7 +47,7 @@ def validate_username(username):
 
     return clean_username
 
-class Profile(models.Model):
+class Profile(ChangeTrackingMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
 
     # OAuth fields
@@ -46,9 +58,11 @@ class Profile(models.Model):
     bio = models.TextField(max_length=500, blank=True)
     avatar = models.ImageField(
         upload_to='profile_pics/',
-        default='profile_pics/default.jpg',
+        default=DEFAULT_AVATAR,
         blank=True
     )
+    # Square resized copies of avatar, built in the background (see accounts/avatars.py)
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     website = models.URLField(blank=True)
     location = models.CharField(max_length=100, blank=True)
 
@@ -75,11 +89,33 @@ class Profile(models.Model):
         return f"@{self.user.username}"
 
     def save(self, *args, **kwargs):
-        """Override save to validate username"""
+        """Override save to validate username; only changed fields are written"""
         if self.user.username:
             # Validate username when saving
             validate_username(self.user.username)
+
+        # A new avatar invalidates its variants; new ones are built once
+        # the save commits
+        update_fields = kwargs.get('update_fields')
+        if (
+            update_fields is None or 'avatar' in update_fields
+        ) and self.has_changed('avatar'):
+            self._build_avatar_variants = True
+            self.avatar_variants = {}
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'avatar_variants'}
         super().save(*args, **kwargs)
+
+    # Fields naming stored files, counted in posts.media
+    MEDIA_FIELDS = ['avatar', 'avatar_variants']
+
+    @staticmethod
+    def media_files(values):
+        """Storage names referenced by avatar and avatar_variants in values"""
+        # The shared default avatar is not counted; gc_media never collects field defaults
+        if values.get('avatar') and values['avatar'] != DEFAULT_AVATAR:
+            yield values['avatar']
+        yield from avatars.variant_files(values.get('avatar_variants'))
     
     @property
     def posts_count(self):
@@ -87,7 +123,71 @@ class Profile(models.Model):
     
     @property
     def likes_received(self):
-        return sum(post.likes.count() for post in self.user.posts.filter(status='published'))
+        total = self.user.posts.filter(status='published').aggregate(total=Sum('like_count'))['total']
+        return total or 0
+
+def build_avatar_variants(profile_id):
+    """Generate the avatar variants of one profile; run in the background"""
+    profile = Profile.objects.filter(pk=profile_id).only('id', 'user_id', 'avatar', 'avatar_variants').first()
+    if profile is None or not profile.avatar or profile.avatar.name == DEFAULT_AVATAR:
+        return
+    source = profile.avatar.name
+    if profile.avatar_variants.get('source') == source:
+        return
+
+    try:
+        variants = avatars.generate_variants(profile.avatar)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning('Could not build avatar variants for profile %s from %s', profile_id, source, exc_info=True)
+        # Recorded with no variants, so templates keep using the upload
+        variants = {'source': source}
+
+    # Skip storing if the avatar was replaced meanwhile; that save queued
+    # its own build, and gc_media collects these files
+    new_files = list(avatars.variant_files(variants))
+    if not Profile.objects.filter(pk=profile_id, avatar=source).update(avatar_variants=variants):
+        media.register(new_files)
+        return
+    # update() skips the signals that keep reference counts
+    media.update_references(avatars.variant_files(profile.avatar_variants), new_files)
+    # update() skips the signals that normally invalidate rendered pages
+    invalidate_author_pages(profile.user_id)
+
+def invalidate_author_pages(user_id):
+    card_cache.bump_author(user_id)
+    page_cache.bump()
+
+# Cached post cards and anonymous pages show the author's avatar and
+# username. A profile save that changes nothing is skipped, so the profile
+# save that follows every User save (see save_user_profile below) only
+# invalidates when the profile really changed
+@receiver(post_save, sender=Profile)
+def invalidate_author_post_cards(sender, instance, **kwargs):
+    invalidate_author_pages(instance.user_id)
+
+@receiver(post_save, sender=Profile)
+def schedule_avatar_variants(sender, instance, **kwargs):
+    if not instance.__dict__.pop('_build_avatar_variants', False):
+        return
+    if instance.avatar and instance.avatar.name != DEFAULT_AVATAR:
+        background.submit_on_commit(build_avatar_variants, instance.pk)
+
+# Count references to stored files; see posts/media.py
+@receiver(post_save, sender=Profile)
+def update_profile_media_references(sender, instance, **kwargs):
+    before, after = media.instance_files(instance, Profile.MEDIA_FIELDS, Profile.media_files)
+    media.update_references(before, after)
+
+@receiver(post_delete, sender=Profile)
+def release_profile_media(sender, instance, **kwargs):
+    _, after = media.instance_files(instance, Profile.MEDIA_FIELDS, Profile.media_files)
+    media.release(after)
+
+@receiver(post_save, sender=User)
+def invalidate_author_post_cards_on_rename(sender, instance, created, update_fields, **kwargs):
+    # Logins save the user with update_fields=['last_login']
+    if not created and (update_fields is None or 'username' in update_fields):
+        invalidate_author_pages(instance.pk)
 
 # Signal to create profile when user is created
 @receiver(post_save, sender=User)
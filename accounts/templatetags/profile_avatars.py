@@ -0,0 +1,16 @@
+from django import template
+from accounts import avatars
+
+register = template.Library()
+
+
+@register.simple_tag
+def avatar_url(profile, size):
+    """
+    URL of a profile's avatar for display at about size px.
+
+    Serves the smallest resized variant (40, 80 or 256 px) that is at least
+    size wide, or the uploaded file until the variants exist. Callers
+    handle profiles without an avatar.
+    """
+    return avatars.variant_url(profile, int(size))
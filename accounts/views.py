@@ -15,6 +15,10 @@ from .forms import (
     AvatarUpdateForm, NameUpdateForm, BioUpdateForm, SocialLinksUpdateForm,
     UsernameUpdateForm
 )
+from freespaces.query_budget import query_budget
+from interactions import likes
+from interactions.models import liked_post_ids
+from .avatars import decode_data_url
 from .models import Profile, validate_username
 
 # OAuth and Profile Setup Views
@@ -77,28 +81,8 @@ def profile_setup(request):
 
                     # Handle cropped profile image if provided
                     if 'profile_image_data' in request.POST:
-                        import base64
-                        from django.core.files.base import ContentFile
-                        from django.core.files.storage import default_storage
-                        import uuid
-
                         try:
-                            # Get base64 image data
-                            image_data = request.POST['profile_image_data']
-                            format, imgstr = image_data.split(';base64,')
-                            ext = format.split('/')[-1]
-
-                            # Create file from base64 data
-                            data = ContentFile(base64.b64decode(imgstr))
-                            filename = f"{uuid.uuid4()}.{ext}"
-
-                            # Delete old avatar if it exists and is not default
-                            if profile.avatar and 'default.jpg' not in profile.avatar.name:
-                                profile.avatar.delete()
-
-                            # Save new avatar
-                            profile.avatar.save(filename, data, save=True)
-
+                            save_cropped_avatar(profile, request.POST['profile_image_data'])
                         except Exception as e:
                             messages.warning(request, 'Profile created successfully, but there was an issue with the profile picture.')
 
@@ -203,6 +187,7 @@ def update_username(request):
 
 # Legacy registration view removed - OAuth-only authentication
 
+@query_budget(14)
 def profile(request, username=None):
     """User profile view"""
     if username:
@@ -213,9 +198,21 @@ def profile(request, username=None):
         user = request.user
     
     profile, created = Profile.objects.get_or_create(user=user)
-    
+
+    # Visitors only see published posts; the owner also sees drafts
+    posts = user.posts.select_related('category').defer('content', 'content_html').order_by('-created_at')
+    if request.user != user:
+        posts = posts.filter(status='published')
+    posts = list(posts)
+    # Counts include likes still waiting for a write-behind flush
+    likes.merge_pending_likes(posts)
+
     # Create forms for inline editing (only for own profile)
-    context = {'profile': profile}
+    context = {
+        'profile': profile,
+        'posts': posts,
+        'liked_post_ids': liked_post_ids(request.user, posts),
+    }
     if request.user == user:
         context.update({
             'avatar_form': AvatarUpdateForm(instance=profile),
@@ -251,6 +248,21 @@ def edit_profile(request):
     }
     return render(request, 'accounts/edit_profile.html', context)
 
+def save_cropped_avatar(profile, data_url):
+    """
+    Replace a profile's avatar with a cropped image posted as a data URL.
+
+    Only decoding and a header check happen here; the resized variants are
+    built in the background after the save commits.
+    """
+    upload = decode_data_url(data_url)
+    try:
+        # The old file may be shared with other uploads; saving releases
+        # this profile's reference and gc_media deletes it once unused
+        profile.avatar.save(upload.name, upload, save=True)
+    finally:
+        upload.close()
+
 @login_required
 def update_avatar(request):
     """Update user avatar"""
@@ -259,29 +271,12 @@ def update_avatar(request):
         
         # Handle cropped image data
         if 'cropped_image' in request.POST:
-            import base64
-            from django.core.files.base import ContentFile
-            from django.core.files.storage import default_storage
-            import uuid
-            
             try:
-                # Get base64 image data
-                image_data = request.POST['cropped_image']
-                format, imgstr = image_data.split(';base64,')
-                ext = format.split('/')[-1]
-                
-                # Create file from base64 data
-                data = ContentFile(base64.b64decode(imgstr))
-                filename = f"{uuid.uuid4()}.{ext}"
-                
-                # Delete old avatar if it exists and is not default
-                if profile.avatar and 'default.jpg' not in profile.avatar.name:
-                    profile.avatar.delete()
-                
-                # Save new avatar
-                profile.avatar.save(filename, data, save=True)
+                save_cropped_avatar(profile, request.POST['cropped_image'])
                 messages.success(request, 'Avatar updated successfully!')
-                
+
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
             except Exception as e:
                 messages.error(request, 'Error processing image.')
         else:
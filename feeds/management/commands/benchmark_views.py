@@ -0,0 +1,159 @@
+import json
+import math
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from freespaces.query_budget import QueryRecorder
+from freespaces.query_plans import recorded_plan_problems
+from posts.models import Post
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Time the main views through the test client and report latency, queries and memory as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30,
+                            help='Timed requests per view')
+        parser.add_argument('--warmup', type=int, default=3,
+                            help='Untimed requests per view before measuring')
+        parser.add_argument('--username',
+                            help='User to log in as (default: the author with the most posts)')
+        parser.add_argument('--query', default='light',
+                            help='Search query for the search view')
+        parser.add_argument('--cold-cache', action='store_true',
+                            help='Clear the cache before every request')
+        parser.add_argument('--views', nargs='+',
+                            help='Only run these views (names as in the report)')
+        parser.add_argument('--explain', action='store_true',
+                            help='EXPLAIN every query of each view and fail on full scans or filesorts')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        post = (
+            Post.objects.filter(status='published')
+            .order_by('-comment_count', '-like_count').only('id', 'slug', 'author_id').first()
+        )
+        if post is None:
+            raise CommandError('No published posts; run generate_dataset first')
+
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+            if user is None:
+                raise CommandError(f'No user named "{options["username"]}"')
+        else:
+            user = User.objects.get(pk=post.author_id)
+
+        views = {
+            'home': reverse('feeds:home'),
+            'search': reverse('feeds:search') + f'?q={options["query"]}',
+            'post_detail': post.get_absolute_url(),
+            'get_comments': reverse('interactions:get_comments', kwargs={'post_id': post.id}),
+            'profile': reverse('accounts:profile', kwargs={'username': user.username}),
+        }
+        if options['views']:
+            unknown = set(options['views']) - set(views)
+            if unknown:
+                raise CommandError(f'Unknown views: {", ".join(sorted(unknown))}')
+            views = {name: url for name, url in views.items() if name in options['views']}
+
+        client = Client()
+        client.force_login(user)
+
+        report = {
+            'commit': git_commit(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'cold_cache': options['cold_cache'],
+            'username': user.username,
+            'views': {},
+        }
+        for name, url in views.items():
+            report['views'][name] = self._measure(client, url, options)
+            self.stderr.write(f'{name}: {report["views"][name]["p50_ms"]} ms p50')
+            if options['explain']:
+                report['views'][name]['plan_problems'] = self._explain(client, url)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+        failing = [name for name, result in report['views'].items() if result.get('plan_problems')]
+        if failing:
+            raise CommandError(f'Queries without a usable index in: {", ".join(failing)}')
+
+    def _get(self, client, url, cold_cache):
+        if cold_cache:
+            cache.clear()
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'GET {url} returned {response.status_code}')
+        return response
+
+    def _explain(self, client, url):
+        # Cold cache, so the queries a cache miss runs are the ones explained
+        with QueryRecorder() as recorder:
+            self._get(client, url, cold_cache=True)
+        return [
+            {'sql': sql, 'problems': problems}
+            for sql, problems in recorded_plan_problems(recorder)
+        ]
+
+    def _measure(self, client, url, options):
+        cold_cache = options['cold_cache']
+        for _ in range(options['warmup']):
+            self._get(client, url, cold_cache)
+
+        timings = []
+        query_counts = []
+        for _ in range(options['iterations']):
+            with QueryRecorder() as recorder:
+                start = time.perf_counter()
+                self._get(client, url, cold_cache)
+                timings.append((time.perf_counter() - start) * 1000)
+            query_counts.append(len(recorder))
+
+        # tracemalloc slows everything down, so memory gets its own request
+        tracemalloc.start()
+        try:
+            self._get(client, url, cold_cache)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'url': url,
+            'p50_ms': round(percentile(timings, 0.50), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'queries': int(statistics.median(query_counts)),
+            'max_queries': max(query_counts),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
@@ -0,0 +1,218 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from accounts.models import Profile
+from interactions.models import Comment, Like, fill_root_paths
+from posts import category_registry
+from posts.models import Category, Post
+
+CATEGORY_NAMES = [
+    'Photography', 'Web Design', 'Workspace', 'Art & Design', 'Lifestyle',
+    'Food & Cooking', 'Cafe', 'Travel', 'Music', 'Fitness', 'Health',
+    'Gaming', 'Books', 'Technology', 'Fashion', 'Business', 'Education',
+]
+
+WORDS = (
+    'light morning street coffee window city quiet studio desk color paper '
+    'river mountain sketch brush canvas recipe garden market journey train '
+    'notebook camera lens shadow sunset ocean forest music rhythm melody '
+    'design layout pixel grid typography code project idea draft story '
+    'travel summer winter autumn spring weekend friends family simple small '
+    'warm bright soft calm wild open slow fresh old new golden hidden local'
+).split()
+
+MAX_COMMENTS_PER_POST = 500
+
+COMMENTS = [
+    'Love this!', 'Beautiful work.', 'Thanks for sharing.', 'This is so inspiring.',
+    'Where was this taken?', 'Great read, saved it for later.', 'Stunning colors.',
+    'I tried this and it worked for me too.', 'More posts like this please!',
+]
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate synthetic users, categories, posts, likes and comments for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--likes', type=int, default=100000,
+                            help='Approximate total; likes per post follow a skewed distribution')
+        parser.add_argument('--comments', type=int, default=30000,
+                            help='Approximate total, distributed like likes')
+        parser.add_argument('--categories', type=int, default=len(CATEGORY_NAMES))
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Rows per bulk insert')
+        parser.add_argument('--prefix', default='synth',
+                            help='Prefix for generated usernames and slugs; must be unused')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed, so the same arguments give the same dataset')
+        parser.add_argument('--skip-search-index', action='store_true',
+                            help='Do not rebuild search documents and related posts afterwards')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.prefix = options['prefix']
+        self.random = random.Random(options['seed'])
+
+        if User.objects.filter(username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(f'Users prefixed "{self.prefix}_" already exist; pass another --prefix')
+
+        started = time.monotonic()
+        user_ids = self._create_users(options['users'])
+        category_ids = self._create_categories(options['categories'])
+        if not user_ids or not category_ids:
+            raise CommandError('At least one user and one category are needed')
+
+        avg_likes = options['likes'] / max(options['posts'], 1)
+        avg_comments = options['comments'] / max(options['posts'], 1)
+        totals = self._create_posts(options['posts'], user_ids, category_ids, avg_likes, avg_comments)
+
+        # bulk_create skips signals, so refresh everything they maintain
+        call_command('reconcile_category_counts', stdout=self.stdout)
+        if not options['skip_search_index']:
+            call_command('rebuild_search_index', batch_size=self.batch_size, stdout=self.stdout)
+            # Content similarity is looked up in the search index
+            call_command('rebuild_related_posts', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(user_ids)} users, {totals["posts"]} posts, {totals["likes"]} likes '
+            f'and {totals["comments"]} comments in {time.monotonic() - started:.1f}s.'
+        ))
+
+    def _create_users(self, count):
+        # Hashing once keeps user creation fast; every synthetic user shares it
+        password = make_password('benchmark')
+        user_ids = []
+        for start in range(0, count, self.batch_size):
+            usernames = [f'{self.prefix}_{n}' for n in range(start, min(start + self.batch_size, count))]
+            with transaction.atomic():
+                User.objects.bulk_create(
+                    [User(username=name, email=f'{name}@example.com', password=password) for name in usernames]
+                )
+                # Not every backend returns primary keys from bulk_create
+                ids = list(User.objects.filter(username__in=usernames).values_list('id', flat=True))
+                Profile.objects.bulk_create([
+                    Profile(user_id=user_id, bio=self._sentence(12), profile_setup_complete=True)
+                    for user_id in ids
+                ])
+            user_ids.extend(ids)
+            self.stdout.write(f'Users: {len(user_ids)}/{count}')
+        return user_ids
+
+    def _create_categories(self, count):
+        names = CATEGORY_NAMES[:count] + [f'Topic {n}' for n in range(len(CATEGORY_NAMES), count)]
+        existing = set(Category.objects.filter(name__in=names).values_list('name', flat=True))
+        Category.objects.bulk_create([Category(name=name) for name in names if name not in existing])
+        # bulk_create skips the signals that refresh the category registry
+        category_registry.bump()
+        return list(Category.objects.filter(name__in=names).values_list('id', flat=True))
+
+    def _count(self, average, limit):
+        """Skewed per-post count: most posts get a few, some get many"""
+        if average <= 0:
+            return 0
+        return min(limit, round(self.random.expovariate(1 / average)))
+
+    def _sentence(self, words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+    def _html_content(self):
+        blocks = []
+        for _ in range(self.random.randint(3, 8)):
+            kind = self.random.random()
+            if kind < 0.15:
+                blocks.append(f'<h2>{self._sentence(4)}</h2>')
+            elif kind < 0.25:
+                items = ''.join(f'<li>{self._sentence(5)}</li>' for _ in range(self.random.randint(2, 5)))
+                blocks.append(f'<ul>{items}</ul>')
+            else:
+                sentences = [self._sentence(self.random.randint(8, 20)) for _ in range(self.random.randint(2, 6))]
+                sentences[0] = f'<strong>{sentences[0]}</strong>'
+                blocks.append(f'<p>{" ".join(sentences)}</p>')
+        return ''.join(blocks)
+
+    def _create_posts(self, count, user_ids, category_ids, avg_likes, avg_comments):
+        totals = {'posts': 0, 'likes': 0, 'comments': 0}
+        # A few categories hold most of the posts, like real tags do
+        category_weights = [1 / (rank + 1) for rank in range(len(category_ids))]
+
+        for start in range(0, count, self.batch_size):
+            posts = []
+            for n in range(start, min(start + self.batch_size, count)):
+                title = self._sentence(self.random.randint(3, 8)).rstrip('.')
+                status = 'published' if self.random.random() < 0.9 else 'draft'
+                post = Post(
+                    title=title,
+                    slug=f'{slugify(title)[:200]}-{self.prefix}-{n}',
+                    content=self._html_content(),
+                    author_id=self.random.choice(user_ids),
+                    category_id=self.random.choices(category_ids, category_weights)[0],
+                    status=status,
+                    published_at=timezone.now() if status == 'published' else None,
+                )
+                post.render_content()
+                post.refresh_content_metadata()
+                if status == 'published':
+                    # Counters are set up front to match the rows inserted below
+                    post.like_count = self._count(avg_likes, len(user_ids))
+                    post.comment_count = self._count(avg_comments, MAX_COMMENTS_PER_POST)
+                posts.append(post)
+
+            with transaction.atomic():
+                Post.objects.bulk_create(posts)
+                if posts[0].pk is None:
+                    slugs = {post.slug: post for post in posts}
+                    for post_id, slug in Post.objects.filter(slug__in=slugs).values_list('id', 'slug'):
+                        slugs[slug].pk = post_id
+                totals['likes'] += self._create_likes(posts, user_ids)
+                totals['comments'] += self._create_comments(posts, user_ids)
+
+            totals['posts'] += len(posts)
+            self.stdout.write(
+                f'Posts: {totals["posts"]}/{count}, likes: {totals["likes"]}, comments: {totals["comments"]}'
+            )
+        return totals
+
+    def _create_likes(self, posts, user_ids):
+        created = 0
+        likes = []
+        for post in posts:
+            # Distinct users, so the (user, post) unique constraint always holds
+            for user_id in self.random.sample(user_ids, post.like_count):
+                likes.append(Like(user_id=user_id, post_id=post.pk))
+            if len(likes) >= self.batch_size:
+                Like.objects.bulk_create(likes)
+                created += len(likes)
+                likes = []
+        Like.objects.bulk_create(likes)
+        return created + len(likes)
+
+    def _create_comments(self, posts, user_ids):
+        created = 0
+        comments = []
+        for post in posts:
+            for _ in range(post.comment_count):
+                comments.append(Comment(
+                    user_id=self.random.choice(user_ids),
+                    post_id=post.pk,
+                    content=self.random.choice(COMMENTS),
+                ))
+            if len(comments) >= self.batch_size:
+                self._insert_comments(comments)
+                created += len(comments)
+                comments = []
+        self._insert_comments(comments)
+        return created + len(comments)
+
+    def _insert_comments(self, comments):
+        Comment.objects.bulk_create(comments)
+        fill_root_paths({comment.post_id for comment in comments})
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from posts import page_cache
+from posts.models import Post
+from feeds import related
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related posts list of every published post'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Number of posts loaded and updated per batch')
+        parser.add_argument('--missing-only', action='store_true',
+                            help='Only compute lists for posts that have none yet')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        posts = Post.objects.filter(status='published')
+        if options['missing_only']:
+            posts = posts.filter(related_ranking=[])
+
+        total = 0
+        last_id = 0
+        while True:
+            # Walk the table in primary key order so every batch is a range scan
+            batch = list(
+                posts.filter(id__gt=last_id).order_by('id')
+                .only('id', 'title', 'excerpt', 'author_id', 'category_id', 'related_ranking')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            # Every list is recomputed, so nothing is merged into neighbours
+            for post in batch:
+                post.related_ranking = related.compute_related(post)
+            Post.objects.bulk_update(batch, ['related_ranking'])
+            total += len(batch)
+            self.stdout.write(f'Computed {total} posts...')
+
+        page_cache.bump()
+        self.stdout.write(self.style.SUCCESS(f'Computed related posts for {total} published posts.'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from posts.models import Post
+from feeds.models import SearchDocument
+from feeds import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search documents for all published posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of documents written per bulk insert')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        SearchDocument.objects.all().delete()
+        search.reset_index()
+
+        posts = Post.objects.filter(status='published').select_related('category')
+        batch = []
+        total = 0
+        for post in posts.iterator(chunk_size=batch_size):
+            batch.append(SearchDocument(
+                post_id=post.pk,
+                title=post.title,
+                category=post.category.name if post.category_id else '',
+                body=search.html_to_text(post.content),
+            ))
+            if len(batch) >= batch_size:
+                SearchDocument.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+                self.stdout.write(f'Indexed {total} posts...')
+
+        SearchDocument.objects.bulk_create(batch)
+        total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} published posts.'))
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.4 on 2026-10-17 22:51
+
+import html
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+
+def html_to_text(content):
+    """Frozen copy of posts.text.html_to_text as of this migration"""
+    text = html.unescape(strip_tags(content or ''))
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def add_fulltext_indexes(apps, schema_editor):
+    """FULLTEXT indexes only exist on MySQL; other backends use the Python index"""
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute(
+        'CREATE FULLTEXT INDEX feeds_searchdoc_ft ON feeds_searchdocument (title, category, body)'
+    )
+    schema_editor.execute(
+        'CREATE FULLTEXT INDEX feeds_searchdoc_title_ft ON feeds_searchdocument (title)'
+    )
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute('DROP INDEX feeds_searchdoc_ft ON feeds_searchdocument')
+    schema_editor.execute('DROP INDEX feeds_searchdoc_title_ft ON feeds_searchdocument')
+
+
+def populate_search_documents(apps, schema_editor):
+    """Index the posts that were published before search documents existed"""
+    Post = apps.get_model('posts', 'Post')
+    SearchDocument = apps.get_model('feeds', 'SearchDocument')
+
+    posts = Post.objects.filter(status='published').select_related('category')
+    batch = []
+    for post in posts.iterator(chunk_size=500):
+        batch.append(SearchDocument(
+            post_id=post.pk,
+            title=post.title,
+            category=post.category.name if post.category else '',
+            body=html_to_text(post.content),
+        ))
+        if len(batch) >= 500:
+            SearchDocument.objects.bulk_create(batch)
+            batch = []
+    SearchDocument.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('posts', '0007_post_like_count_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='posts.post')),
+                ('title', models.CharField(max_length=200)),
+                ('category', models.CharField(blank=True, max_length=50)),
+                ('body', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(add_fulltext_indexes, drop_fulltext_indexes),
+        migrations.RunPython(populate_search_documents, migrations.RunPython.noop),
+    ]
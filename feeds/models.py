@@ -1,3 +1,55 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from freespaces import background
+from posts.models import Post, Category
+from . import related, search
 
 # Create your models here.
+class SearchDocument(models.Model):
+    """Plain-text copy of a published post, indexed for full-text search"""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    title = models.CharField(max_length=200)
+    category = models.CharField(max_length=50, blank=True)
+    body = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.title
+
+
+# Keep the search index in step with posts and categories
+# Fields a search document is built from
+INDEXED_POST_FIELDS = {'title', 'content', 'category', 'status'}
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, update_fields, **kwargs):
+    # Post saves write only changed columns; skip edits that leave the
+    # document as it is
+    if update_fields is not None and not INDEXED_POST_FIELDS & set(update_fields):
+        return
+    search.index_post(instance)
+
+# Related lists are built from the same fields, once the search document
+# they are matched against is in place
+@receiver(post_save, sender=Post)
+def schedule_related_posts(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and not INDEXED_POST_FIELDS & set(update_fields):
+        return
+    if instance.status == 'published':
+        background.submit_on_commit(related.refresh_related_posts, instance.pk)
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+@receiver(post_save, sender=Category)
+def reindex_renamed_category(sender, instance, created, **kwargs):
+    if not created:
+        SearchDocument.objects.filter(post__category=instance).update(category=instance.name)
+        search.reset_index()
+
+@receiver(pre_delete, sender=Category)
+def unindex_deleted_category(sender, instance, **kwargs):
+    # Posts keep existing with category set to NULL
+    SearchDocument.objects.filter(post__category=instance).update(category='')
+    search.reset_index()
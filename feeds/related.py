@@ -0,0 +1,114 @@
+"""
+Related posts for the post detail page.
+
+Every published post stores a short ranked list of related posts in
+Post.related_ranking, as [[post_id, score], ...] (at most RELATED_STORED).
+A list is computed from a bounded set of candidates:
+
+- the author's AUTHOR_CANDIDATES latest published posts,
+- the category's CATEGORY_CANDIDATES latest published posts,
+- the SIMILAR_CANDIDATES posts whose search documents are most similar to
+  the post's title and excerpt (TF-IDF, see feeds.search.similar_posts),
+
+each scored by WEIGHTS. Lists are computed in the background when a post is
+published or edited (see feeds/models.py), and the post is then merged into
+the lists of the posts it ranked, so existing lists pick up new posts
+without recomputing the whole site. Posts that were unpublished or deleted
+are dropped when a list is read; rebuild_related_posts recomputes
+everything.
+"""
+from posts import page_cache
+from posts.models import Post
+from . import search
+
+# How much sharing the author, sharing the category, and content
+# similarity (0..1) add to a candidate's score
+WEIGHTS = {
+    'author': 0.3,
+    'category': 0.2,
+    'content': 0.5,
+}
+
+RELATED_SHOWN = 4
+# Stored beyond what is shown, so a few unpublished entries leave no gap
+RELATED_STORED = 8
+
+AUTHOR_CANDIDATES = 20
+CATEGORY_CANDIDATES = 20
+SIMILAR_CANDIDATES = 30
+
+
+def compute_related(post):
+    """Ranked [[post_id, score], ...] for post, best first"""
+    published = Post.objects.filter(status='published').exclude(pk=post.pk)
+    candidate_ids = set(
+        published.filter(author_id=post.author_id)
+        .order_by('-created_at').values_list('id', flat=True)[:AUTHOR_CANDIDATES]
+    )
+    if post.category_id:
+        candidate_ids.update(
+            published.filter(category_id=post.category_id)
+            .order_by('-created_at').values_list('id', flat=True)[:CATEGORY_CANDIDATES]
+        )
+    similarity = dict(search.similar_posts(f'{post.title} {post.excerpt}', SIMILAR_CANDIDATES + 1))
+    similarity.pop(post.pk, None)
+    candidate_ids.update(similarity)
+
+    scored = []
+    for post_id, author_id, category_id in published.filter(id__in=candidate_ids).values_list(
+        'id', 'author_id', 'category_id'
+    ):
+        score = (
+            WEIGHTS['author'] * (author_id == post.author_id)
+            + WEIGHTS['category'] * (category_id is not None and category_id == post.category_id)
+            + WEIGHTS['content'] * similarity.get(post_id, 0)
+        )
+        scored.append((round(score, 4), post_id))
+    # Newer posts (higher ids) win ties
+    scored.sort(reverse=True)
+    return [[post_id, score] for score, post_id in scored[:RELATED_STORED]]
+
+
+def _merge(ranking, post_id, score):
+    ranking = [entry for entry in ranking if entry[0] != post_id] + [[post_id, score]]
+    ranking.sort(key=lambda entry: (-entry[1], -entry[0]))
+    return ranking[:RELATED_STORED]
+
+
+def refresh_related_posts(post_id):
+    """Recompute one post's related list and offer it to the posts it ranked; run in the background"""
+    post = (
+        Post.objects.filter(pk=post_id, status='published')
+        .only('id', 'title', 'excerpt', 'author_id', 'category_id').first()
+    )
+    if post is None:
+        return
+    ranking = compute_related(post)
+    Post.objects.filter(pk=post_id).update(related_ranking=ranking)
+
+    # Scores are close enough to symmetric to reuse for the other side
+    scores = dict(ranking)
+    neighbours = list(Post.objects.filter(id__in=scores).only('id', 'related_ranking'))
+    changed = []
+    for neighbour in neighbours:
+        merged = _merge(neighbour.related_ranking, post_id, scores[neighbour.id])
+        if merged != neighbour.related_ranking:
+            neighbour.related_ranking = merged
+            changed.append(neighbour)
+    Post.objects.bulk_update(changed, ['related_ranking'])
+
+    # update() and bulk_update() skip the signals that bump cached pages
+    page_cache.bump()
+
+
+def related_posts_for(post, limit=RELATED_SHOWN):
+    """Up to limit published posts related to post, in ranked order; one query"""
+    related = Post.objects.filter(status='published').select_related('category').defer('content', 'content_html')
+    ids = [post_id for post_id, _ in post.related_ranking]
+    if not ids:
+        # Not computed yet: fall back to the author's latest posts
+        return list(related.filter(author_id=post.author_id).exclude(pk=post.pk).order_by('-created_at')[:limit])
+
+    # At most RELATED_STORED rows by primary key; ranked here rather than sorted by the database
+    by_id = related.order_by().in_bulk(ids)
+    return [by_id[post_id] for post_id in ids if post_id in by_id][:limit]
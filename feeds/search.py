@@ -0,0 +1,280 @@
+"""
+Full-text search over published posts.
+
+Every published post has a plain-text SearchDocument row (title, category
+name and tag-stripped content), refreshed by signals in feeds/models.py.
+On MySQL the rows are queried with a FULLTEXT index; on other databases
+(SQLite in development and tests) an in-process inverted index is built
+from the same rows on first use and then kept up to date incrementally.
+"""
+import heapq
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from posts.text import html_to_text
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Relative weight of a term found in each field of a document
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'category': 2.0,
+    'body': 1.0,
+}
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens"""
+    return TOKEN_RE.findall(text.lower())
+
+
+class InvertedIndex:
+    """
+    Pure-Python term -> {post_id: weight} index with TF-IDF ranking.
+
+    Used where the database has no native full-text search. Query terms must
+    all match (like MySQL boolean mode with '+'); the last term also matches
+    as a prefix so results update while the user is still typing.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._vocabulary = []
+        self.built = False
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._vocabulary = []
+            self.built = False
+
+    def build(self, documents):
+        """Load (post_id, title, category, body) rows unless already built"""
+        with self._lock:
+            if self.built:
+                return
+            for post_id, title, category, body in documents:
+                self.add(post_id, title, category, body)
+            self.built = True
+
+    def add(self, post_id, title, category, body):
+        """Index (or re-index) one document"""
+        weights = defaultdict(float)
+        for field, text in (('title', title), ('category', category), ('body', body)):
+            for term in tokenize(text):
+                weights[term] += FIELD_WEIGHTS[field]
+
+        with self._lock:
+            self._remove_locked(post_id)
+            for term, weight in weights.items():
+                if term not in self._postings:
+                    insort(self._vocabulary, term)
+                self._postings[term][post_id] = weight
+            self._doc_terms[post_id] = list(weights)
+
+    def remove(self, post_id):
+        with self._lock:
+            self._remove_locked(post_id)
+
+    def _remove_locked(self, post_id):
+        for term in self._doc_terms.pop(post_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(post_id, None)
+            if not postings:
+                del self._postings[term]
+                index = bisect_left(self._vocabulary, term)
+                if index < len(self._vocabulary) and self._vocabulary[index] == term:
+                    del self._vocabulary[index]
+
+    def _expand_prefix(self, prefix):
+        """All indexed terms starting with prefix, found by bisecting the vocabulary"""
+        start = bisect_left(self._vocabulary, prefix)
+        terms = []
+        for term in self._vocabulary[start:]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, query):
+        """Return matching post ids ordered by descending relevance"""
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            total_docs = len(self._doc_terms) or 1
+            scores = None
+            for position, term in enumerate(terms):
+                is_last = position == len(terms) - 1
+                candidates = self._expand_prefix(term) if is_last else [term]
+
+                term_scores = defaultdict(float)
+                for candidate in candidates:
+                    postings = self._postings.get(candidate, {})
+                    if not postings:
+                        continue
+                    idf = math.log(1 + total_docs / len(postings))
+                    for post_id, weight in postings.items():
+                        term_scores[post_id] += weight * idf
+
+                if scores is None:
+                    scores = term_scores
+                else:
+                    # Every term must match
+                    scores = {
+                        post_id: score + term_scores[post_id]
+                        for post_id, score in scores.items()
+                        if post_id in term_scores
+                    }
+                if not scores:
+                    return []
+
+        # Newer posts (higher ids) win ties
+        return [post_id for post_id, _ in sorted(scores.items(), key=lambda item: (-item[1], -item[0]))]
+
+    def similar(self, text, limit):
+        """
+        Top (post_id, score) pairs sharing any term with text, by TF-IDF.
+
+        Unlike search(), terms are OR-ed and not prefix-expanded, so a whole
+        title and excerpt can be passed as the query.
+        """
+        query_terms = set(tokenize(text))
+        with self._lock:
+            total_docs = len(self._doc_terms) or 1
+            scores = defaultdict(float)
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + total_docs / len(postings))
+                for post_id, weight in postings.items():
+                    scores[post_id] += weight * idf
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+
+
+_index = InvertedIndex()
+
+
+def uses_native_fulltext():
+    return connection.vendor == 'mysql'
+
+
+def _document_values(post):
+    return {
+        'title': post.title,
+        'category': post.category.name if post.category_id else '',
+        'body': html_to_text(post.content),
+    }
+
+
+def index_post(post):
+    """Create, refresh or drop the search document for a post"""
+    from .models import SearchDocument
+
+    if post.status != 'published':
+        remove_post(post.pk)
+        return
+
+    values = _document_values(post)
+    SearchDocument.objects.update_or_create(post_id=post.pk, defaults=values)
+    if _index.built:
+        _index.add(post.pk, **values)
+
+
+def remove_post(post_id):
+    from .models import SearchDocument
+
+    SearchDocument.objects.filter(post_id=post_id).delete()
+    if _index.built:
+        _index.remove(post_id)
+
+
+def reset_index():
+    """Drop the in-process index; it is rebuilt from the database on next use"""
+    _index.clear()
+
+
+def _ensure_index_built():
+    from .models import SearchDocument
+
+    if not _index.built:
+        documents = SearchDocument.objects.values_list('post_id', 'title', 'category', 'body')
+        _index.build(documents.iterator(chunk_size=2000))
+
+
+def _boolean_query(query):
+    """'+term1 +term2*' for MySQL boolean mode; the last term is a prefix match"""
+    terms = tokenize(query)
+    if not terms:
+        return ''
+    terms[-1] += '*'
+    return ' '.join(f'+{term}' for term in terms)
+
+
+def similar_posts(text, limit):
+    """
+    Up to limit (post_id, score) pairs of published posts most similar to
+    text, best first. Scores are relative to the best match (1.0).
+    """
+    from .models import SearchDocument
+
+    if not tokenize(text):
+        return []
+    if uses_native_fulltext():
+        # Natural language mode ranks by TF-IDF over any of the words
+        score = RawSQL('MATCH(title, category, body) AGAINST (%s IN NATURAL LANGUAGE MODE)', [text])
+        pairs = list(
+            SearchDocument.objects.annotate(score=score).filter(score__gt=0)
+            .order_by('-score', '-post_id').values_list('post_id', 'score')[:limit]
+        )
+    else:
+        _ensure_index_built()
+        pairs = _index.similar(text, limit)
+
+    if not pairs:
+        return []
+    best = pairs[0][1] or 1
+    return [(post_id, score / best) for post_id, score in pairs]
+
+
+def search_post_ids(query):
+    """
+    Ids of published posts matching query, most relevant first.
+
+    Returns a sliceable sequence (a values_list queryset on MySQL, a list
+    elsewhere) so callers can paginate it or use it in an ``id__in`` filter.
+    """
+    from .models import SearchDocument
+
+    if uses_native_fulltext():
+        boolean_query = _boolean_query(query)
+        if not boolean_query:
+            return SearchDocument.objects.none().values_list('post_id', flat=True)
+        score = RawSQL(
+            'MATCH(title, category, body) AGAINST (%s IN BOOLEAN MODE)'
+            ' + 2 * MATCH(title) AGAINST (%s IN BOOLEAN MODE)',
+            [boolean_query, boolean_query],
+        )
+        return (
+            SearchDocument.objects
+            .annotate(score=score)
+            .extra(where=['MATCH(title, category, body) AGAINST (%s IN BOOLEAN MODE)'], params=[boolean_query])
+            .order_by('-score', '-post_id')
+            .values_list('post_id', flat=True)
+        )
+
+    _ensure_index_built()
+    return _index.search(query)
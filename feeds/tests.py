@@ -1,3 +1,310 @@
-from django.test import TestCase
+import io
+import re
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from freespaces.query_budget import QueryBudgetMixin, QueryRecorder
+from freespaces.query_plans import ALLOWED_SCANS, QueryPlanMixin
+from interactions.models import Comment, Like
+from posts.models import Category, Post
+from posts.pagination import encode_cursor
+from . import related, search
+from .models import SearchDocument
+
+
+class FeedQueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'author_{i}', password='x') for i in range(4)]
+        category = Category.objects.create(name='Photography')
+        cls.posts = [
+            Post.objects.create(
+                title=f'Hello world {i}', content='<p>hello there</p>',
+                author=cls.users[i % 4], category=category, status='published',
+            )
+            for i in range(30)
+        ]
+        for post in cls.posts[-12:]:
+            for user in cls.users:
+                Like.objects.create(user=user, post=post)
+                Comment.objects.create(user=user, post=post, content='nice')
+
+    def setUp(self):
+        # Budgets must hold with a cold card cache
+        cache.clear()
+        self.client.force_login(self.users[0])
+
+    def test_home(self):
+        self.assertWithinQueryBudget(reverse('feeds:home'))
+
+    def test_home_page(self):
+        cursor = encode_cursor(self.posts[-13])
+        self.assertWithinQueryBudget(reverse('feeds:home_page'), data={'cursor': cursor})
+
+    def test_search(self):
+        self.assertWithinQueryBudget(reverse('feeds:search'), data={'q': 'hello'})
+
+    def test_anonymous_home(self):
+        self.client.logout()
+        self.assertWithinQueryBudget(reverse('feeds:home'))
+
+
+class QueryRecorderTests(TransactionTestCase):
+    def test_transaction_control_is_not_counted(self):
+        with QueryRecorder() as recorder:
+            for i in range(3):
+                with transaction.atomic():
+                    with transaction.atomic():
+                        pass
+            User.objects.count()
+        self.assertEqual(len(recorder), 1)
+        self.assertEqual(recorder.repeated_shapes(), [])
+
+
+class HomeFeedPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('writer', password='x')
+        cls.posts = [
+            Post.objects.create(title=f'Post {i}', content='<p>x</p>', author=author, status='published')
+            for i in range(30)
+        ]
+        Post.objects.create(title='Draft', content='<p>x</p>', author=author, status='draft')
+        # Same timestamp everywhere, so only the id tiebreak orders them
+        Post.objects.update(created_at=cls.posts[0].created_at)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('feeds:home_page')
+
+    def _ids(self, data):
+        return [int(i) for i in re.findall(r'class="like-container" data-post-id="(\d+)"', data['posts_html'])]
+
+    def test_cursor_pages_walk_every_post_once(self):
+        seen, params, pages = [], {}, 0
+        while True:
+            data = self.client.get(self.url, params).json()
+            seen.extend(self._ids(data))
+            pages += 1
+            if not data['has_next']:
+                self.assertIsNone(data['next_cursor'])
+                break
+            params = {'cursor': data['next_cursor']}
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, [post.id for post in reversed(self.posts)])
+
+    def test_malformed_cursor(self):
+        for cursor in ('not-a-cursor', '!!!', encode_cursor(self.posts[0])[:-3]):
+            response = self.client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+
+class InvertedIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = search.InvertedIndex()
+        self.index.build([
+            (1, 'Ramen in Tokyo', 'Food', 'noodles and broth'),
+            (2, 'Tokyo by night', 'Travel', 'neon streets and ramen stalls'),
+            (3, 'Baking bread', 'Food', 'flour water salt'),
+        ])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.index.search('tokyo ramen'), [1, 2])
+        self.assertEqual(self.index.search('tokyo bread'), [])
+        self.assertEqual(self.index.search('  '), [])
+
+    def test_title_matches_outrank_body_matches(self):
+        self.assertEqual(self.index.search('ramen'), [1, 2])
+        self.assertEqual(self.index.search('food'), [3, 1])
+
+    def test_last_term_matches_as_prefix(self):
+        self.assertEqual(self.index.search('ram'), [1, 2])
+        self.assertEqual(self.index.search('ram tokyo'), [])
+        self.assertEqual(self.index.search('food bre'), [3])
+
+    def test_add_replaces_and_remove_drops_terms(self):
+        self.index.add(3, 'Sourdough', 'Food', 'starter')
+        self.assertEqual(self.index.search('baking'), [])
+        self.assertEqual(self.index.search('sour'), [3])
+
+        self.index.remove(3)
+        self.assertEqual(self.index.search('sour'), [])
+        self.assertNotIn('sourdough', self.index._vocabulary)
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        search.reset_index()
+        self.addCleanup(search.reset_index)
+        self.author = User.objects.create_user('indexer', password='x')
+        self.food = Category.objects.create(name='Food')
+
+    def _search(self, query):
+        return list(search.search_post_ids(query))
+
+    def test_signals_keep_the_built_index_current(self):
+        post = Post.objects.create(title='Ramen guide', content='<p>rich <b>broth</b></p>',
+                                   author=self.author, category=self.food, status='published')
+        self.assertEqual(self._search('broth'), [post.id])
+        self.assertTrue(search._index.built)
+
+        post.title = 'Udon guide'
+        post.save()
+        self.assertEqual(self._search('ramen'), [])
+        self.assertEqual(self._search('udon'), [post.id])
+
+        self.food.name = 'Noodles'
+        self.food.save()
+        self.assertEqual(self._search('noodles'), [post.id])
+
+        post.status = 'draft'
+        post.save()
+        self.assertEqual(self._search('udon'), [])
+        self.assertFalse(SearchDocument.objects.exists())
+
+        post.status = 'published'
+        post.save()
+        self.assertEqual(self._search('udon'), [post.id])
+        post.delete()
+        self.assertEqual(self._search('udon'), [])
+
+    def test_rebuild_search_index(self):
+        published = [
+            Post.objects.create(title=f'Market {i}', content='<p>stalls &amp; food</p>',
+                                author=self.author, category=self.food, status='published')
+            for i in range(3)
+        ]
+        Post.objects.create(title='Market draft', content='<p>x</p>', author=self.author)
+        SearchDocument.objects.all().delete()
+        SearchDocument.objects.create(post=published[0], title='Stale', body='stale')
+        search.reset_index()
+
+        out = io.StringIO()
+        call_command('rebuild_search_index', batch_size=2, stdout=out)
+        self.assertIn('Indexed 3 published posts.', out.getvalue())
+        self.assertEqual(
+            set(SearchDocument.objects.values_list('post_id', flat=True)), {post.id for post in published},
+        )
+        self.assertEqual(SearchDocument.objects.get(post=published[0]).body, 'stalls & food')
+        self.assertEqual(self._search('stale'), [])
+        self.assertEqual(self._search('market'), [post.id for post in reversed(published)])
+
+
+@override_settings(BACKGROUND_JOBS_SYNC=True)
+class RelatedPostsTests(TestCase):
+    def setUp(self):
+        search.reset_index()
+        self.addCleanup(search.reset_index)
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+        self.travel = Category.objects.create(name='Travel')
+        self.food = Category.objects.create(name='Food')
+
+    def publish(self, title, author, category, content='<p>notes</p>'):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title=title, content=content, author=author,
+                                       category=category, status='published')
+        post.refresh_from_db()
+        return post
+
+    def test_ranking_mixes_author_category_and_content(self):
+        ramen = self.publish('Ramen in Tokyo', self.alice, self.food)
+        sushi = self.publish('Sushi in Tokyo', self.bob, self.food)
+        hiking = self.publish('Hiking the Alps', self.bob, self.travel)
+        trip = self.publish('Tokyo food trip', self.bob, self.travel, '<p>ramen and sushi</p>')
+
+        ranked = [post_id for post_id, _ in trip.related_ranking]
+        # Same author, similar text and same category beats each alone
+        self.assertEqual(ranked[0], sushi.id)
+        self.assertEqual(set(ranked), {ramen.id, sushi.id, hiking.id})
+
+        # Earlier posts picked up the new one without being recomputed
+        ramen.refresh_from_db()
+        self.assertIn(trip.id, [post_id for post_id, _ in ramen.related_ranking])
+
+    def test_unpublished_posts_are_skipped_when_read(self):
+        first = self.publish('Market day', self.alice, self.food)
+        second = self.publish('Market night', self.alice, self.food)
+        post = self.publish('Market guide', self.alice, self.food)
+        self.assertEqual(related.related_posts_for(post), [second, first])
+
+        Post.objects.filter(pk=second.pk).update(status='draft')
+        with self.assertNumQueries(1):
+            self.assertEqual(related.related_posts_for(post), [first])
+
+
+class QueryPlanTests(QueryPlanMixin, TestCase):
+    """The main views' queries use indexes on a generated dataset"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_dataset', users=20, posts=300, likes=2000, comments=600, stdout=io.StringIO(),
+        )
+        cls.post = Post.objects.filter(status='published').order_by('-comment_count').first()
+        cls.author = User.objects.get(pk=cls.post.author_id)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.author)
+
+    def test_home(self):
+        self.assertQueryPlansUseIndexes(reverse('feeds:home'))
+
+    def test_home_page(self):
+        cursor = encode_cursor(Post.objects.filter(status='published').order_by('-created_at', '-id')[20])
+        self.assertQueryPlansUseIndexes(reverse('feeds:home_page'), data={'cursor': cursor})
+
+    def test_search(self):
+        # Without MySQL full-text search, the in-process index is built by
+        # reading every search document once
+        self.assertQueryPlansUseIndexes(
+            reverse('feeds:search'), data={'q': 'light'},
+            allowed_scans=ALLOWED_SCANS | {'feeds_searchdocument'},
+        )
+
+    def test_post_list(self):
+        self.assertQueryPlansUseIndexes(reverse('posts:list'))
+
+    def test_post_detail(self):
+        self.assertQueryPlansUseIndexes(self.post.get_absolute_url())
+
+    def test_category_posts(self):
+        self.assertQueryPlansUseIndexes(
+            reverse('posts:category', kwargs={'category_name': self.post.category.name})
+        )
+
+    def test_my_posts(self):
+        self.assertQueryPlansUseIndexes(reverse('posts:my_posts'))
+
+    def test_profile(self):
+        self.assertQueryPlansUseIndexes(reverse('accounts:profile', kwargs={'username': self.author.username}))
+
+    def test_visitor_profile(self):
+        self.client.logout()
+        self.assertQueryPlansUseIndexes(reverse('accounts:profile', kwargs={'username': self.author.username}))
+
+    def test_get_comments(self):
+        self.assertQueryPlansUseIndexes(reverse('interactions:get_comments', kwargs={'post_id': self.post.id}))
+        comments = Comment.objects.filter(post=self.post).order_by('-created_at', '-id')
+        url = reverse('interactions:get_comments', kwargs={'post_id': self.post.id})
+        self.assertQueryPlansUseIndexes(url, data={'cursor': encode_cursor(comments[10])})
+        self.assertQueryPlansUseIndexes(url, data={'since': encode_cursor(comments[5])})
+
+    def test_comment_threads(self):
+        roots = list(Comment.objects.filter(post=self.post).order_by('-created_at', '-id')[:3])
+        for root in roots:
+            reply = Comment.objects.create(user=self.author, post=self.post, parent=root, content='reply')
+            Comment.objects.create(user=self.author, post=self.post, parent=reply, content='nested')
+        cache.clear()
+        url = reverse('interactions:get_comments', kwargs={'post_id': self.post.id})
+        self.assertQueryPlansUseIndexes(url)
+        self.assertQueryPlansUseIndexes(url, data={'thread': roots[0].id})
+        reply = Comment.objects.filter(root=roots[0]).order_by('path').first()
+        self.assertQueryPlansUseIndexes(url, data={'thread': roots[0].id, 'cursor': reply.path})
@@ -5,5 +5,6 @@ app_name = 'feeds'
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('feed/page/', views.home_page, name='home_page'),
     path('search/', views.search, name='search'),
 ]
\ No newline at end of file
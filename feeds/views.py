@@ -1,50 +1,92 @@
 from django.shortcuts import render
-from django.db.models import Q, Count
-from posts.models import Post, Category
+from django.core.paginator import Paginator
+from django.http import JsonResponse
+from django.template.loader import render_to_string
+from posts import category_registry
+from posts.models import Post
+from posts.pagination import KeysetPage, InvalidCursor
+from freespaces.query_budget import query_budget
+from posts.page_cache import anonymous_page_cache
+from interactions.models import liked_post_ids
+from .search import search_post_ids
+
+HOME_PAGE_SIZE = 12
+SEARCH_PAGE_SIZE = 12
+
+
+def _home_feed_page(cursor=None):
+    """Return one keyset page of the published home feed"""
+    posts = Post.objects.filter(status='published').select_related('author__profile', 'category').defer('content', 'content_html')
+    return KeysetPage(posts, cursor=cursor, per_page=HOME_PAGE_SIZE)
 
 # Create your views here.
+@query_budget(10)
+@anonymous_page_cache('home')
 def home(request):
-    """Home page view with all published posts"""
-    recent_posts = Post.objects.filter(status='published').select_related('author', 'category').order_by('-created_at')
-    categories = Category.objects.all().order_by('name')
+    """Home page view with the first page of published posts"""
+    recent_posts = _home_feed_page()
+    categories = category_registry.categories()
     context = {
         'recent_posts': recent_posts,
         'categories': categories,
+        'liked_post_ids': liked_post_ids(request.user, recent_posts),
     }
     return render(request, 'feeds/home.html', context)
 
+@query_budget(8)
+def home_page(request):
+    """Next page of the home feed for infinite scroll via AJAX"""
+    try:
+        page = _home_feed_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    posts_html = render_to_string('feeds/post_cards.html', {
+        'posts': page,
+        'user': request.user,
+        'liked_post_ids': liked_post_ids(request.user, page),
+    }, request=request)
+
+    return JsonResponse({
+        'posts_html': posts_html,
+        'has_next': page.has_next,
+        'next_cursor': page.next_cursor
+    })
+
+@query_budget(10)
+@anonymous_page_cache('search')
 def search(request):
-    """Global search functionality"""
+    """Global full-text search over post titles, content and categories"""
     query = request.GET.get('q')
     posts = []
+    page_obj = None
+    total_results = 0
     
     if query:
-        posts = Post.objects.filter(
-            status='published'
-        ).filter(
-            Q(title__icontains=query) |
-            Q(category__name__icontains=query)
-        ).select_related('author', 'category').distinct()
-    
-    # Get top 10 most popular categories based on published post count
-    popular_categories = Category.objects.annotate(
-        post_count=Count('post', filter=Q(post__status='published'))
-    ).filter(post_count__gt=0).order_by('-post_count')[:10]
+        # Ranked post ids from the full-text index, paginated before loading posts
+        paginator = Paginator(search_post_ids(query), SEARCH_PAGE_SIZE)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        total_results = paginator.count
+
+        page_ids = list(page_obj)
+        # Ordered by rank below; no ORDER BY needed
+        posts_by_id = (
+            Post.objects.select_related('author__profile', 'category').defer('content', 'content_html')
+            .order_by().in_bulk(page_ids)
+        )
+        posts = [posts_by_id[pk] for pk in page_ids if pk in posts_by_id]
     
-    # If we have less than 10 categories with posts, pad with remaining categories
-    if popular_categories.count() < 10:
-        used_category_ids = [cat.id for cat in popular_categories]
-        additional_categories = Category.objects.exclude(
-            id__in=used_category_ids
-        ).order_by('name')[:10 - popular_categories.count()]
-        
-        # Combine the lists
-        popular_categories = list(popular_categories) + list(additional_categories)
+    # Top 10 categories by published post count, padded with the remaining
+    # categories by name. post_count is maintained on write and kept in the
+    # category registry, so this reads no table.
+    popular_categories = category_registry.popular(10)
     
     context = {
         'posts': posts,
         'query': query,
-        'total_results': posts.count() if query else 0,
-        'popular_categories': popular_categories
+        'total_results': total_results,
+        'page_obj': page_obj,
+        'popular_categories': popular_categories,
+        'liked_post_ids': liked_post_ids(request.user, posts),
     }
     return render(request, 'feeds/search.html', context)
\ No newline at end of file
@@ -0,0 +1,55 @@
+"""
+Minimal off-request job runner.
+
+Jobs run on a small in-process thread pool once the current transaction
+commits, so the request that queued them returns without waiting. There is
+no persistent queue: a job lost to a restart is redone by the management
+command that backs it (e.g. backfill_post_images).
+
+Set BACKGROUND_JOBS_SYNC = True to run jobs inline instead (tests, scripts).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'BACKGROUND_JOBS_WORKERS', 2),
+                thread_name_prefix='background-job',
+            )
+        return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('Background job %s failed', getattr(func, '__name__', func))
+    finally:
+        # Worker threads hold their own connections; don't leak them
+        connections.close_all()
+
+
+def submit(func, *args, **kwargs):
+    """Run func(*args, **kwargs) on the background pool now"""
+    if getattr(settings, 'BACKGROUND_JOBS_SYNC', False):
+        func(*args, **kwargs)
+        return
+    _get_executor().submit(_run, func, args, kwargs)
+
+
+def submit_on_commit(func, *args, **kwargs):
+    """Run func in the background once the current transaction commits"""
+    transaction.on_commit(lambda: submit(func, *args, **kwargs))
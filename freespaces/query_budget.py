@@ -0,0 +1,147 @@
+"""
+Per-request SQL query recording, N+1 detection and per-view query budgets.
+
+Views declare how many queries a request may take with @query_budget(n).
+In development QueryBudgetMiddleware logs requests that go over budget or
+repeat the same query shape (the usual sign of an N+1 loop in a template),
+and QueryBudgetMixin makes the same checks fail the test suite.
+"""
+import logging
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# A query shape seen this many times in one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = 3
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN \((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
+# Transaction control; how many statements there are depends on atomic()
+# nesting (tests run inside one) and on the backend, not on the work a view
+# does, so they count towards neither the budget nor N+1 detection
+_TRANSACTION_RE = re.compile(
+    r'^\s*(?:BEGIN|START TRANSACTION|COMMIT|ROLLBACK|SAVEPOINT|RELEASE SAVEPOINT)\b', re.IGNORECASE,
+)
+
+
+def query_shape(sql):
+    """SQL with literals and IN lists replaced, so repeats of one query compare equal"""
+    shape = _STRING_RE.sub('?', sql)
+    shape = _NUMBER_RE.sub('?', shape)
+    shape = _IN_LIST_RE.sub('IN (...)', shape)
+    return _SPACE_RE.sub(' ', shape).strip()
+
+
+class QueryRecorder:
+    """
+    Context manager that records every statement run on one connection.
+
+    Uses an execute wrapper rather than connection.queries, so it works with
+    DEBUG off and never misses queries when the debug log rotates.
+    """
+
+    def __init__(self, using='default'):
+        self.connection = connections[using]
+        self.queries = []
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._wrapper.__exit__(*exc_info)
+
+    def __call__(self, execute, sql, params, many, context):
+        if _TRANSACTION_RE.match(sql):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'sql': sql, 'params': params, 'time': time.perf_counter() - start})
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated_shapes(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """[(shape, count)] of query shapes run at least threshold times, worst first"""
+        counts = Counter(query_shape(query['sql']) for query in self.queries)
+        return [(shape, count) for shape, count in counts.most_common() if count >= threshold]
+
+
+def query_budget(max_queries):
+    """Declare the most queries one request to the decorated view may run"""
+    def decorator(view_func):
+        # Outer decorators built with functools.wraps copy the attribute up
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+def get_query_budget(view_func):
+    return getattr(view_func, 'query_budget', None)
+
+
+def budget_problems(recorder, budget):
+    """Human-readable list of the ways a request broke its budget"""
+    problems = []
+    if budget is not None and len(recorder) > budget:
+        problems.append(f'{len(recorder)} queries, budget is {budget}')
+    for shape, count in recorder.repeated_shapes():
+        problems.append(f'possible N+1, {count} x {shape}')
+    return problems
+
+
+class QueryBudgetMiddleware:
+    """
+    Development middleware reporting query counts per request.
+
+    Adds an X-Query-Count header and logs a warning when a view runs more
+    queries than its budget or repeats a query shape. Disabled unless DEBUG.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        response['X-Query-Count'] = str(len(recorder))
+        match = getattr(request, 'resolver_match', None)
+        budget = get_query_budget(match.func) if match else None
+        for problem in budget_problems(recorder, budget):
+            logger.warning('%s %s: %s', request.method, request.path, problem)
+        return response
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin that fails a test when a request breaks its view's budget.
+
+    Every view checked this way must declare a budget with @query_budget.
+    """
+
+    def assertWithinQueryBudget(self, url, method='get', data=None, **extra):
+        with QueryRecorder() as recorder:
+            response = getattr(self.client, method)(url, data, **extra)
+
+        budget = get_query_budget(response.resolver_match.func)
+        if budget is None:
+            self.fail(f'{response.resolver_match.view_name} has no @query_budget')
+        problems = budget_problems(recorder, budget)
+        if problems:
+            queries = '\n'.join(query['sql'] for query in recorder.queries)
+            self.fail(f'{method.upper()} {url}: ' + '; '.join(problems) + f'\n\n{queries}')
+        return response
@@ -0,0 +1,94 @@
+"""
+EXPLAIN checks for the queries a request runs.
+
+plan_problems() explains one SELECT and reports the two things an index
+should have prevented on a hot path:
+
+- full table scans (MySQL type ALL, SQLite "SCAN <table>" without an index),
+- sorts done after reading the rows (MySQL "Using filesort", SQLite
+  "USE TEMP B-TREE FOR ORDER BY").
+
+Reading a subquery's result whole (e.g. the wrapper Django puts around
+filters on window functions) is not a table scan and is not reported.
+
+QueryPlanMixin makes these fail the test suite for a request, and
+`manage.py benchmark_views --explain` runs the same checks against the
+benchmark dataset. On a handful of rows MySQL prefers scanning to using an
+index, so only plans taken on a realistically sized dataset mean anything
+there; SQLite plans from indexes alone and is fine to check in tests.
+"""
+import re
+
+from django.db import connections
+
+from .query_budget import QueryRecorder
+
+# Lookup tables small enough that reading them whole is the right plan
+ALLOWED_SCANS = {'posts_category', 'django_site', 'socialaccount_socialapp'}
+
+_SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+_SQLITE_SORT_RE = re.compile(r'^USE TEMP B-TREE FOR (?:.* )?ORDER BY$')
+
+
+def explain(connection, sql, params):
+    """EXPLAIN rows for one statement, as dicts keyed by column name"""
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def plan_problems(connection, sql, params=None, allowed_scans=ALLOWED_SCANS):
+    """Human-readable list of full scans and sorts in the plan for one SELECT"""
+    problems = []
+    if connection.vendor == 'sqlite':
+        tables = set(connection.introspection.table_names())
+        for row in explain(connection, sql, params):
+            detail = row['detail']
+            scan = _SQLITE_SCAN_RE.match(detail)
+            if scan and scan.group(1) in tables and scan.group(1) not in allowed_scans:
+                problems.append(f'full scan of {scan.group(1)}')
+            elif _SQLITE_SORT_RE.match(detail):
+                problems.append('sort without an index')
+    elif connection.vendor == 'mysql':
+        for row in explain(connection, sql, params):
+            table = row.get('table') or ''
+            # <derivedN> is a subquery's result
+            if row.get('type') == 'ALL' and not table.startswith('<derived') and table not in allowed_scans:
+                problems.append(f'full scan of {table}')
+            if 'Using filesort' in (row.get('Extra') or ''):
+                problems.append(f'filesort on {table}')
+    else:
+        raise NotImplementedError(f'Query plans are not checked on {connection.vendor}')
+    return problems
+
+
+def recorded_plan_problems(recorder, allowed_scans=ALLOWED_SCANS):
+    """[(sql, problems)] for every recorded SELECT whose plan has problems"""
+    found = []
+    for query in recorder.queries:
+        if not query['sql'].lstrip().upper().startswith('SELECT'):
+            continue
+        problems = plan_problems(recorder.connection, query['sql'], query['params'], allowed_scans)
+        if problems:
+            found.append((query['sql'], problems))
+    return found
+
+
+class QueryPlanMixin:
+    """TestCase mixin that fails a test when a request's queries scan or sort without an index"""
+
+    def assertQueryPlansUseIndexes(self, url, method='get', data=None, allowed_scans=ALLOWED_SCANS, **extra):
+        connection = connections['default']
+        if connection.vendor not in ('sqlite', 'mysql'):
+            self.skipTest(f'Query plans are not checked on {connection.vendor}')
+
+        with QueryRecorder() as recorder:
+            response = getattr(self.client, method)(url, data, **extra)
+
+        found = recorded_plan_problems(recorder, allowed_scans)
+        if found:
+            report = '\n\n'.join(f'{", ".join(problems)}:\n{sql}' for sql, problems in found)
+            self.fail(f'{method.upper()} {url}: {len(found)} queries without a usable index\n\n{report}')
+        return response
@@ -58,6 +58,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Query counts and N+1 warnings per request; only active with DEBUG = True
+    'freespaces.query_budget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -101,6 +103,37 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory is per process; use a shared backend (Redis/Memcached) in
+# production so cached post cards and their version keys are shared by workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'freespaces',
+    }
+}
+
+# Serve home, search, post detail and category pages to logged-out visitors
+# from the cache (see posts/page_cache.py). Off by default.
+ANONYMOUS_PAGE_CACHE = False
+
+# Off-request work such as image resizing (see freespaces/background.py) runs
+# on this many threads per process; set BACKGROUND_JOBS_SYNC = True to run
+# it inline instead.
+BACKGROUND_JOBS_WORKERS = 2
+BACKGROUND_JOBS_SYNC = False
+
+# Write-behind likes for viral posts (see interactions/likes.py): toggles
+# append to a staging table instead of writing Like rows and the post's
+# counter, and batched flushes apply them. Flushes start from toggles at most
+# every LIKE_FLUSH_INTERVAL seconds; also run manage.py flush_likes from cron
+# so the last clicks before a quiet spell are applied. Off by default.
+LIKE_WRITE_BEHIND = False
+LIKE_FLUSH_INTERVAL = 5
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -145,6 +178,17 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads are stored once per distinct content and named by hash (see
+# freespaces/storage.py); run `manage.py gc_media` to delete unreferenced files
+STORAGES = {
+    'default': {
+        'BACKEND': 'freespaces.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Login/Logout redirects
 LOGIN_URL = '/accounts/oauth-login/'
 LOGOUT_REDIRECT_URL = '/'
@@ -0,0 +1,79 @@
+"""
+Content-addressed media storage.
+
+Every saved file is named after the SHA-256 of its bytes, keeping the
+upload_to directory and the extension:
+
+    post_images/beach.JPG  ->  post_images/3f/3fa9...c1.jpg
+
+Saving bytes that are already stored writes nothing and returns the
+existing name, so identical uploads share one file. A name therefore never
+points at different content, which is what lets media URLs be cached
+forever (see serve_media).
+
+Because files are shared, nothing may delete them directly. Models record
+which files they reference in posts.media, and the gc_media command
+deletes files nobody references any more.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.views.static import serve
+
+# Browsers and CDNs may keep content-addressed files for a year without revalidating
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+HASHED_NAME_RE = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+def is_hashed_name(name):
+    """Whether name was produced by ContentAddressedStorage"""
+    return bool(HASHED_NAME_RE.search(name))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names files by content and stores each content once"""
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk if isinstance(chunk, bytes) else chunk.encode())
+        digest = digest.hexdigest()
+        directory = posixpath.dirname(name.replace('\\', '/'))
+        extension = os.path.splitext(name)[1].lower()
+        # Two-character shards keep directories small
+        return posixpath.join(directory, digest[:2], f'{digest}{extension}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        validate_file_name(name, allow_relative_path=True)
+
+        if self.exists(name):
+            # Refresh the modification time so gc_media's grace period
+            # protects a file that was unreferenced but is wanted again
+            os.utime(self.path(name))
+            return name
+
+        # Write under a unique temporary name and rename into place, so a
+        # concurrent save of the same bytes never sees a half-written file
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """django.views.static.serve, marking content-addressed files immutable"""
+    response = serve(request, path, document_root=document_root, show_indexes=show_indexes)
+    if is_hashed_name(path) and response.status_code == 200:
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
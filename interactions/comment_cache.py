@@ -0,0 +1,98 @@
+"""
+Cache of the first rendered comment pages of each post.
+
+Most viewers of a post only read its first page or two of comments, so
+get_comments keeps the first CACHED_PAGES keyset pages of every post in one
+cache entry, built together on a miss. The key carries a per-post version
+that adding or deleting a comment bumps, so a new comment invalidates
+exactly one post's pages.
+
+Cached HTML must not depend on the viewer: comment_item.html renders every
+delete button hidden, marked with the comment author's id, and main.js shows
+the ones belonging to the current user. Times are rendered as <time>
+elements that main.js keeps relative.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import render_to_string
+
+from posts.pagination import KeysetPage
+
+CACHED_PAGES = 3
+# Backstop for what versions do not track, such as a commenter's new avatar
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+
+def _version_key(post_id):
+    return f'comment_pages:version:{post_id}'
+
+
+def _new_version():
+    # From the clock, so a recreated version key never matches old pages
+    return int(time.time() * 1000)
+
+
+def _version(post_id):
+    key = _version_key(post_id)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def bump(post_id):
+    """Drop the cached comment pages of one post"""
+    try:
+        cache.incr(_version_key(post_id))
+    except ValueError:
+        cache.set(_version_key(post_id), _new_version(), None)
+
+
+def invalidate(post_id):
+    """bump() now and again after the current transaction commits"""
+    # A request between the two could cache pages without the change
+    bump(post_id)
+    transaction.on_commit(lambda: bump(post_id))
+
+
+def render_page(page):
+    """The get_comments payload for one KeysetPage of top-level comments"""
+    # Imported late: models imports this module for its signal receivers
+    from .models import REPLIES_SHOWN, attach_replies
+    attach_replies(page.object_list, REPLIES_SHOWN)
+    return {
+        'comments_html': render_to_string('interactions/comments_list.html', {'comments': page}),
+        'has_next': page.has_next,
+        'next_cursor': page.next_cursor,
+        'newest_cursor': page.newest_cursor,
+    }
+
+
+def get_page(post_id, comments, cursor=None, per_page=10):
+    """
+    The payload of one of the first CACHED_PAGES pages, or None.
+
+    comments is the post's top-level comment queryset. The first page (no
+    cursor) always comes back, building and caching all CACHED_PAGES pages
+    on a miss. A cursor only hits if it continues one of the cached pages;
+    callers page deeper ones themselves.
+    """
+    key = f'comment_pages:{post_id}:{_version(post_id)}:{per_page}'
+    pages = cache.get(key)
+    if pages is None:
+        if cursor is not None:
+            return None
+        pages = {}
+        page_cursor = None
+        for _ in range(CACHED_PAGES):
+            page = KeysetPage(comments, cursor=page_cursor, per_page=per_page)
+            pages[page_cursor or ''] = render_page(page)
+            if not page.has_next:
+                break
+            page_cursor = page.next_cursor
+        cache.set(key, pages, PAGE_CACHE_TIMEOUT)
+    return pages.get(cursor or '')
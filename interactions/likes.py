@@ -0,0 +1,252 @@
+"""
+Race-safe like toggling.
+
+A toggle is one short transaction: lock the post row, DELETE the
+(user, post) like, and INSERT it only if nothing was deleted, then adjust
+Post.like_count by the same amount. The post row lock serializes toggles on
+one post, so two clicks that arrive together end up as a like and an
+unlike, never as two likes or a counter that disagrees with the rows. The
+counter UPDATE would hold that lock until commit anyway; taking it first
+only makes the count read at the start exact.
+
+That is three statements for an unlike and four for a like rather than a
+single upsert: without RETURNING (MySQL has none) the new count needs a
+read after the write anyway, and the locked read up front is that read.
+
+Clients may send an idempotency token with each click and reuse it when
+retrying. The first answer for a token is cached, and a retry gets that
+answer back instead of toggling again.
+
+With LIKE_WRITE_BEHIND on, a toggle locks nothing: it appends the state the
+user asked for to PendingLike and answers with the stored count plus the
+post's pending deltas. flush_pending_likes() applies the pending rows in
+batches, one counter update per post per batch, so a viral post's row is
+written once per flush instead of once per click. The user's own clicks show
+up at once through liked_post_ids(), post_like_count() and, on list pages,
+merge_pending_likes(), which every view showing counts calls.
+"""
+import re
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from freespaces import background
+from posts import card_cache
+from posts.models import Post
+from .models import Like, PendingLike, adjust_post_counter
+
+TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+# How long a retry can still get the first answer for its token
+TOKEN_TIMEOUT = 60 * 60 * 24
+
+_PENDING = 'pending'
+
+# Set while a flush started by a toggle is due; expires after LIKE_FLUSH_INTERVAL
+FLUSH_SCHEDULED_KEY = 'likes:flush_scheduled'
+# Held by the running flush, so flushes from several workers do not overlap
+FLUSH_LOCK_KEY = 'likes:flushing'
+FLUSH_LOCK_TIMEOUT = 5 * 60
+
+
+def _published(post_id):
+    return Post.objects.filter(pk=post_id, status='published')
+
+
+def pending_like_deltas(post_ids):
+    """{post id: change to like_count not flushed yet} for posts with pending likes"""
+    return dict(
+        PendingLike.objects.filter(post_id__in=post_ids).order_by()
+        .values('post').annotate(delta=Sum('delta')).values_list('post', 'delta')
+    )
+
+
+def post_like_count(post):
+    """post.like_count including pending likes when LIKE_WRITE_BEHIND is on"""
+    if not settings.LIKE_WRITE_BEHIND:
+        return post.like_count
+    return max(post.like_count + pending_like_deltas([post.id]).get(post.id, 0), 0)
+
+
+def merge_pending_likes(posts):
+    """
+    Add pending likes to the like_count of each post, in place.
+
+    For list pages, so counts move with the viewer's own clicks as the heart
+    does. One query for the whole list, none unless LIKE_WRITE_BEHIND is on.
+    """
+    if not settings.LIKE_WRITE_BEHIND or not posts:
+        return
+    deltas = pending_like_deltas([post.pk for post in posts])
+    for post in posts:
+        if post.pk in deltas:
+            post.like_count = max(post.like_count + deltas[post.pk], 0)
+
+
+def _user_likes(user_id, post_id):
+    """Whether the user likes the post, counting a pending like or unlike"""
+    if settings.LIKE_WRITE_BEHIND:
+        pending = (
+            PendingLike.objects.filter(user_id=user_id, post_id=post_id)
+            .order_by('-id').values_list('liked', flat=True).first()
+        )
+        if pending is not None:
+            return pending
+    return Like.objects.filter(user_id=user_id, post_id=post_id).exists()
+
+
+def like_state(user_id, post_id):
+    """(liked, like_count) without changing anything, or None if the post is not published"""
+    post = _published(post_id).only('id', 'like_count').first()
+    if post is None:
+        return None
+    return _user_likes(user_id, post_id), post_like_count(post)
+
+
+def _delete_likes(post_id, user_ids):
+    """
+    DELETE the likes of one post by these users and return how many went.
+
+    A plain statement: QuerySet.delete() would load the rows first and send
+    the Like signals, which adjust the counter that callers adjust once
+    themselves.
+    """
+    quote = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(Like._meta.db_table)} '
+            f'WHERE {quote(Like._meta.get_field("post").column)} = %s '
+            f'AND {quote(Like._meta.get_field("user").column)} IN ({placeholders})',
+            [post_id, *user_ids],
+        )
+        return cursor.rowcount
+
+
+def _toggle(user_id, post_id):
+    with transaction.atomic():
+        like_count = _published(post_id).select_for_update().values_list('like_count', flat=True).first()
+        if like_count is None:
+            return None
+
+        # Plain DELETE and INSERT statements skip the Like signals; the
+        # counter is adjusted once below
+        if _delete_likes(post_id, [user_id]):
+            liked, delta = False, -1
+        else:
+            Like.objects.bulk_create([Like(user_id=user_id, post_id=post_id)])
+            liked, delta = True, 1
+
+        adjust_post_counter(post_id, 'like_count', delta)
+    # Counters never go below zero
+    return liked, max(like_count + delta, 0)
+
+
+def _buffer_toggle(user_id, post_id):
+    post = _published(post_id).only('id', 'like_count').first()
+    if post is None:
+        return None
+
+    # Two clicks racing here may both ask for the same state; applying it
+    # twice is harmless, and the flush recounts from the rows it changes
+    liked = not _user_likes(user_id, post_id)
+    PendingLike.objects.create(user_id=user_id, post_id=post_id, liked=liked, delta=1 if liked else -1)
+    # Cards that show the count are cached with the merged value
+    card_cache.bump_post(post_id)
+    if cache.add(FLUSH_SCHEDULED_KEY, True, settings.LIKE_FLUSH_INTERVAL):
+        background.submit_on_commit(flush_pending_likes)
+    return liked, post_like_count(post)
+
+
+def flush_pending_likes(batch_size=1000):
+    """
+    Apply pending likes to Like and Post.like_count, oldest first.
+
+    Each batch commits on its own. Returns the number of pending rows
+    applied, or 0 if another flush is running.
+    """
+    if not cache.add(FLUSH_LOCK_KEY, True, FLUSH_LOCK_TIMEOUT):
+        return 0
+    try:
+        applied = 0
+        while True:
+            batch = _flush_batch(batch_size)
+            applied += batch
+            if batch < batch_size:
+                return applied
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+
+
+def _flush_batch(batch_size):
+    with transaction.atomic():
+        pending = list(
+            PendingLike.objects.select_for_update().order_by('id')
+            .values_list('id', 'user_id', 'post_id', 'liked')[:batch_size]
+        )
+        if not pending:
+            return 0
+
+        # The latest click per (user, post) wins
+        wanted = {(user_id, post_id): liked for _, user_id, post_id, liked in pending}
+        existing = set(
+            Like.objects.filter(
+                user_id__in={user_id for user_id, _ in wanted},
+                post_id__in={post_id for _, post_id in wanted},
+            ).order_by().values_list('user_id', 'post_id')
+        )
+
+        added = [pair for pair, liked in wanted.items() if liked and pair not in existing]
+        removed = defaultdict(list)
+        for (user_id, post_id), liked in wanted.items():
+            if not liked and (user_id, post_id) in existing:
+                removed[post_id].append(user_id)
+
+        # Plain statements skip the Like signals; counters are adjusted once
+        # per post below
+        Like.objects.bulk_create([Like(user_id=user_id, post_id=post_id) for user_id, post_id in added])
+        deltas = Counter(post_id for _, post_id in added)
+        for post_id, user_ids in removed.items():
+            deltas[post_id] -= _delete_likes(post_id, user_ids)
+        for post_id, delta in deltas.items():
+            if delta:
+                adjust_post_counter(post_id, 'like_count', delta)
+
+        PendingLike.objects.filter(id__in=[row[0] for row in pending]).delete()
+    return len(pending)
+
+
+def toggle(user_id, post_id, token=None):
+    """
+    Like the post if the user has not, unlike it if they have.
+
+    Returns (liked, like_count) as the user now sees them, or None if there
+    is no published post with this id. With a token (matching TOKEN_PATTERN),
+    repeated calls return the first call's answer and toggle only once.
+    """
+    apply = _buffer_toggle if settings.LIKE_WRITE_BEHIND else _toggle
+    if token is None:
+        return apply(user_id, post_id)
+
+    key = f'likes:toggle:{user_id}:{post_id}:{token}'
+    if not cache.add(key, _PENDING, TOKEN_TIMEOUT):
+        result = cache.get(key)
+        if result is not None and result != _PENDING:
+            return tuple(result)
+        # The first request is still running: report the state without
+        # toggling a second time
+        return like_state(user_id, post_id)
+
+    try:
+        result = apply(user_id, post_id)
+    except BaseException:
+        # Nothing was toggled, so a retry may try again
+        cache.delete(key)
+        raise
+    if result is None:
+        cache.delete(key)
+    else:
+        cache.set(key, result, TOKEN_TIMEOUT)
+    return result
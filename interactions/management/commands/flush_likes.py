@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from interactions.likes import flush_pending_likes
+
+
+class Command(BaseCommand):
+    help = 'Apply likes buffered by LIKE_WRITE_BEHIND to Like rows and post counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Pending likes applied per transaction')
+
+    def handle(self, *args, **options):
+        applied = flush_pending_likes(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Applied {applied} pending likes.'))
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from posts.models import Post
+from interactions.models import Like, Comment
+
+
+class Command(BaseCommand):
+    help = 'Recompute Post.like_count and Post.comment_count and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of posts checked per batch')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drifted posts without updating them')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        likes = Like.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(c=Count('id')).values('c')
+        comments = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(c=Count('id')).values('c')
+
+        checked = fixed = 0
+        last_id = 0
+        while True:
+            # Walk the table in primary key order so every batch is a range scan
+            ids = list(
+                Post.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            checked += len(ids)
+
+            drifted = Post.objects.filter(id__in=ids).annotate(
+                actual_likes=Coalesce(Subquery(likes), 0),
+                actual_comments=Coalesce(Subquery(comments), 0),
+            ).exclude(
+                Q(like_count=F('actual_likes')) & Q(comment_count=F('actual_comments'))
+            ).values_list('id', 'like_count', 'actual_likes', 'comment_count', 'actual_comments')
+
+            for post_id, like_count, actual_likes, comment_count, actual_comments in drifted:
+                fixed += 1
+                self.stdout.write(
+                    f'Post {post_id}: likes {like_count} -> {actual_likes}, '
+                    f'comments {comment_count} -> {actual_comments}'
+                )
+                if not dry_run:
+                    # Recount inside the UPDATE so concurrent writes are not lost
+                    Post.objects.filter(id=post_id).update(
+                        like_count=Coalesce(Subquery(likes), 0),
+                        comment_count=Coalesce(Subquery(comments), 0),
+                    )
+
+        action = 'Found' if dry_run else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} posts. {action} {fixed} with drifted counters.'))
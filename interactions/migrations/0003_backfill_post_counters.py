@@ -0,0 +1,32 @@
+# Generated manually to backfill the denormalized counters on posts.Post
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_post_counters(apps, schema_editor):
+    """Populate like_count and comment_count from the existing rows"""
+    Post = apps.get_model('posts', 'Post')
+    Like = apps.get_model('interactions', 'Like')
+    Comment = apps.get_model('interactions', 'Comment')
+
+    likes = Like.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(c=Count('id')).values('c')
+    comments = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(c=Count('id')).values('c')
+
+    Post.objects.update(
+        like_count=Coalesce(Subquery(likes), 0),
+        comment_count=Coalesce(Subquery(comments), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('interactions', '0002_comment'),
+        ('posts', '0007_post_like_count_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_post_counters, migrations.RunPython.noop),
+    ]
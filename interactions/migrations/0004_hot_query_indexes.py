@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('interactions', '0003_backfill_post_counters'),
+        ('posts', '0014_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', '-created_at', '-id'], name='comment_post_recent_idx'),
+        ),
+    ]
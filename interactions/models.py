@@ -1,6 +1,13 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import F, Value, Window
+from django.db.models.functions import Cast, Concat, LPad, RowNumber
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from posts.models import Post
+from posts import card_cache
+from . import comment_cache
 
 # Create your models here.
 class Like(models.Model):
@@ -16,15 +23,195 @@ class Like(models.Model):
         return f'{self.user.username} likes {self.post.title}'
 
 
+# Width of one id in Comment.path; ids up to 10 digits
+PATH_SEGMENT_WIDTH = 10
+# Deepest reply allowed; a path holds at most 23 segments
+MAX_REPLY_DEPTH = 6
+# Replies listed under each top-level comment before "View all replies"
+REPLIES_SHOWN = 3
+
+
+def path_segment(comment_id):
+    return f'{comment_id:0{PATH_SEGMENT_WIDTH}d}/'
+
+
 class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
+    # Replies: parent is the comment answered, root the top-level comment of
+    # the thread (both empty on top-level comments)
+    parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='replies')
+    root = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.CASCADE, related_name='+',
+        db_index=False,  # comment_thread_idx covers it
+    )
+    # Materialized path: the zero-padded ids from the root down to this
+    # comment, each followed by '/'. Sorting a thread by path lists every
+    # reply right after the comment it answers.
+    path = models.CharField(max_length=255, blank=True, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
+    # Replies anywhere in the thread, kept on top-level comments only
+    reply_count = models.PositiveIntegerField(default=0)
     content = models.TextField(max_length=1000)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # A post's top-level comments, newest first
+            models.Index(fields=['post', 'root', '-created_at', '-id'], name='comment_post_roots_idx'),
+            # A whole thread in reading order
+            models.Index(fields=['root', 'path'], name='comment_thread_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username} commented on {self.post.title}'
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if adding and self.parent_id:
+            self.root_id = self.parent.root_id or self.parent_id
+            self.depth = self.parent.depth + 1
+        super().save(*args, **kwargs)
+        if adding and not self.path:
+            # The path ends with this comment's own id, known only now
+            self.path = (self.parent.path if self.parent_id else '') + path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
+
+class PendingLike(models.Model):
+    """
+    A like or unlike not yet applied to Like and Post.like_count.
+
+    Append-only staging table for LIKE_WRITE_BEHIND (see likes.py). Rows
+    record the state the user asked for, so applying them twice is harmless;
+    the latest row per (user, post) wins. delta is the change to the post's
+    count this click made as far as the user could see at the time.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    liked = models.BooleanField()
+    delta = models.SmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # A user's latest intent per post
+            models.Index(fields=['user', 'post', '-id'], name='pendinglike_user_post_idx'),
+        ]
 
     def __str__(self):
-        return f'{self.user.username} commented on {self.post.title}'
\ No newline at end of file
+        return f'{self.user_id} {"likes" if self.liked else "unlikes"} {self.post_id} (pending)'
+
+
+def liked_post_ids(user, posts):
+    """
+    Return the set of ids among `posts` that `user` has liked.
+
+    `posts` may be a queryset (used as a subquery) or any iterable of posts,
+    such as an already evaluated page. Either way this costs one query on the
+    (user, post) unique index instead of loading every Like per post.
+    """
+    if not user.is_authenticated:
+        return set()
+
+    if isinstance(posts, models.QuerySet):
+        post_ids = posts.order_by().values('id')
+    else:
+        post_ids = [post.id for post in posts]
+        if not post_ids:
+            return set()
+
+    liked = set(
+        # No ORDER BY: Meta.ordering would sort the ids for nothing
+        Like.objects.filter(user=user, post_id__in=post_ids).order_by().values_list('post_id', flat=True)
+    )
+    if settings.LIKE_WRITE_BEHIND:
+        # Clicks not flushed yet, oldest first so the latest wins
+        for post_id, post_liked in PendingLike.objects.filter(
+            user=user, post_id__in=post_ids,
+        ).order_by('id').values_list('post_id', 'liked'):
+            if post_liked:
+                liked.add(post_id)
+            else:
+                liked.discard(post_id)
+    return liked
+
+
+def fill_root_paths(post_ids):
+    """Set the path of top-level comments on these posts made by bulk_create, which skips save()"""
+    Comment.objects.filter(post_id__in=post_ids, path='').update(
+        path=Concat(LPad(Cast('id', models.CharField()), PATH_SEGMENT_WIDTH, Value('0')), Value('/')),
+    )
+
+
+def attach_replies(roots, limit):
+    """
+    Set shown_replies on each top-level comment: the first `limit` replies
+    of its thread in reading order.
+
+    One query for all the threads, served by comment_thread_idx, however
+    many roots there are.
+    """
+    roots = list(roots)
+    by_id = {}
+    for root in roots:
+        root.shown_replies = []
+        if root.reply_count:
+            by_id[root.pk] = root
+    if not by_id:
+        return roots
+
+    replies = (
+        Comment.objects.filter(root_id__in=by_id)
+        .annotate(position=Window(RowNumber(), partition_by=F('root_id'), order_by=F('path').asc()))
+        .filter(position__lte=limit)
+        .select_related('user', 'user__profile')
+        .order_by()
+    )
+    # Few rows per page; sorting them here avoids a second sort in the database
+    for reply in sorted(replies, key=lambda reply: reply.path):
+        by_id[reply.root_id].shown_replies.append(reply)
+    return roots
+
+
+def adjust_post_counter(post_id, field, delta):
+    """Atomically add delta to one of the denormalized counters on Post"""
+    posts = Post.objects.filter(pk=post_id)
+    if delta < 0:
+        # Never let drift push an unsigned counter below zero
+        posts = posts.filter(**{f'{field}__gte': -delta})
+    posts.update(**{field: F(field) + delta})
+    # Cached cards show the counters
+    card_cache.bump_post(post_id)
+
+
+# Signals keep Post.like_count / Post.comment_count in step with the rows,
+# including deletes cascaded from a user or made through the admin
+@receiver(post_save, sender=Like)
+def increment_like_count(sender, instance, created, **kwargs):
+    if created:
+        adjust_post_counter(instance.post_id, 'like_count', 1)
+
+@receiver(post_delete, sender=Like)
+def decrement_like_count(sender, instance, **kwargs):
+    adjust_post_counter(instance.post_id, 'like_count', -1)
+
+@receiver(post_save, sender=Comment)
+def increment_comment_count(sender, instance, created, **kwargs):
+    if created:
+        adjust_post_counter(instance.post_id, 'comment_count', 1)
+        if instance.root_id:
+            Comment.objects.filter(pk=instance.root_id).update(reply_count=F('reply_count') + 1)
+    # Edits show up on cached pages too
+    comment_cache.invalidate(instance.post_id)
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance, **kwargs):
+    adjust_post_counter(instance.post_id, 'comment_count', -1)
+    if instance.root_id:
+        # Also runs for each reply cascaded from a deleted comment; a root
+        # deleted with its thread simply matches no row
+        Comment.objects.filter(pk=instance.root_id, reply_count__gte=1).update(reply_count=F('reply_count') - 1)
+    comment_cache.invalidate(instance.post_id)
\ No newline at end of file
@@ -1,3 +1,468 @@
-from django.test import TestCase
+import io
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from freespaces.query_budget import QueryBudgetMixin
+from posts.models import Post
+from . import likes
+from .models import MAX_REPLY_DEPTH, Comment, Like, PendingLike, liked_post_ids
+from .views import THREAD_REPLIES_PER_PAGE
+
+
+class InteractionQueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'reader_{i}', password='x') for i in range(6)]
+        cls.post = Post.objects.create(
+            title='Busy post', content='<p>talk to me</p>', author=cls.users[0], status='published',
+        )
+        for i in range(15):
+            Comment.objects.create(user=cls.users[i % 6], post=cls.post, content=f'comment {i}')
+
+    def setUp(self):
+        # Budgets must hold with cold comment pages
+        cache.clear()
+        self.client.force_login(self.users[1])
+
+    def test_toggle_like(self):
+        url = reverse('interactions:toggle_like', kwargs={'post_id': self.post.id})
+        self.assertWithinQueryBudget(url, method='post')
+        self.assertWithinQueryBudget(url, method='post')
+
+    def test_add_comment(self):
+        url = reverse('interactions:add_comment', kwargs={'post_id': self.post.id})
+        self.assertWithinQueryBudget(url, method='post', data={'content': 'hello'})
+
+    def test_get_comments(self):
+        self.assertWithinQueryBudget(reverse('interactions:get_comments', kwargs={'post_id': self.post.id}))
+
+    def test_delete_comment(self):
+        comment = Comment.objects.filter(user=self.users[1]).first()
+        url = reverse('interactions:delete_comment', kwargs={'comment_id': comment.id})
+        self.assertWithinQueryBudget(url, method='post')
+
+
+class LikeToggleTransactionBudgetTests(QueryBudgetMixin, TransactionTestCase):
+    """
+    toggle_like outside TestCase's wrapping transaction.
+
+    Here the toggle's atomic() runs a real BEGIN rather than a savepoint, as
+    it does in production, so the budget has to cover it.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('clicker', password='x')
+        self.post = Post.objects.create(title='Hot', content='<p>x</p>', author=self.user, status='published')
+        self.client.force_login(self.user)
+
+    def test_toggle_like(self):
+        url = reverse('interactions:toggle_like', kwargs={'post_id': self.post.id})
+        self.assertWithinQueryBudget(url, method='post')
+        self.assertWithinQueryBudget(url, method='post', HTTP_IDEMPOTENCY_KEY='click-1')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+
+class PostCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'counter_{i}', password='x') for i in range(3)]
+        cls.post = Post.objects.create(title='Counted', content='<p>x</p>', author=cls.users[0], status='published')
+
+    def _counts(self):
+        self.post.refresh_from_db()
+        return self.post.like_count, self.post.comment_count
+
+    def test_likes_and_comments_move_the_counters(self):
+        like_rows = [Like.objects.create(user=user, post=self.post) for user in self.users]
+        comment = Comment.objects.create(user=self.users[1], post=self.post, content='hi')
+        Comment.objects.create(user=self.users[2], post=self.post, content='hello')
+        self.assertEqual(self._counts(), (3, 2))
+
+        like_rows[0].delete()
+        comment.delete()
+        self.assertEqual(self._counts(), (2, 1))
+
+        # Deletes cascaded from a user go through the signals too
+        self.users[2].delete()
+        self.assertEqual(self._counts(), (1, 0))
+
+    def test_counters_never_go_below_zero(self):
+        like = Like.objects.create(user=self.users[1], post=self.post)
+        comment = Comment.objects.create(user=self.users[1], post=self.post, content='hi')
+        Post.objects.filter(pk=self.post.pk).update(like_count=0, comment_count=0)
+        like.delete()
+        comment.delete()
+        self.assertEqual(self._counts(), (0, 0))
+
+    def test_reconcile_fixes_drift(self):
+        Like.objects.create(user=self.users[1], post=self.post)
+        Comment.objects.create(user=self.users[1], post=self.post, content='hi')
+        other = Post.objects.create(title='Fine', content='<p>x</p>', author=self.users[0], status='published')
+        Post.objects.filter(pk=self.post.pk).update(like_count=7, comment_count=0)
+
+        out = io.StringIO()
+        call_command('reconcile_post_counters', dry_run=True, stdout=out)
+        self.assertIn(f'Post {self.post.id}: likes 7 -> 1, comments 0 -> 1', out.getvalue())
+        self.assertEqual(self._counts(), (7, 0))
+
+        out = io.StringIO()
+        call_command('reconcile_post_counters', batch_size=1, stdout=out)
+        self.assertIn('Checked 2 posts. Fixed 1 with drifted counters.', out.getvalue())
+        self.assertEqual(self._counts(), (1, 1))
+        other.refresh_from_db()
+        self.assertEqual((other.like_count, other.comment_count), (0, 0))
+
+
+class CommentPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('talker', password='x')
+        cls.post = Post.objects.create(title='Chatty', content='<p>x</p>', author=cls.user, status='published')
+        cls.comments = [Comment.objects.create(user=cls.user, post=cls.post, content=f'comment {i}') for i in range(25)]
+        # Same timestamp everywhere, so only the id tiebreak orders them
+        Comment.objects.update(created_at=cls.comments[0].created_at)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('interactions:get_comments', kwargs={'post_id': self.post.id})
+
+    def _ids(self, data):
+        return [int(i) for i in re.findall(r'comment-item[^"]*" data-comment-id="(\d+)"', data['comments_html'])]
+
+    def test_cursor_pages_walk_every_comment_once(self):
+        seen, params = [], {}
+        while True:
+            data = self.client.get(self.url, params).json()
+            seen.extend(self._ids(data))
+            self.assertEqual(data['comment_count'], 25)
+            if not data['has_next']:
+                break
+            params = {'cursor': data['next_cursor']}
+        self.assertEqual(seen, [comment.id for comment in reversed(self.comments)])
+
+    def test_since_returns_only_newer_comments(self):
+        newest_cursor = self.client.get(self.url).json()['newest_cursor']
+        self.assertEqual(self._ids(self.client.get(self.url, {'since': newest_cursor}).json()), [])
+
+        added = [Comment.objects.create(user=self.user, post=self.post, content=f'new {i}') for i in range(12)]
+        data = self.client.get(self.url, {'since': newest_cursor}).json()
+        # The oldest ten of the new comments, newest first, and a hint to poll again
+        self.assertEqual(self._ids(data), [comment.id for comment in reversed(added[:10])])
+        self.assertTrue(data['has_newer'])
+        data = self.client.get(self.url, {'since': data['newest_cursor']}).json()
+        self.assertEqual(self._ids(data), [added[11].id, added[10].id])
+        self.assertFalse(data['has_newer'])
+
+    def test_first_pages_are_cached_until_comments_change(self):
+        first = self.client.get(self.url).json()
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(self.url).json()
+            second = self.client.get(self.url, {'cursor': first['next_cursor']}).json()
+        # Only the post lookups
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(cached, first)
+        self.assertEqual(self._ids(second)[0], self.comments[14].id)
+
+        added = Comment.objects.create(user=self.user, post=self.post, content='fresh')
+        self.assertEqual(self._ids(self.client.get(self.url).json())[0], added.id)
+        added.delete()
+        self.assertEqual(self._ids(self.client.get(self.url).json())[0], self.comments[-1].id)
+
+    def test_cached_html_is_the_same_for_every_viewer(self):
+        anonymous = self.client.get(self.url).json()
+        self.client.force_login(self.user)
+        author = self.client.get(self.url).json()
+        self.assertEqual(author['comments_html'], anonymous['comments_html'])
+        self.assertEqual((anonymous['viewer_id'], author['viewer_id']), (None, self.user.id))
+        self.assertIn(f'data-author-id="{self.user.id}"', author['comments_html'])
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'nonsense'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'since': '!!'}).status_code, 400)
+
+
+class CommentThreadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('threader', password='x')
+        cls.post = Post.objects.create(title='Threads', content='<p>x</p>', author=cls.user, status='published')
+        cls.other_root = Comment.objects.create(user=cls.user, post=cls.post, content='other')
+        cls.root = Comment.objects.create(user=cls.user, post=cls.post, content='root')
+        cls.first = Comment.objects.create(user=cls.user, post=cls.post, parent=cls.root, content='first')
+        cls.nested = Comment.objects.create(user=cls.user, post=cls.post, parent=cls.first, content='nested')
+        cls.second = Comment.objects.create(user=cls.user, post=cls.post, parent=cls.root, content='second')
+        cls.third = Comment.objects.create(user=cls.user, post=cls.post, parent=cls.root, content='third')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('interactions:get_comments', kwargs={'post_id': self.post.id})
+
+    def _ids(self, html):
+        return [int(i) for i in re.findall(r'comment-item[^"]*" data-comment-id="(\d+)"', html)]
+
+    def test_path_orders_a_thread_depth_first(self):
+        self.assertEqual((self.nested.root_id, self.nested.depth), (self.root.id, 2))
+        self.assertTrue(self.nested.path.startswith(self.first.path))
+        self.assertEqual(
+            list(Comment.objects.filter(root=self.root).order_by('path')),
+            [self.first, self.nested, self.second, self.third],
+        )
+        self.root.refresh_from_db()
+        self.assertEqual(self.root.reply_count, 4)
+
+    def test_page_shows_first_replies_and_thread_loads_the_rest(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url).json()
+        # One query for the top-level comments, one for every shown reply
+        self.assertEqual(len([q for q in queries if 'interactions_comment' in q['sql']]), 2)
+        self.assertEqual(
+            self._ids(data['comments_html']),
+            [self.root.id, self.first.id, self.nested.id, self.second.id, self.other_root.id],
+        )
+        self.assertIn('View all 4 replies', data['comments_html'])
+
+        thread = self.client.get(self.url, {'thread': self.root.id}).json()
+        self.assertEqual(
+            self._ids(thread['comments_html']), [self.first.id, self.nested.id, self.second.id, self.third.id],
+        )
+        self.assertEqual((thread['has_next'], thread['next_cursor']), (False, None))
+
+    def test_thread_pages_follow_the_path_cursor(self):
+        more = [
+            Comment.objects.create(user=self.user, post=self.post, parent=self.root, content=f'reply {i}')
+            for i in range(THREAD_REPLIES_PER_PAGE)
+        ]
+        seen, params, pages = [], {'thread': self.root.id}, 0
+        while True:
+            data = self.client.get(self.url, params).json()
+            seen.extend(self._ids(data['comments_html']))
+            pages += 1
+            if not data['has_next']:
+                break
+            params = {'thread': self.root.id, 'cursor': data['next_cursor']}
+        self.assertEqual(pages, 2)
+        self.assertEqual(seen, [self.first.id, self.nested.id, self.second.id, self.third.id] + [c.id for c in more])
+
+        for cursor in ('not-a-path', '12/', self.first.path + 'x'):
+            response = self.client.get(self.url, {'thread': self.root.id, 'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+    def test_reply_and_delete_keep_counts(self):
+        add = reverse('interactions:add_comment', kwargs={'post_id': self.post.id})
+        data = self.client.post(add, {'content': 'late reply', 'parent_id': self.nested.id}).json()
+        self.assertEqual((data['parent_id'], data['root_id']), (self.nested.id, self.root.id))
+        self.root.refresh_from_db()
+        self.assertEqual(self.root.reply_count, 5)
+
+        # Deleting a reply takes its own replies with it
+        self.client.post(reverse('interactions:delete_comment', kwargs={'comment_id': self.first.id}))
+        self.root.refresh_from_db()
+        self.post.refresh_from_db()
+        self.assertEqual(self.root.reply_count, 2)
+        self.assertEqual(self.post.comment_count, Comment.objects.filter(post=self.post).count())
+
+    def test_invalid_replies_are_rejected(self):
+        elsewhere = Post.objects.create(title='Elsewhere', content='<p>x</p>', author=self.user, status='published')
+        add = reverse('interactions:add_comment', kwargs={'post_id': elsewhere.id})
+        self.assertEqual(self.client.post(add, {'content': 'x', 'parent_id': self.root.id}).status_code, 400)
+
+        parent = self.root
+        for _ in range(MAX_REPLY_DEPTH):
+            parent = Comment.objects.create(user=self.user, post=self.post, parent=parent, content='deeper')
+        add = reverse('interactions:add_comment', kwargs={'post_id': self.post.id})
+        self.assertEqual(self.client.post(add, {'content': 'x', 'parent_id': parent.id}).status_code, 400)
+
+
+class LikeToggleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='x')
+        cls.reader = User.objects.create_user('reader', password='x')
+        cls.post = Post.objects.create(title='Likeable', content='<p>x</p>', author=cls.author, status='published')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+        self.url = reverse('interactions:toggle_like', kwargs={'post_id': self.post.id})
+
+    def test_toggle_keeps_counter_and_rows_in_step(self):
+        self.assertEqual(self.client.post(self.url).json(), {'liked': True, 'like_count': 1})
+        self.assertTrue(Like.objects.filter(user=self.reader, post=self.post).exists())
+        self.assertEqual(self.client.post(self.url).json(), {'liked': False, 'like_count': 0})
+        self.assertFalse(Like.objects.exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+    def test_each_toggle_runs_a_fixed_set_of_statements(self):
+        # Lock the post row, DELETE the like, INSERT it on a miss, adjust the
+        # counter; plus the SAVEPOINT/RELEASE pair atomic() runs inside a test
+        for click in range(1, 7):
+            liked = click % 2 == 1
+            with self.assertNumQueries(6 if liked else 5):
+                self.assertEqual(likes.toggle(self.reader.id, self.post.id), (liked, int(liked)))
+        for _ in range(3):
+            likes.toggle(self.author.id, self.post.id)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(list(Like.objects.values_list('user_id', flat=True)), [self.author.id])
+
+    def test_retry_with_same_key_does_not_toggle_again(self):
+        first = self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='click-1').json()
+        retry = self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='click-1').json()
+        self.assertEqual(first, {'liked': True, 'like_count': 1})
+        self.assertEqual(retry, first)
+        self.assertEqual(Like.objects.count(), 1)
+        # A new click gets a new key
+        self.assertEqual(
+            self.client.post(self.url, {'idempotency_key': 'click-2'}).json(), {'liked': False, 'like_count': 0},
+        )
+
+    def test_invalid_key_is_rejected(self):
+        response = self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='not a key!')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Like.objects.exists())
+
+    def test_draft_post_cannot_be_liked(self):
+        draft = Post.objects.create(title='Draft', content='<p>x</p>', author=self.author)
+        response = self.client.post(reverse('interactions:toggle_like', kwargs={'post_id': draft.id}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Like.objects.exists())
+
+
+@override_settings(LIKE_WRITE_BEHIND=True, BACKGROUND_JOBS_SYNC=True)
+class LikeWriteBehindTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='x')
+        cls.reader = User.objects.create_user('reader', password='x')
+        cls.post = Post.objects.create(title='Viral', content='<p>x</p>', author=cls.author, status='published')
+
+    def setUp(self):
+        cache.clear()
+
+    def _like_count(self):
+        self.post.refresh_from_db()
+        return self.post.like_count
+
+    def test_clicks_are_buffered_and_merged_into_reads(self):
+        Like.objects.create(user=self.author, post=self.post)
+        self.assertEqual(likes.toggle(self.reader.id, self.post.id), (True, 2))
+
+        # Nothing applied yet, but the reader sees their like
+        self.assertEqual(self._like_count(), 1)
+        self.assertFalse(Like.objects.filter(user=self.reader).exists())
+        self.assertEqual(liked_post_ids(self.reader, [self.post]), {self.post.id})
+        self.assertEqual(likes.post_like_count(self.post), 2)
+
+        self.assertEqual(likes.toggle(self.author.id, self.post.id), (False, 1))
+        self.assertEqual(liked_post_ids(self.author, Post.objects.all()), set())
+
+    def test_list_pages_show_pending_likes(self):
+        Like.objects.create(user=self.author, post=self.post)
+        self.client.force_login(self.author)
+        # The author's card is cached with the stored count first
+        self.assertContains(self.client.get(reverse('posts:my_posts')), '1 likes')
+        likes.toggle(self.reader.id, self.post.id)
+        self.assertContains(self.client.get(reverse('posts:my_posts')), '2 likes')
+
+        self.client.force_login(self.reader)
+        count = r'like-count text-sm font-medium">2<'
+        for url in (reverse('posts:list'), reverse('accounts:profile', kwargs={'username': self.author.username})):
+            self.assertRegex(self.client.get(url).content.decode(), count)
+        self.assertRegex(self.client.get(reverse('feeds:home_page')).json()['posts_html'], count)
+
+    def test_flush_applies_latest_click_per_user(self):
+        Like.objects.create(user=self.author, post=self.post)
+        for _ in range(3):
+            likes.toggle(self.reader.id, self.post.id)
+        likes.toggle(self.author.id, self.post.id)
+
+        self.assertEqual(likes.flush_pending_likes(), 4)
+        self.assertFalse(PendingLike.objects.exists())
+        self.assertEqual(list(Like.objects.values_list('user', flat=True)), [self.reader.id])
+        self.assertEqual(self._like_count(), 1)
+        self.assertEqual(likes.like_state(self.reader.id, self.post.id), (True, 1))
+
+    def test_toggle_schedules_a_flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            likes.toggle(self.reader.id, self.post.id)
+        self.assertTrue(Like.objects.filter(user=self.reader).exists())
+        self.assertEqual(self._like_count(), 1)
+
+
+# Needs a database whose transactions really run side by side and lock rows;
+# SQLite serializes writers and skips these
+@skipUnlessDBFeature('has_select_for_update')
+class LikeToggleConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(f'clicker_{i}', password='x') for i in range(self.THREADS)]
+        self.post = Post.objects.create(title='Hot', content='<p>x</p>', author=self.users[0], status='published')
+
+    def _run_together(self, calls):
+        """Run every call in its own thread, all released at once"""
+        barrier = threading.Barrier(len(calls))
+
+        def run(call):
+            try:
+                barrier.wait()
+                return call()
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(len(calls)) as executor:
+            return list(executor.map(run, calls))
+
+    def _assert_counter_matches_rows(self):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, Like.objects.filter(post=self.post).count())
+
+    def test_many_users_liking_at_once(self):
+        results = self._run_together([
+            lambda user=user: likes.toggle(user.id, self.post.id) for user in self.users
+        ])
+        self.assertTrue(all(liked for liked, _ in results))
+        # Each toggle saw the likes committed before it
+        self.assertEqual(sorted(count for _, count in results), list(range(1, self.THREADS + 1)))
+        self._assert_counter_matches_rows()
+        self.assertEqual(self.post.like_count, self.THREADS)
+
+    def test_one_user_clicking_repeatedly(self):
+        user = self.users[1]
+        clicks = self.THREADS - 1
+        results = self._run_together([lambda: likes.toggle(user.id, self.post.id)] * clicks)
+        # Toggles alternate starting with a like, so an odd number of clicks ends liked
+        unlikes = clicks // 2
+        self.assertEqual(sorted(liked for liked, _ in results), [False] * unlikes + [True] * (clicks - unlikes))
+        self._assert_counter_matches_rows()
+        self.assertEqual(self.post.like_count, clicks % 2)
+
+    def test_retries_with_one_key_toggle_once(self):
+        user = self.users[1]
+        self._run_together([lambda: likes.toggle(user.id, self.post.id, 'retry')] * self.THREADS)
+        self._assert_counter_matches_rows()
+        self.assertEqual(self.post.like_count, 1)
+
+    @override_settings(LIKE_WRITE_BEHIND=True)
+    def test_write_behind_flush_matches_rows(self):
+        self._run_together([
+            lambda user=user: likes.toggle(user.id, self.post.id) for user in self.users
+        ] + [likes.flush_pending_likes] * 2)
+        likes.flush_pending_likes()
+        self._assert_counter_matches_rows()
+        self.assertEqual(self.post.like_count, self.THREADS)
@@ -1,45 +1,51 @@
+import re
+
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.db import transaction
+from django.http import Http404, JsonResponse
 from django.views.decorators.http import require_POST
-from django.core.paginator import Paginator
 from django.template.loader import render_to_string
+from freespaces.query_budget import query_budget
 from posts.models import Post
-from .models import Like, Comment
+from posts.pagination import InvalidCursor, KeysetPage, NewerPage
+from . import comment_cache, likes
+from .models import MAX_REPLY_DEPTH, PATH_SEGMENT_WIDTH, REPLIES_SHOWN, Comment, attach_replies
+
+COMMENTS_PER_PAGE = 10
+THREAD_REPLIES_PER_PAGE = 50
+# A thread cursor is the path of the last reply shown
+THREAD_CURSOR_PATTERN = re.compile(r'(?:[0-9]{%d}/){1,%d}' % (PATH_SEGMENT_WIDTH, MAX_REPLY_DEPTH + 1))
+
 
 # Create your views here.
+@query_budget(12)
 @login_required
 @require_POST
 def toggle_like(request, post_id):
     """Toggle like/unlike for a post via AJAX"""
-    post = get_object_or_404(Post, id=post_id, status='published')
-    
-    like, created = Like.objects.get_or_create(
-        user=request.user,
-        post=post
-    )
-    
-    if not created:
-        # Like already exists, so remove it (unlike)
-        like.delete()
-        liked = False
-    else:
-        # New like created
-        liked = True
-    
-    # Get updated like count
-    like_count = post.likes.count()
-    
+    # Clients send a new key per click and the same key when retrying it,
+    # so a retried request cannot toggle the like back
+    token = request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key')
+    if token is not None and not likes.TOKEN_PATTERN.fullmatch(token):
+        return JsonResponse({'error': 'Invalid idempotency key'}, status=400)
+
+    result = likes.toggle(request.user.id, post_id, token)
+    if result is None:
+        raise Http404('No published post with this id')
+    liked, like_count = result
+
     return JsonResponse({
         'liked': liked,
         'like_count': like_count
     })
 
 
+@query_budget(12)
 @login_required
 @require_POST
 def add_comment(request, post_id):
-    """Add a comment to a post via AJAX"""
+    """Add a comment, or with parent_id a reply, to a post via AJAX"""
     post = get_object_or_404(Post, id=post_id, status='published')
     content = request.POST.get('content', '').strip()
     
@@ -48,16 +54,30 @@ def add_comment(request, post_id):
     
     if len(content) > 1000:
         return JsonResponse({'error': 'Comment is too long (max 1000 characters)'}, status=400)
-    
-    # Create the comment
-    comment = Comment.objects.create(
-        user=request.user,
-        post=post,
-        content=content
-    )
+
+    parent = None
+    if request.POST.get('parent_id'):
+        try:
+            parent = Comment.objects.only('id', 'root_id', 'path', 'depth').get(
+                id=int(request.POST['parent_id']), post=post,
+            )
+        except (ValueError, Comment.DoesNotExist):
+            return JsonResponse({'error': 'The comment you replied to no longer exists'}, status=400)
+        if parent.depth >= MAX_REPLY_DEPTH:
+            return JsonResponse({'error': 'This thread is nested too deeply to reply to'}, status=400)
+    
+    # Create the comment; the counters are bumped in the same transaction
+    with transaction.atomic():
+        comment = Comment.objects.create(
+            user=request.user,
+            post=post,
+            parent=parent,
+            content=content
+        )
     
     # Get updated comment count
-    comment_count = post.comments.count()
+    post.refresh_from_db(fields=['comment_count'])
+    comment_count = post.comment_count
     
     # Render the comment HTML
     comment_html = render_to_string('interactions/comment_item.html', {
@@ -68,39 +88,87 @@ def add_comment(request, post_id):
     return JsonResponse({
         'success': True,
         'comment_html': comment_html,
-        'comment_count': comment_count
+        'comment_count': comment_count,
+        'parent_id': comment.parent_id,
+        'root_id': comment.root_id,
+        'viewer_id': request.user.id
     })
 
 
+@query_budget(8)
 def get_comments(request, post_id):
-    """Get paginated comments for a post via AJAX"""
-    post = get_object_or_404(Post, id=post_id, status='published')
-    page = request.GET.get('page', 1)
-    
-    comments = post.comments.select_related('user', 'user__profile').all()
-    paginator = Paginator(comments, 10)  # 10 comments per page
-    
+    """
+    Get a page of comments for a post via AJAX, newest first.
+
+    Pages list top-level comments, each with the first few replies of its
+    thread. ?cursor= continues after a page's next_cursor; ?since= returns
+    only the top-level comments added after a newest_cursor, so polling is
+    one indexed query; ?thread=<id> pages through the replies under one
+    top-level comment in reading order, continuing with ?cursor=. The first pages come from comment_cache and
+    are the same for everyone.
+    """
+    post = get_object_or_404(Post.objects.only('id', 'comment_count'), id=post_id, status='published')
+    comments = Comment.objects.filter(post=post).select_related('user', 'user__profile')
+    if 'thread' in request.GET:
+        return _thread_replies(request, post, comments)
+
+    roots = comments.filter(root__isnull=True)
+    cursor = request.GET.get('cursor')
+
     try:
-        comments_page = paginator.page(page)
-    except:
-        comments_page = paginator.page(1)
-    
-    # Render comments HTML
-    comments_html = render_to_string('interactions/comments_list.html', {
-        'comments': comments_page,
-        'user': request.user
+        if 'since' in request.GET:
+            page = NewerPage(roots, request.GET['since'], per_page=COMMENTS_PER_PAGE)
+            attach_replies(page, REPLIES_SHOWN)
+            # Polls only add comments, so they skip the list wrapper and empty state
+            data = {
+                'comments_html': render_to_string('interactions/comment_items.html', {'comments': page}),
+                'has_next': False,
+                'next_cursor': None,
+                'has_newer': page.has_newer,
+                'newest_cursor': page.newest_cursor,
+            }
+        else:
+            data = comment_cache.get_page(post.id, roots, cursor, per_page=COMMENTS_PER_PAGE)
+            if data is None:
+                data = comment_cache.render_page(KeysetPage(roots, cursor=cursor, per_page=COMMENTS_PER_PAGE))
+            data = {**data, 'has_newer': False}
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    return JsonResponse({
+        **data,
+        # The stored counter, not a COUNT(*) over the comments
+        'comment_count': post.comment_count,
+        # Shows this viewer's delete buttons in the shared HTML
+        'viewer_id': request.user.id,
     })
-    
+
+
+def _thread_replies(request, post, comments):
+    """A page of the replies under one top-level comment, keyed on comment_thread_idx"""
+    try:
+        root_id = int(request.GET['thread'])
+    except ValueError:
+        return JsonResponse({'error': 'Invalid thread'}, status=400)
+    replies = comments.filter(root_id=root_id).order_by('path')
+    cursor = request.GET.get('cursor')
+    if cursor:
+        if not THREAD_CURSOR_PATTERN.fullmatch(cursor):
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        replies = replies.filter(path__gt=cursor)
+    # One extra row tells whether another page follows
+    replies = list(replies[:THREAD_REPLIES_PER_PAGE + 1])
+    has_next = len(replies) > THREAD_REPLIES_PER_PAGE
+    replies = replies[:THREAD_REPLIES_PER_PAGE]
     return JsonResponse({
-        'comments_html': comments_html,
-        'has_next': comments_page.has_next(),
-        'has_previous': comments_page.has_previous(),
-        'current_page': comments_page.number,
-        'total_pages': paginator.num_pages,
-        'comment_count': paginator.count
+        'comments_html': render_to_string('interactions/comment_items.html', {'comments': replies}),
+        'has_next': has_next,
+        'next_cursor': replies[-1].path if has_next else None,
+        'viewer_id': request.user.id,
     })
 
 
+@query_budget(12)
 @login_required
 @require_POST  
 def delete_comment(request, comment_id):
@@ -111,12 +179,12 @@ def delete_comment(request, comment_id):
     if comment.user != request.user:
         return JsonResponse({'error': 'You can only delete your own comments'}, status=403)
     
-    post_id = comment.post.id
-    comment.delete()
+    post_id = comment.post_id
+    with transaction.atomic():
+        comment.delete()
     
     # Get updated comment count
-    post = get_object_or_404(Post, id=post_id)
-    comment_count = post.comments.count()
+    comment_count = Post.objects.filter(id=post_id).values_list('comment_count', flat=True).first() or 0
     
     return JsonResponse({
         'success': True,
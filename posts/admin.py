@@ -46,19 +46,13 @@ class PostAdmin(admin.ModelAdmin):
         """
         if not change:  # If creating new post
             obj.author = request.user
-        else:  # If editing existing post
-            # Get the original post from database to check for author changes
-            try:
-                original_post = Post.objects.get(pk=obj.pk)
-                if original_post.author != obj.author:
-                    # Author change detected - this should not happen with readonly field
-                    # but we add this as an extra security layer
-                    raise PermissionDenied(
-                        "Changing post authorship is not allowed for security reasons. "
-                        "Posts must maintain their original author."
-                    )
-            except Post.DoesNotExist:
-                # This shouldn't happen for existing posts, but handle gracefully
-                pass
+        elif obj.has_changed('author'):
+            # Compared against the author the post was loaded with, so no
+            # extra query. This should not happen with the readonly field,
+            # but we add this as an extra security layer
+            raise PermissionDenied(
+                "Changing post authorship is not allowed for security reasons. "
+                "Posts must maintain their original author."
+            )
 
         super().save_model(request, obj, form, change)
\ No newline at end of file
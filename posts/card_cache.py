@@ -0,0 +1,148 @@
+"""
+Cache of rendered post cards for list pages.
+
+A card's cache key carries three version numbers: one for the post (bumped
+when the post is saved or deleted, or gets a like or comment), one for its
+author (bumped when the author's profile, avatar or username changes) and
+one for its category (bumped when the category is renamed or deleted).
+Bumping a version orphans the old entries instead of deleting them, so no
+signal handler needs to know which pages a card was rendered on.
+
+Cached HTML must not depend on the viewer. Card templates put
+LIKE_BUTTON_SLOT where the like button goes, and the {% post_card %} tag
+fills it in for the current user on every render.
+"""
+import time
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+LIKE_BUTTON_SLOT = '<!-- like-button -->'
+
+HITS_KEY = 'post_card:stats:hits'
+MISSES_KEY = 'post_card:stats:misses'
+
+
+def _post_version_key(post_id):
+    return f'post_card:post_version:{post_id}'
+
+
+def _author_version_key(user_id):
+    return f'post_card:author_version:{user_id}'
+
+
+def _category_version_key(category_id):
+    return f'post_card:category_version:{category_id}'
+
+
+def _new_version():
+    # Versions start from the clock, not 1, so a version key that was evicted
+    # and recreated can never match a card cached under the old value
+    return int(time.time() * 1000)
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), None)
+
+
+def bump_post(post_id):
+    """Invalidate every cached card of one post"""
+    _bump(_post_version_key(post_id))
+
+
+def bump_author(user_id):
+    """Invalidate every cached card of posts written by one user"""
+    _bump(_author_version_key(user_id))
+
+
+def bump_category(category_id):
+    """Invalidate every cached card of posts in one category"""
+    _bump(_category_version_key(category_id))
+
+
+def _versions(version_keys):
+    versions = cache.get_many(version_keys)
+    missing = {key: _new_version() for key in version_keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+
+def render_cards(posts, template_name):
+    """
+    Return {post_id: card_html} for posts, rendering only cache misses.
+
+    Costs a fixed number of cache round trips per page (versions, cards,
+    stores and stats) however many posts are on it.
+    """
+    posts = list(posts)
+    if not posts:
+        return {}
+
+    version_keys = set()
+    for post in posts:
+        version_keys.add(_post_version_key(post.pk))
+        version_keys.add(_author_version_key(post.author_id))
+        if post.category_id:
+            version_keys.add(_category_version_key(post.category_id))
+    versions = _versions(list(version_keys))
+
+    card_keys = {
+        post.pk: 'post_card:{}:{}:{}:{}:{}'.format(
+            template_name,
+            post.pk,
+            versions[_post_version_key(post.pk)],
+            versions[_author_version_key(post.author_id)],
+            versions[_category_version_key(post.category_id)] if post.category_id else '',
+        )
+        for post in posts
+    }
+    cached = cache.get_many(list(card_keys.values()))
+
+    cards = {}
+    rendered = {}
+    for post in posts:
+        key = card_keys[post.pk]
+        if key in cached:
+            cards[post.pk] = cached[key]
+        else:
+            html = render_to_string(template_name, {'post': post})
+            cards[post.pk] = rendered[key] = html
+
+    if rendered:
+        cache.set_many(rendered, CARD_CACHE_TIMEOUT)
+    _record(hits=len(posts) - len(rendered), misses=len(rendered))
+    return cards
+
+
+def _record(hits, misses):
+    for key, amount in ((HITS_KEY, hits), (MISSES_KEY, misses)):
+        if not amount:
+            continue
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            cache.add(key, 0, None)
+            cache.incr(key, amount)
+
+
+def stats():
+    """Hit/miss counters shared by every worker using the same cache"""
+    values = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits = values.get(HITS_KEY, 0)
+    misses = values.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else 0.0,
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,98 @@
+"""
+Process-local registry of categories.
+
+There are few categories and they rarely change, so every process keeps
+all of them in memory, by id and by name, instead of querying the table on
+each request. Reads check one cache key, VERSION_KEY, shared by all
+workers: saving or deleting a category, or changing a post count, bumps it,
+and each process reloads the registry the next time it reads.
+
+The bump happens both right away and again once the transaction commits,
+so a worker that reloaded before the commit (and read the old rows) reloads
+once more.
+
+The Category instances are shared between requests and threads; treat
+them as read-only.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'category_registry:version'
+
+_lock = threading.Lock()
+_loaded = None
+
+
+class _Registry:
+    def __init__(self, version, categories):
+        self.version = version
+        self.by_name_order = tuple(sorted(categories, key=lambda category: category.name))
+        self.by_id = {category.pk: category for category in categories}
+        self.by_name = {category.name: category for category in categories}
+
+
+def _new_version():
+    # Start from the clock so a recreated key never matches a loaded registry
+    return int(time.time() * 1000)
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Another worker may set it first; everyone uses the stored value
+        new_version = _new_version()
+        cache.add(VERSION_KEY, new_version, None)
+        version = cache.get(VERSION_KEY, new_version)
+    return version
+
+
+def _registry():
+    global _loaded
+    version = _version()
+    registry = _loaded
+    if registry is None or registry.version != version:
+        with _lock:
+            registry = _loaded
+            if registry is None or registry.version != version:
+                # Imported late: posts.models imports this module
+                from .models import Category
+                registry = _Registry(version, list(Category.objects.all()))
+                _loaded = registry
+    return registry
+
+
+def bump():
+    """Make every process reload the registry on its next read"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, _new_version(), None)
+
+
+def invalidate():
+    """bump() now and again after the current transaction commits"""
+    bump()
+    transaction.on_commit(bump)
+
+
+def categories():
+    """Every category, by name"""
+    return _registry().by_name_order
+
+
+def get(category_id):
+    """The category with this id, or None"""
+    return _registry().by_id.get(category_id)
+
+
+def get_by_name(name):
+    """The category with this name, or None"""
+    return _registry().by_name.get(name)
+
+
+def popular(limit):
+    """The limit categories with the most published posts, ties by name"""
+    return sorted(categories(), key=lambda category: -category.post_count)[:limit]
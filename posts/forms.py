@@ -1,10 +1,63 @@
+import copy
+
 from django import forms
-from .models import Post, Category
+from django.core.exceptions import ValidationError
+from django.utils.choices import BaseChoiceIterator
+from .models import Category, Post
+from . import category_registry
+
+
+class _RegistryChoices(BaseChoiceIterator):
+    def __init__(self, field):
+        self.field = field
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for category in category_registry.categories():
+            yield (category.pk, category.name)
+
+
+class CategoryChoiceField(forms.ModelChoiceField):
+    """Category select whose choices and validation read the category registry, not the table"""
+
+    def _get_choices(self):
+        return _RegistryChoices(self)
+
+    choices = property(_get_choices, forms.ChoiceField.choices.fset)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, self.queryset.model):
+            value = value.pk
+        try:
+            category = category_registry.get(int(value))
+        except (TypeError, ValueError):
+            category = None
+        if category is None:
+            raise ValidationError(
+                self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value},
+            )
+        # The registry's instances are shared between threads
+        return copy.copy(category)
+
 
 class PostForm(forms.ModelForm):
+    # Declared instead of listed in Meta.fields, so model validation leaves
+    # it alone and does not look the category up in the table again;
+    # save() assigns it
+    category = CategoryChoiceField(
+        queryset=Category.objects.none(), required=False,
+        widget=forms.Select(attrs={
+            'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500'
+        }),
+    )
+    field_order = ('title', 'content', 'category', 'featured_image', 'status')
+
     class Meta:
         model = Post
-        fields = ('title', 'content', 'category', 'featured_image', 'status')
+        fields = ('title', 'content', 'featured_image', 'status')
         widgets = {
             'title': forms.TextInput(attrs={
                 'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500',
@@ -15,9 +68,6 @@ class PostForm(forms.ModelForm):
                 'rows': 10,
                 'placeholder': 'Share your story...'
             }),
-            'category': forms.Select(attrs={
-                'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500'
-            }),
             'featured_image': forms.FileInput(attrs={
                 'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500',
                 'accept': 'image/*'
@@ -29,4 +79,11 @@ class PostForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['category'].empty_label = "Select a category (optional)"
\ No newline at end of file
+        self.fields['category'].empty_label = "Select a category (optional)"
+        if self.instance.category_id:
+            self.initial.setdefault('category', self.instance.category_id)
+
+    def save(self, commit=True):
+        category = self.cleaned_data.get('category')
+        self.instance.category_id = category.pk if category else None
+        return super().save(commit)
@@ -0,0 +1,132 @@
+"""
+Resized derivatives of post featured images.
+
+Uploads are stored at whatever size the camera produced. For each use
+(card, hero, related) a few fixed widths are generated with Pillow, each as
+WebP with a JPEG fallback, under post_images/variants/ next to the
+originals. Post.image_variants records them:
+
+    {'source': 'post_images/3f/3fa9...c1.jpg',
+     'card': [{'width': 400, 'height': 300,
+               'webp': 'post_images/variants/8c/8c41...07.webp',
+               'jpeg': 'post_images/variants/d2/d20e...9a.jpg'}, ...],
+     ...}
+
+Like the originals, derivatives are named by content and may be shared
+between posts; their references are counted in posts.media.
+
+'source' is the image the derivatives were made from, so stale entries are
+easy to spot. Generation runs off the request path (see
+posts.models.build_post_image_variants); until it has run, templates fall
+back to the original file.
+"""
+import io
+import os
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from . import media
+
+# Widths per use, smallest first; roughly 1x and 2x of the rendered size
+VARIANTS = {
+    'card': (400, 800),
+    'hero': (960, 1600),
+    'related': (320, 640),
+}
+
+# <img sizes> per use, matching the layouts in the templates
+SIZES = {
+    'card': '(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw',
+    'hero': '(min-width: 1024px) 896px, 100vw',
+    'related': '(min-width: 768px) 33vw, 100vw',
+}
+
+# (key in image_variants, Pillow format, file extension, save options)
+FORMATS = (
+    ('webp', 'WEBP', 'webp', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+VARIANT_DIR = 'variants'
+
+
+def _target_widths(original_width, widths):
+    """Widths to generate for an image original_width pixels wide"""
+    # Never upscale; an image narrower than every width gets one copy at its own size
+    targets = [width for width in widths if width < original_width]
+    if len(targets) < len(widths):
+        targets.append(min(original_width, widths[-1]))
+    return sorted(set(targets))
+
+
+def _variant_name(source_name, variant, width, extension):
+    directory, filename = os.path.split(source_name)
+    stem = os.path.splitext(filename)[0]
+    return f'{directory}/{VARIANT_DIR}/{stem}-{variant}-{width}.{extension}'
+
+
+def _encode(image, pil_format, options):
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha; flatten transparent images onto white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_variants(image_file):
+    """
+    Write every derivative of image_file (a FieldFile) to its storage.
+
+    Returns the dict to store in Post.image_variants. Raises OSError or
+    Image.DecompressionBombError if the file is not a usable image.
+    """
+    storage = image_file.storage
+    largest = max(width for widths in VARIANTS.values() for width in widths)
+
+    with image_file.open('rb') as f, Image.open(f) as image:
+        # Let the JPEG decoder downscale while decoding; far cheaper than
+        # decoding a full camera-sized frame and resizing it afterwards
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+        variants = {'source': image_file.name}
+        written = []
+        try:
+            for variant, widths in VARIANTS.items():
+                variants[variant] = []
+                for width in _target_widths(image.width, widths):
+                    height = max(1, round(image.height * width / image.width))
+                    resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                    entry = {'width': width, 'height': height}
+                    for key, pil_format, extension, options in FORMATS:
+                        name = _variant_name(image_file.name, variant, width, extension)
+                        # Stored under a name derived from the encoded bytes
+                        entry[key] = storage.save(name, _encode(resized, pil_format, options))
+                        written.append(entry[key])
+                    variants[variant].append(entry)
+        except Exception:
+            # Files may be shared with other images, so leave what was
+            # written to gc_media instead of deleting it
+            media.register(written)
+            raise
+    return variants
+
+
+def variant_files(variants):
+    """Storage names of every derivative listed in an image_variants dict"""
+    for variant in VARIANTS:
+        for entry in (variants or {}).get(variant, []):
+            for key, *_ in FORMATS:
+                if entry.get(key):
+                    yield entry[key]
+
+
+def srcset(entries, key, storage):
+    """srcset attribute value for one format of one variant's entries"""
+    return ', '.join(f'{storage.url(entry[key])} {entry["width"]}w' for entry in entries)
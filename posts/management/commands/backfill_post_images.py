@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from posts.models import Post, build_post_image_variants
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized featured image derivatives of existing posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Number of post ids loaded per batch')
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild derivatives that are already up to date')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many posts need derivatives')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = Post.objects.exclude(featured_image='').exclude(featured_image__isnull=True)
+
+        checked = built = 0
+        last_id = 0
+        while True:
+            # Walk the table in primary key order so every batch is a range scan
+            batch = list(
+                posts.filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'featured_image', 'image_variants')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            checked += len(batch)
+
+            for post_id, image_name, variants in batch:
+                if not options['force'] and (variants or {}).get('source') == image_name:
+                    continue
+                built += 1
+                if not options['dry_run']:
+                    # Runs inline; this command is already off the request path
+                    build_post_image_variants(post_id, force=options['force'])
+
+            self.stdout.write(f'Checked {checked} posts, {built} need derivatives')
+
+        verb = 'Would build' if options['dry_run'] else 'Built'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} posts. {verb} derivatives for {built}.'))
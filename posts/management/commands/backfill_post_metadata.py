@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from posts import card_cache
+from posts.models import Post
+
+METADATA_FIELDS = ['excerpt', 'word_count', 'reading_time']
+
+
+class Command(BaseCommand):
+    help = 'Compute the stored excerpt, word count and reading time of existing posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts loaded and updated per batch')
+        parser.add_argument('--missing-only', action='store_true',
+                            help='Only fill posts that have no excerpt yet')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        posts = Post.objects.all()
+        if options['missing_only']:
+            posts = posts.filter(excerpt='')
+
+        checked = updated = 0
+        last_id = 0
+        while True:
+            # Walk the table in primary key order so every batch is a range scan
+            batch = list(
+                posts.filter(id__gt=last_id).order_by('id').only('id', 'content', *METADATA_FIELDS)[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            checked += len(batch)
+
+            changed = []
+            for post in batch:
+                before = [getattr(post, field) for field in METADATA_FIELDS]
+                post.refresh_content_metadata()
+                if [getattr(post, field) for field in METADATA_FIELDS] != before:
+                    changed.append(post)
+
+            # bulk_update skips save() and its signals, so only the cached
+            # cards (which show the excerpt) need invalidating by hand
+            Post.objects.bulk_update(changed, METADATA_FIELDS)
+            for post in changed:
+                card_cache.bump_post(post.pk)
+            updated += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} posts. Updated {updated}.'))
@@ -0,0 +1,104 @@
+import sys
+import time
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from interactions.models import Comment, Like
+from posts.models import Category, Post
+from posts.transfer import FORMAT_VERSION, dump_record
+
+
+class Command(BaseCommand):
+    help = 'Stream users, categories and posts (with likes and comments) to a JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write, or - for standard output')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows read per query')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.started = time.monotonic()
+
+        if options['path'] == '-':
+            self._export(sys.stdout)
+        else:
+            with open(options['path'], 'w', encoding='utf-8') as out:
+                self._export(out)
+
+    def _progress(self, message):
+        # On stderr, so the export itself can go to stdout
+        self.stderr.write(f'{message} ({time.monotonic() - self.started:.0f}s)')
+
+    def _batches(self, queryset, *fields):
+        """values() rows of queryset in primary key batches, so every query is a range scan"""
+        last_id = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id).order_by('id').values('id', *fields)[:self.batch_size])
+            if not batch:
+                return
+            last_id = batch[-1]['id']
+            yield batch
+
+    def _export(self, out):
+        out.write(dump_record('header', version=FORMAT_VERSION, exported_at=timezone.now()))
+
+        users = 0
+        for batch in self._batches(
+            User.objects.all(), 'username', 'email', 'first_name', 'last_name', 'date_joined', 'profile__bio',
+        ):
+            for row in batch:
+                out.write(dump_record(
+                    'user', username=row['username'], email=row['email'], first_name=row['first_name'],
+                    last_name=row['last_name'], date_joined=row['date_joined'], bio=row['profile__bio'] or '',
+                ))
+            users += len(batch)
+            self._progress(f'Users: {users}')
+
+        for row in Category.objects.order_by('id').values('name', 'created_at'):
+            out.write(dump_record('category', **row))
+
+        posts = likes = comments = 0
+        for batch in self._batches(
+            Post.objects.all(), 'title', 'slug', 'content', 'status', 'author__username', 'category__name',
+            'featured_image', 'created_at', 'updated_at', 'published_at',
+        ):
+            post_ids = [row['id'] for row in batch]
+            likes_by_post = defaultdict(list)
+            for like in Like.objects.filter(post_id__in=post_ids).order_by('id').values(
+                'post_id', 'user__username', 'created_at',
+            ):
+                likes_by_post[like['post_id']].append({'user': like['user__username'], 'created_at': like['created_at']})
+            comments_by_post = defaultdict(list)
+            # Comment id -> its index in its post's list; replies refer to
+            # their parent by that index, which always comes earlier
+            positions = {}
+            for comment in Comment.objects.filter(post_id__in=post_ids).order_by('id').values(
+                'id', 'post_id', 'parent_id', 'user__username', 'content', 'created_at', 'updated_at',
+            ):
+                entries = comments_by_post[comment['post_id']]
+                positions[comment['id']] = len(entries)
+                entries.append({
+                    'user': comment['user__username'], 'content': comment['content'],
+                    'created_at': comment['created_at'], 'updated_at': comment['updated_at'],
+                    'parent': positions.get(comment['parent_id']),
+                })
+
+            for row in batch:
+                out.write(dump_record(
+                    'post', title=row['title'], slug=row['slug'], content=row['content'], status=row['status'],
+                    author=row['author__username'], category=row['category__name'],
+                    featured_image=row['featured_image'] or '', created_at=row['created_at'],
+                    updated_at=row['updated_at'], published_at=row['published_at'],
+                    likes=likes_by_post[row['id']], comments=comments_by_post[row['id']],
+                ))
+            posts += len(batch)
+            likes += sum(len(entries) for entries in likes_by_post.values())
+            comments += sum(len(entries) for entries in comments_by_post.values())
+            self._progress(f'Posts: {posts}, likes: {likes}, comments: {comments}')
+
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {users} users, {posts} posts, {likes} likes and {comments} comments.'
+        ))
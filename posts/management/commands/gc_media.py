@@ -0,0 +1,116 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.utils import timezone
+from posts import media
+from posts.models import MediaFile
+
+
+class Command(BaseCommand):
+    help = 'Delete stored media files that no post or profile references any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows read and files deleted per batch')
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Only delete files unreferenced and untouched for this long')
+        parser.add_argument('--recount', action='store_true',
+                            help='First rebuild reference counts from the database and register '
+                                 'every file in storage (run once after migrating)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be deleted without deleting it')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        if options['recount']:
+            self._recount(options['dry_run'])
+
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        # The default file of a FileField (e.g. the default avatar) is shared
+        # by every row that never uploaded one and is never counted
+        protected = {
+            field.default
+            for model in media.referencing_models()
+            for field in model._meta.fields
+            if isinstance(field, models.FileField) and isinstance(field.default, str)
+        }
+
+        checked = deleted = 0
+        last_id = 0
+        while True:
+            batch = list(
+                MediaFile.objects.filter(ref_count=0, updated_at__lt=cutoff, id__gt=last_id)
+                .order_by('id').values_list('id', 'name')[:self.batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            checked += len(batch)
+
+            candidates = {
+                media_id: name for media_id, name in batch
+                if name not in protected and not self._touched_since(name, cutoff)
+            }
+            if options['dry_run']:
+                deleted += len(candidates)
+                continue
+
+            # Re-check the count under a lock, in case a save referenced
+            # the file again since the batch was read
+            with transaction.atomic():
+                ids = list(
+                    MediaFile.objects.select_for_update()
+                    .filter(id__in=candidates, ref_count=0).values_list('id', flat=True)
+                )
+                MediaFile.objects.filter(id__in=ids).delete()
+            for media_id in ids:
+                default_storage.delete(candidates[media_id])
+            deleted += len(ids)
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} unreferenced files. {verb} {deleted}.'))
+
+    def _touched_since(self, name, cutoff):
+        # The storage refreshes a file's modification time when an upload
+        # of the same bytes reuses it
+        try:
+            return default_storage.get_modified_time(name) >= cutoff
+        except (FileNotFoundError, NotImplementedError):
+            return False
+
+    def _walk_storage(self, path=''):
+        directories, files = default_storage.listdir(path)
+        for name in files:
+            yield f'{path}/{name}' if path else name
+        for directory in directories:
+            yield from self._walk_storage(f'{path}/{directory}' if path else directory)
+
+    def _recount(self, dry_run):
+        counts = Counter()
+        for model in media.referencing_models():
+            rows = model._default_manager.order_by('pk')
+            last_pk = None
+            while True:
+                # Walk the table in primary key order so every batch is a range scan
+                page = rows if last_pk is None else rows.filter(pk__gt=last_pk)
+                batch = list(page.values('pk', *model.MEDIA_FIELDS)[:self.batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1]['pk']
+                for values in batch:
+                    counts.update(model.media_files(values))
+
+        # Files nobody references, including ones stored before counting
+        # existed, get a zero count so the collection below can find them
+        stored = list(self._walk_storage())
+        self.stdout.write(
+            f'Found {len(counts)} referenced files and {len(stored)} files in storage.'
+        )
+        if dry_run:
+            return
+        with transaction.atomic():
+            media.register(stored)
+            media.set_counts(counts)
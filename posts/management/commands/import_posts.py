@@ -0,0 +1,330 @@
+import json
+import os
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from accounts.models import Profile
+from interactions.models import MAX_REPLY_DEPTH, Comment, Like, path_segment
+from posts import category_registry, media, page_cache
+from posts.models import Category, Post
+from posts.slugs import allocate_slugs, slug_base
+from posts.transfer import FORMAT_VERSION, explicit_timestamps
+
+# Record type -> method importing a batch of them
+IMPORTERS = {
+    'user': '_import_users',
+    'category': '_import_categories',
+    'post': '_import_posts',
+}
+
+
+def _datetime(value, default=None):
+    return parse_datetime(value) if value else default
+
+
+class Command(BaseCommand):
+    help = 'Stream users, categories and posts from a JSON Lines file written by export_posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File written by export_posts')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Records inserted per transaction')
+        parser.add_argument('--checkpoint',
+                            help='Progress file, rewritten after every committed batch '
+                                 '(default: <path>.checkpoint)')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue after the last committed batch recorded in the checkpoint')
+        parser.add_argument('--skip-search-index', action='store_true',
+                            help='Do not rebuild search documents and related posts afterwards')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.path = os.path.abspath(options['path'])
+        self.checkpoint_path = options['checkpoint'] or f'{options["path"]}.checkpoint'
+        self.totals = dict.fromkeys(('users', 'categories', 'posts', 'likes', 'comments', 'skipped'), 0)
+
+        # Set while resuming until a batch of posts turns out not to be in
+        # the database yet
+        self.check_imported = options['resume']
+
+        offset = line_number = 0
+        if options['resume']:
+            checkpoint = self._read_checkpoint()
+            if checkpoint['path'] != self.path:
+                raise CommandError(f'{self.checkpoint_path} belongs to {checkpoint["path"]}')
+            offset, line_number = checkpoint['offset'], checkpoint['line']
+            self.totals.update(checkpoint['totals'])
+            self.stdout.write(f'Resuming at line {line_number + 1}')
+
+        self.started = time.monotonic()
+        self.file_size = os.path.getsize(options['path'])
+        # Binary, so byte offsets can be recorded and seeked to
+        with open(options['path'], 'rb') as f:
+            f.seek(offset)
+            batch, batch_type = [], None
+            for raw in f:
+                line_number += 1
+                offset += len(raw)
+                if not raw.strip():
+                    continue
+                try:
+                    record = json.loads(raw)
+                    record_type = record['type']
+                except (ValueError, KeyError, TypeError):
+                    raise CommandError(f'Line {line_number} is not a valid record')
+                if record_type == 'header':
+                    if record.get('version', 0) > FORMAT_VERSION:
+                        raise CommandError(f'File format version {record["version"]} is newer than this importer')
+                    continue
+                if record_type not in IMPORTERS:
+                    raise CommandError(f'Line {line_number} has unknown type "{record_type}"')
+
+                if batch and (record_type != batch_type or len(batch) >= self.batch_size):
+                    self._flush(batch_type, batch)
+                    self._write_checkpoint(batch_end_offset, batch_end_line)
+                    batch = []
+                batch_type = record_type
+                batch.append(record)
+                # The checkpoint after a batch points just past its last record
+                batch_end_offset, batch_end_line = offset, line_number
+
+            if batch:
+                self._flush(batch_type, batch)
+                self._write_checkpoint(batch_end_offset, batch_end_line)
+
+        # bulk_create and update() skip the signals that maintain these
+        category_registry.bump()
+        call_command('reconcile_category_counts', stdout=self.stdout)
+        if not options['skip_search_index']:
+            call_command('rebuild_search_index', batch_size=self.batch_size, stdout=self.stdout)
+            call_command('rebuild_related_posts', stdout=self.stdout)
+        page_cache.bump()
+
+        totals = self.totals
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {totals["users"]} users, {totals["categories"]} categories, {totals["posts"]} posts, '
+            f'{totals["likes"]} likes and {totals["comments"]} comments; skipped {totals["skipped"]} records. '
+            f'Run backfill_post_images once the media files are copied.'
+        ))
+
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise CommandError(f'No checkpoint at {self.checkpoint_path}')
+
+    def _write_checkpoint(self, offset, line_number):
+        # Written to a temporary file and renamed, so a crash never leaves a
+        # half-written checkpoint
+        temporary = f'{self.checkpoint_path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'path': self.path, 'offset': offset, 'line': line_number, 'totals': self.totals}, f)
+        os.replace(temporary, self.checkpoint_path)
+
+        elapsed = time.monotonic() - self.started
+        percent = 100 * offset / self.file_size if self.file_size else 100
+        self.stdout.write(
+            f'{percent:.1f}% (line {line_number}): {self.totals["users"]} users, '
+            f'{self.totals["posts"]} posts, {self.totals["likes"]} likes, '
+            f'{self.totals["comments"]} comments ({elapsed:.0f}s)'
+        )
+
+    def _flush(self, record_type, records):
+        # Each batch commits on its own, so a checkpoint never covers
+        # records that were rolled back
+        with transaction.atomic():
+            getattr(self, IMPORTERS[record_type])(records)
+
+    def _user_ids(self, usernames):
+        return dict(User.objects.filter(username__in=set(usernames)).values_list('username', 'id'))
+
+    def _import_users(self, records):
+        existing = set(self._user_ids(record['username'] for record in records))
+        new = {
+            record['username']: record for record in records if record['username'] not in existing
+        }
+        # Imported accounts sign in through Google
+        password = make_password(None)
+        with explicit_timestamps(User):
+            User.objects.bulk_create([
+                User(
+                    username=username, email=record.get('email', ''),
+                    first_name=record.get('first_name', ''), last_name=record.get('last_name', ''),
+                    password=password, date_joined=_datetime(record.get('date_joined'), timezone.now()),
+                )
+                for username, record in new.items()
+            ])
+        # Not every backend returns primary keys from bulk_create
+        user_ids = self._user_ids(new)
+        Profile.objects.bulk_create(
+            [Profile(user_id=user_ids[username], bio=new[username].get('bio', '')) for username in new],
+            ignore_conflicts=True,
+        )
+        self.totals['users'] += len(new)
+
+    def _import_categories(self, records):
+        names = {record['name'] for record in records}
+        existing = set(Category.objects.filter(name__in=names).values_list('name', flat=True))
+        new = [record for record in records if record['name'] not in existing]
+        with explicit_timestamps(Category):
+            Category.objects.bulk_create(
+                [Category(name=record['name'], created_at=_datetime(record.get('created_at'), timezone.now()))
+                 for record in new]
+            )
+        category_registry.bump()
+        self.totals['categories'] += len(new)
+
+    def _skip_imported(self, records, user_ids):
+        """
+        Drop posts that a crashed run committed after its last checkpoint.
+
+        A batch commits before its checkpoint is written, so the first posts
+        after the checkpoint may already be in the database. They are matched
+        on author, title and created_at; checking stops at the first batch
+        with none of them.
+        """
+        keys = {
+            (user_ids[record['author']], record['title'], _datetime(record.get('created_at')))
+            for record in records
+        }
+        imported = set(
+            Post.objects.filter(
+                author_id__in={author_id for author_id, _, _ in keys},
+                title__in={title for _, title, _ in keys},
+                created_at__in={created_at for _, _, created_at in keys if created_at},
+            ).values_list('author_id', 'title', 'created_at')
+        )
+        if not imported:
+            self.check_imported = False
+            return records
+
+        fresh = [
+            record for record in records
+            if (user_ids[record['author']], record['title'], _datetime(record.get('created_at'))) not in imported
+        ]
+        self.stdout.write(f'Skipped {len(records) - len(fresh)} posts imported before the checkpoint was written')
+        return fresh
+
+    def _import_posts(self, records):
+        usernames = {record['author'] for record in records}
+        for record in records:
+            usernames.update(entry['user'] for entry in record.get('likes', ()))
+            usernames.update(entry['user'] for entry in record.get('comments', ()))
+        user_ids = self._user_ids(usernames)
+
+        kept = [record for record in records if record['author'] in user_ids]
+        self.totals['skipped'] += len(records) - len(kept)
+        if self.check_imported:
+            kept = self._skip_imported(kept, user_ids)
+        if not kept:
+            return
+
+        # One query per batch instead of several per post in Post.save()
+        slugs = allocate_slugs(Post, [
+            slug_base(record.get('slug') or record['title']) for record in kept
+        ])
+
+        now = timezone.now()
+        posts, likes, comments = [], [], []
+        for record, slug in zip(kept, slugs):
+            category = category_registry.get_by_name(record['category']) if record.get('category') else None
+            post = Post(
+                title=record['title'], slug=slug, content=record.get('content', ''),
+                author_id=user_ids[record['author']], category_id=category.pk if category else None,
+                status=record.get('status', 'draft'), featured_image=record.get('featured_image') or None,
+                created_at=_datetime(record.get('created_at'), now),
+                updated_at=_datetime(record.get('updated_at'), now),
+                published_at=_datetime(record.get('published_at')),
+            )
+            # What Post.save() would derive from the content
+            post.render_content()
+            post.refresh_content_metadata()
+            # Each user likes a post once
+            post_likes = {
+                entry['user']: entry for entry in record.get('likes', ()) if entry['user'] in user_ids
+            }
+            # File index -> (position in comments, depth) of each kept comment
+            kept_comments, post_comments = {}, []
+            for index, entry in enumerate(record.get('comments', ())):
+                parent = kept_comments.get(entry.get('parent'))
+                # Replies to a comment that was left out go with it
+                if entry['user'] not in user_ids or (entry.get('parent') is not None and parent is None):
+                    continue
+                depth = parent[1] + 1 if parent else 0
+                if depth > MAX_REPLY_DEPTH:
+                    continue
+                kept_comments[index] = (len(comments) + len(post_comments), depth)
+                post_comments.append((post, entry, parent[0] if parent else None))
+            post.like_count, post.comment_count = len(post_likes), len(post_comments)
+            posts.append(post)
+            likes.extend((post, entry) for entry in post_likes.values())
+            comments.extend(post_comments)
+
+        with explicit_timestamps(Post, Like, Comment):
+            Post.objects.bulk_create(posts)
+            if posts[0].pk is None:
+                by_slug = {post.slug: post for post in posts}
+                for post_id, slug in Post.objects.filter(slug__in=by_slug).values_list('id', 'slug'):
+                    by_slug[slug].pk = post_id
+
+            Like.objects.bulk_create([
+                Like(user_id=user_ids[entry['user']], post_id=post.pk, created_at=_datetime(entry.get('created_at'), now))
+                for post, entry in likes
+            ], batch_size=self.batch_size)
+            created = Comment.objects.bulk_create([
+                Comment(
+                    user_id=user_ids[entry['user']], post_id=post.pk, content=entry['content'],
+                    created_at=_datetime(entry.get('created_at'), now),
+                    updated_at=_datetime(entry.get('updated_at'), now),
+                )
+                for post, entry, _ in comments
+            ], batch_size=self.batch_size)
+            self._link_threads(created, [parent for _, _, parent in comments])
+
+        # bulk_create skips the signals that count media references
+        media.acquire(post.featured_image.name for post in posts if post.featured_image)
+
+        self.totals['posts'] += len(posts)
+        self.totals['likes'] += len(likes)
+        self.totals['comments'] += len(comments)
+
+    def _link_threads(self, comments, parents):
+        """
+        Set the thread fields of comments made by bulk_create, which skips
+        Comment.save() and its signals. parents[i] is the position in
+        `comments` of the comment comments[i] answers, or None.
+        """
+        if not comments:
+            return
+        if comments[0].pk is None:
+            # The posts are new, so every comment on them is one of these,
+            # inserted in list order
+            ids = Comment.objects.filter(
+                post_id__in={comment.post_id for comment in comments},
+            ).order_by('id').values_list('id', flat=True)
+            for comment, pk in zip(comments, ids):
+                comment.pk = pk
+
+        # Position of each comment's top-level comment
+        roots = []
+        for comment, parent in zip(comments, parents):
+            if parent is None:
+                roots.append(len(roots))
+                comment.path = path_segment(comment.pk)
+                continue
+            roots.append(roots[parent])
+            root, parent = comments[roots[parent]], comments[parent]
+            comment.parent_id, comment.root_id = parent.pk, root.pk
+            comment.depth = parent.depth + 1
+            comment.path = parent.path + path_segment(comment.pk)
+            root.reply_count += 1
+        Comment.objects.bulk_update(
+            comments, ['parent', 'root', 'depth', 'path', 'reply_count'], batch_size=self.batch_size,
+        )
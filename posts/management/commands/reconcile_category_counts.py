@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from posts import category_registry
+from posts.models import Category, Post
+
+
+class Command(BaseCommand):
+    help = 'Recompute Category.post_count (published posts per category) and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drifted categories without updating them')
+
+    def handle(self, *args, **options):
+        published = Post.objects.filter(
+            category=OuterRef('pk'), status='published'
+        ).order_by().values('category').annotate(c=Count('id')).values('c')
+
+        drifted = Category.objects.annotate(
+            actual=Coalesce(Subquery(published), 0)
+        ).exclude(post_count=F('actual')).values_list('id', 'name', 'post_count', 'actual')
+
+        fixed = 0
+        for category_id, name, post_count, actual in drifted:
+            fixed += 1
+            self.stdout.write(f'{name}: {post_count} -> {actual}')
+            if not options['dry_run']:
+                Category.objects.filter(id=category_id).update(post_count=Coalesce(Subquery(published), 0))
+
+        if fixed and not options['dry_run']:
+            # update() skips the signals that refresh the category registry
+            category_registry.invalidate()
+
+        action = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(f'{action} {fixed} categories with drifted counts.'))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from posts import page_cache, rendering
+from posts.models import Post
+
+RENDERED_FIELDS = ['content_html', 'content_html_version']
+
+
+class Command(BaseCommand):
+    help = 'Re-render the stored HTML of posts rendered by an older version of the rendering rules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts loaded and updated per batch')
+        parser.add_argument('--all', action='store_true',
+                            help='Re-render every post, not only outdated ones')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        posts = Post.objects.all()
+        if not options['all']:
+            posts = posts.exclude(content_html_version=rendering.RENDERER_VERSION)
+
+        checked = updated = 0
+        last_id = 0
+        while True:
+            # Walk the table in primary key order so every batch is a range scan
+            batch = list(
+                posts.filter(id__gt=last_id).order_by('id').only('id', 'content', *RENDERED_FIELDS)[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            checked += len(batch)
+
+            changed = []
+            for post in batch:
+                before = [getattr(post, field) for field in RENDERED_FIELDS]
+                post.render_content()
+                if [getattr(post, field) for field in RENDERED_FIELDS] != before:
+                    changed.append(post)
+
+            Post.objects.bulk_update(changed, RENDERED_FIELDS)
+            updated += len(changed)
+
+        # bulk_update skips the signals that bump cached detail pages
+        if updated:
+            page_cache.bump()
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {checked} posts. Re-rendered {updated} (renderer version {rendering.RENDERER_VERSION}).'
+        ))
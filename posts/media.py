@@ -0,0 +1,116 @@
+"""
+Reference counting for stored media.
+
+The default storage (freespaces/storage.py) stores identical files once, so
+a file can be referenced by several posts and profiles and must not be
+deleted when one of them lets go. MediaFile keeps a count per storage name:
+
+- Post and Profile signal receivers compare the files an instance
+  references as loaded (ChangeTrackingMixin's snapshot) with what it
+  references after the save, and call acquire()/release() with the
+  difference. Deleting a row releases everything it referenced.
+- Code that changes references with queryset.update() (the background
+  image jobs) calls update_references() itself.
+- Files written but never referenced (a job that lost a race) are
+  register()ed with a zero count.
+
+Models opt in by declaring MEDIA_FIELDS (the fields naming files) and a
+media_files(values) static method. gc_media deletes files whose count has
+been zero for longer than a grace period, and with --recount rebuilds every
+count from the referencing rows.
+"""
+from collections import Counter, defaultdict
+
+from django.apps import apps
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+# Names per UPDATE statement
+NAMES_PER_QUERY = 500
+
+
+def _media_files():
+    # Imported late: posts.models imports this module
+    from .models import MediaFile
+    return MediaFile
+
+
+def _grouped(names):
+    """{count: [names]} for a Counter or iterable of names, in query-sized chunks"""
+    by_count = defaultdict(list)
+    for name, count in Counter(names).items():
+        if name and count > 0:
+            by_count[count].append(name)
+    for count, grouped in by_count.items():
+        for start in range(0, len(grouped), NAMES_PER_QUERY):
+            yield count, grouped[start:start + NAMES_PER_QUERY]
+
+
+def register(names):
+    """Make sure every name has a MediaFile row, with a zero count if new"""
+    MediaFile = _media_files()
+    names = list(dict.fromkeys(name for name in names if name))
+    MediaFile.objects.bulk_create(
+        [MediaFile(name=name) for name in names], ignore_conflicts=True, batch_size=NAMES_PER_QUERY,
+    )
+
+
+def acquire(names):
+    """Add one reference per occurrence of each name"""
+    MediaFile = _media_files()
+    counts = Counter(name for name in names if name)
+    register(counts)
+    for count, chunk in _grouped(counts):
+        MediaFile.objects.filter(name__in=chunk).update(
+            ref_count=F('ref_count') + count, updated_at=timezone.now(),
+        )
+
+
+def release(names):
+    """Drop one reference per occurrence of each name; counts stop at zero"""
+    MediaFile = _media_files()
+    for count, chunk in _grouped(names):
+        MediaFile.objects.filter(name__in=chunk).update(
+            # Unsigned columns cannot go below zero even for a moment
+            ref_count=Case(When(ref_count__gt=count, then=F('ref_count') - count), default=0),
+            updated_at=timezone.now(),
+        )
+
+
+def update_references(old_names, new_names):
+    """Acquire names only in new_names and release names only in old_names"""
+    old, new = Counter(old_names), Counter(new_names)
+    if new - old:
+        acquire(new - old)
+    if old - new:
+        release(old - new)
+
+
+def set_counts(counts):
+    """Overwrite every count with counts ({name: references}); others become zero"""
+    MediaFile = _media_files()
+    register(counts)
+    now = timezone.now()
+    MediaFile.objects.exclude(ref_count=0).update(ref_count=0, updated_at=now)
+    for count, chunk in _grouped(counts):
+        MediaFile.objects.filter(name__in=chunk).update(ref_count=count, updated_at=now)
+
+
+def referencing_models():
+    """Models that declare MEDIA_FIELDS and media_files()"""
+    return [model for model in apps.get_models() if hasattr(model, 'MEDIA_FIELDS')]
+
+
+def instance_files(instance, attnames, extract):
+    """
+    (before, after): the names instance referenced as loaded and now.
+
+    extract({attname: value}) returns the names those field values refer
+    to. Fields not loaded on the instance count as unchanged.
+    """
+    before = instance.loaded_values()
+    after = dict(before)
+    for attname in attnames:
+        if attname in instance.__dict__:
+            after[attname] = instance._comparable(instance.__dict__[attname])
+    return list(extract(before)), list(extract(after))
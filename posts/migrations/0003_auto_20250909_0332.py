@@ -1,38 +1,86 @@
 # Generated by Django 5.2.6 on 2025-09-08 20:32
 
+import re
+
 from django.db import migrations
+from django.db.models import Case, IntegerField, Max, Q, Value, When
+from django.db.models.functions import Cast, Substr
 from django.utils.text import slugify
 from django.utils import timezone
 
+SLUG_MAX_LENGTH = 255
+# Posts slugged per batch; also the number of bases looked up per query
+BATCH_SIZE = 200
+
+
+# Frozen copy of posts.slugs as of this migration: the highest N in use as
+# base-N, for a batch of bases in one query, so the backfill costs one
+# query per batch instead of one per candidate slug
+def _highest_numbers(Post, bases):
+    taken = Q()
+    numbers = {}
+    for position, base in enumerate(bases):
+        numbered = Q(slug__startswith=f'{base}-', slug__regex=rf'^{re.escape(base)}-[0-9]+$')
+        taken |= Q(slug=base) | numbered
+        numbers[f'base_{position}'] = Max(Case(
+            When(Q(slug=base), then=Value(1)),
+            When(numbered, then=Cast(Substr('slug', len(base) + 2), IntegerField())),
+            output_field=IntegerField(),
+        ))
+    found = Post.objects.filter(taken).aggregate(**numbers)
+    return {base: found[f'base_{position}'] or 0 for position, base in enumerate(bases)}
+
+
+def _with_suffix(base, number):
+    if number == 1:
+        return base
+    suffix = f'-{number}'
+    return f'{base[:SLUG_MAX_LENGTH - len(suffix)].rstrip("-")}{suffix}'
+
+
+def _slug_base(post):
+    if not post.title:
+        # Fallback for empty titles
+        base_slug = f'post-{post.id}-{timezone.now().strftime("%Y%m%d")}'
+    else:
+        # Clean the title and create base slug
+        base_slug = slugify(post.title)
+        if not base_slug:
+            # If slugify returns empty (e.g., title with only special chars)
+            base_slug = f'post-{post.id}-{timezone.now().strftime("%Y%m%d")}'
+
+    # Ensure slug is not too long
+    if len(base_slug) > 240:  # Leave room for numeric suffix
+        base_slug = base_slug[:240]
+    return base_slug
+
 
 def populate_post_slugs(apps, schema_editor):
     """Populate slug field for existing posts"""
     Post = apps.get_model('posts', 'Post')
 
-    for post in Post.objects.filter(slug__isnull=True).union(Post.objects.filter(slug='')):
-        if not post.title:
-            # Fallback for empty titles
-            base_slug = f'post-{post.id}-{timezone.now().strftime("%Y%m%d")}'
-        else:
-            # Clean the title and create base slug
-            base_slug = slugify(post.title)
-            if not base_slug:
-                # If slugify returns empty (e.g., title with only special chars)
-                base_slug = f'post-{post.id}-{timezone.now().strftime("%Y%m%d")}'
-
-        # Ensure slug is not too long
-        if len(base_slug) > 240:  # Leave room for numeric suffix
-            base_slug = base_slug[:240]
-
-        # Check for uniqueness and add numeric suffix if needed
-        slug = base_slug
-        counter = 1
-        while Post.objects.filter(slug=slug).exclude(pk=post.pk).exists():
-            counter += 1
-            slug = f'{base_slug}-{counter}'
-
-        post.slug = slug
-        post.save(update_fields=['slug'])
+    # A plain OR filter: union() of the two querysets fails on SQLite, which
+    # rejects the ORDER BY that Meta.ordering adds to each part
+    missing = Post.objects.filter(Q(slug__isnull=True) | Q(slug='')).order_by('pk')
+    while True:
+        # Slugged posts drop out of the filter, so each batch is the next one
+        posts = list(missing[:BATCH_SIZE])
+        if not posts:
+            break
+        bases = [_slug_base(post) for post in posts]
+        highest = _highest_numbers(Post, list(dict.fromkeys(bases)))
+        used = set()
+        for post, base in zip(posts, bases):
+            highest[base] += 1
+            slug = _with_suffix(base, highest[base])
+            # Only when one base in the batch looks like another with a
+            # suffix ("tips" and "tips-2") can the next number be taken
+            while slug in used:
+                highest[base] += 1
+                slug = _with_suffix(base, highest[base])
+            used.add(slug)
+            post.slug = slug
+        Post.objects.bulk_update(posts, ['slug'])
 
 
 def reverse_populate_post_slugs(apps, schema_editor):
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-17 22:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_category_post_counts(apps, schema_editor):
+    """Count the published posts already in each category"""
+    Category = apps.get_model('posts', 'Category')
+    Post = apps.get_model('posts', 'Post')
+
+    published = Post.objects.filter(
+        category=OuterRef('pk'), status='published'
+    ).order_by().values('category').annotate(c=Count('id')).values('c')
+    Category.objects.update(post_count=Coalesce(Subquery(published), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_post_like_count_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['-post_count', 'name'], name='category_leaderboard_idx'),
+        ),
+        migrations.RunPython(populate_category_post_counts, migrations.RunPython.noop),
+    ]
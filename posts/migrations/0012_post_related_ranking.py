@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_mediafile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='related_ranking',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
@@ -1,17 +1,38 @@
-from django.db import models
+import logging
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import slugify
-import re
+from PIL import Image
+from freespaces import background
+from . import card_cache, category_registry, images, media, page_cache, rendering
+from .slugs import allocate_slug, slug_base
+from .text import content_metadata
+from .tracking import ChangeTrackingMixin
+
+logger = logging.getLogger(__name__)
+
+# Tries at inserting a post whose generated slug keeps being taken concurrently
+SLUG_SAVE_ATTEMPTS = 3
 
 # Create your models here.
 class Category(models.Model):
     name = models.CharField(max_length=50, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Number of published posts, maintained by the Post signals below
+    post_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name_plural = "Categories"
+        indexes = [
+            # Popular categories leaderboard: most posts first, then by name
+            models.Index(fields=['-post_count', 'name'], name='category_leaderboard_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -19,7 +40,27 @@ class Category(models.Model):
     def get_absolute_url(self):
         return reverse('posts:category', kwargs={'category_name': self.name})
 
-class Post(models.Model):
+class MediaFile(models.Model):
+    """
+    Reference count of one stored media file (see posts/media.py).
+
+    Files are shared between rows that uploaded the same bytes; a file is
+    only deleted, by gc_media, after its count has been zero for a while.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    # Last time the count changed; gc_media leaves recently released files alone
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count', 'updated_at'], name='mediafile_gc_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count})'
+
+class Post(ChangeTrackingMixin, models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
         ('published', 'Published'),
@@ -36,47 +77,53 @@ class Post(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     published_at = models.DateTimeField(null=True, blank=True)
 
+    # Denormalized counters, maintained by the interactions app
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # Derived from content in save() so list pages never need the content column
+    excerpt = models.CharField(max_length=300, blank=True, editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveSmallIntegerField(default=1, editable=False, help_text='Minutes')
+
+    # Sanitized content served by the detail page, and the renderer version
+    # that produced it (see posts/rendering.py)
+    content_html = models.TextField(blank=True, editable=False)
+    content_html_version = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    # Resized copies of featured_image, built in the background (see posts/images.py)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    # [[post_id, score], ...] of related posts, maintained by feeds/related.py
+    related_ranking = models.JSONField(default=list, blank=True, editable=False)
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of the published feed walks (created_at, id)
+            models.Index(fields=['status', '-created_at', '-id'], name='post_feed_idx'),
+            # Category pages and visitors' view of a profile: one category's or
+            # author's published posts, newest first
+            models.Index(fields=['category', 'status', '-created_at'], name='post_category_feed_idx'),
+            models.Index(fields=['author', 'status', '-created_at'], name='post_author_feed_idx'),
+            # An author's own listings (my posts, own profile) include drafts
+            models.Index(fields=['author', '-created_at'], name='post_author_recent_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def _counted_category_id(self, values=None):
+        """Category this post adds one to in Category.post_count, if any"""
+        # Read through __dict__ so deferred fields are not fetched
+        values = self.__dict__ if values is None else values
+        if values.get('status') != 'published':
+            return None
+        return values.get('category_id')
+
     def _generate_unique_slug(self):
         """Generate a unique slug from the title"""
-        if not self.title or not self.title.strip():
-            # Fallback for empty titles
-            base_slug = f'post-{timezone.now().strftime("%Y%m%d%H%M%S")}'
-        else:
-            # Clean the title and create base slug
-            # Remove extra whitespace and clean the title
-            clean_title = re.sub(r'\s+', ' ', self.title.strip())
-            base_slug = slugify(clean_title)
-
-            if not base_slug:
-                # If slugify returns empty (e.g., title with only special chars)
-                base_slug = f'post-{timezone.now().strftime("%Y%m%d%H%M%S")}'
-
-        # Ensure slug is not too long (leave room for numeric suffix)
-        max_length = 240
-        if len(base_slug) > max_length:
-            base_slug = base_slug[:max_length].rstrip('-')
-
-        # Check for uniqueness and add numeric suffix if needed
-        slug = base_slug
-        counter = 1
-        while Post.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-            counter += 1
-            # Calculate suffix and ensure total length doesn't exceed limit
-            suffix = f'-{counter}'
-            if len(base_slug) + len(suffix) > 255:
-                # Truncate base_slug to make room for suffix
-                truncated_base = base_slug[:255 - len(suffix)].rstrip('-')
-                slug = f'{truncated_base}{suffix}'
-            else:
-                slug = f'{base_slug}{suffix}'
-
-        return slug
+        return allocate_slug(Post, slug_base(self.title), exclude_pk=self.pk)
 
     def _should_regenerate_slug(self):
         """Check if slug should be regenerated based on title changes"""
@@ -86,32 +133,205 @@ class Post(models.Model):
         if not self.slug:  # No slug exists
             return True
 
-        # Check if title has changed significantly
-        try:
-            old_post = Post.objects.get(pk=self.pk)
-            old_title_slug = slugify(old_post.title) if old_post.title else ''
-            current_title_slug = slugify(self.title) if self.title else ''
+        # Check if title has changed significantly, against the title as loaded
+        if not self.has_changed('title'):
+            return False
+        old_title = self.original_value('title')
+        old_title_slug = slugify(old_title) if old_title else ''
+        current_title_slug = slugify(self.title) if self.title else ''
 
-            # Regenerate if the slugified title is completely different
-            return old_title_slug != current_title_slug and current_title_slug
-        except Post.DoesNotExist:
-            return True
+        # Regenerate if the slugified title is completely different
+        return old_title_slug != current_title_slug and current_title_slug
 
     def save(self, *args, **kwargs):
         # Generate slug if not provided
         # Don't regenerate if slug was manually set (preserve manual overrides)
-        if not self.slug:
+        generated_slug = not self.slug
+        if generated_slug:
             self.slug = self._generate_unique_slug()
 
         # Set published_at when status changes to published
         if self.status == 'published' and not self.published_at:
             self.published_at = timezone.now()
-        super().save(*args, **kwargs)
+
+        # Re-render and refresh excerpt and reading metadata whenever content changes
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            if self._state.adding or self.has_changed('content'):
+                self.render_content()
+                self.refresh_content_metadata()
+        elif 'content' in update_fields:
+            self.render_content()
+            self.refresh_content_metadata()
+            kwargs['update_fields'] = set(update_fields) | {
+                'excerpt', 'word_count', 'reading_time', 'content_html', 'content_html_version',
+            }
+
+        # A new or replaced image invalidates its derivatives; new ones are
+        # built once the save commits
+        if (
+            update_fields is None or 'featured_image' in update_fields
+        ) and self.has_changed('featured_image'):
+            self._build_image_variants = True
+            self.image_variants = {}
+            if update_fields is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'image_variants'}
+
+        if not generated_slug:
+            super().save(*args, **kwargs)
+            return
+
+        # A concurrent save can take the same generated slug between
+        # allocating it and inserting; the unique index rejects the loser,
+        # which allocates again
+        for attempt in range(SLUG_SAVE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                slug_taken = Post.objects.filter(slug=self.slug).exclude(pk=self.pk).exists()
+                if not slug_taken or attempt == SLUG_SAVE_ATTEMPTS - 1:
+                    raise
+                self.slug = self._generate_unique_slug()
+
+    def refresh_content_metadata(self):
+        """Recompute excerpt, word_count and reading_time from content"""
+        for field, value in content_metadata(self.content).items():
+            setattr(self, field, value)
+
+    def render_content(self):
+        """Store the sanitized HTML of content"""
+        self.content_html = rendering.render_content(self.content)
+        self.content_html_version = rendering.RENDERER_VERSION
+
+    @property
+    def rendered_content(self):
+        """Sanitized HTML of content; rendered now if the stored copy is outdated"""
+        if self.content_html_version == rendering.RENDERER_VERSION:
+            return self.content_html
+        return rendering.render_content(self.content)
 
     def get_absolute_url(self):
         return reverse('posts:detail', kwargs={'slug': self.slug})
 
-    @property
-    def excerpt(self):
-        """Return first 150 characters of content"""
-        return self.content[:150] + "..." if len(self.content) > 150 else self.content
\ No newline at end of file
+    # Fields naming stored files, counted in posts.media
+    MEDIA_FIELDS = ['featured_image', 'image_variants']
+
+    @staticmethod
+    def media_files(values):
+        """Storage names referenced by featured_image and image_variants in values"""
+        if values.get('featured_image'):
+            yield values['featured_image']
+        yield from images.variant_files(values.get('image_variants'))
+
+
+def build_post_image_variants(post_id, force=False):
+    """Generate the image derivatives of one post; run in the background"""
+    post = Post.objects.filter(pk=post_id).only('id', 'featured_image', 'image_variants').first()
+    if post is None or not post.featured_image:
+        return
+    source = post.featured_image.name
+    if post.image_variants.get('source') == source and not force:
+        return
+
+    try:
+        variants = images.generate_variants(post.featured_image)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning('Could not build image variants for post %s from %s', post_id, source, exc_info=True)
+        # Recorded with no derivatives, so templates keep the original and
+        # the backfill does not retry the same broken file
+        variants = {'source': source}
+
+    # The image may have been replaced while this ran; that save scheduled
+    # its own build, so leave these files unreferenced for gc_media
+    new_files = list(images.variant_files(variants))
+    updated = Post.objects.filter(pk=post_id, featured_image=source).update(image_variants=variants)
+    if not updated:
+        media.register(new_files)
+        return
+    # update() skips the signals that keep reference counts; with force the
+    # previous derivatives are replaced
+    media.update_references(images.variant_files(post.image_variants), new_files)
+
+    # update() skips the signals that normally invalidate rendered pages
+    card_cache.bump_post(post_id)
+    page_cache.bump()
+
+
+def adjust_category_post_count(category_id, delta):
+    """Atomically add delta to a category's published post count"""
+    categories = Category.objects.filter(pk=category_id)
+    if delta < 0:
+        categories = categories.filter(post_count__gte=-delta)
+    categories.update(post_count=F('post_count') + delta)
+    # The registry keeps counts for the popular categories list
+    category_registry.invalidate()
+
+
+# Keep Category.post_count in step when posts are published, unpublished,
+# moved to another category or deleted
+@receiver(post_save, sender=Post)
+def update_category_leaderboard(sender, instance, **kwargs):
+    # Post.save() has not refreshed its snapshot yet, so it still holds the
+    # status and category the row had before this save
+    old_category_id = instance._counted_category_id(instance.loaded_values())
+    new_category_id = instance._counted_category_id()
+    if old_category_id != new_category_id:
+        if old_category_id is not None:
+            adjust_category_post_count(old_category_id, -1)
+        if new_category_id is not None:
+            adjust_category_post_count(new_category_id, 1)
+
+@receiver(post_delete, sender=Post)
+def remove_from_category_leaderboard(sender, instance, **kwargs):
+    category_id = instance._counted_category_id(instance.loaded_values())
+    if category_id is not None:
+        adjust_category_post_count(category_id, -1)
+
+
+@receiver(post_save, sender=Post)
+def schedule_image_variants(sender, instance, **kwargs):
+    if instance.__dict__.pop('_build_image_variants', False) and instance.featured_image:
+        background.submit_on_commit(build_post_image_variants, instance.pk)
+
+# Count references to stored files so shared files are only collected once
+# no post or profile uses them
+@receiver(post_save, sender=Post)
+def update_post_media_references(sender, instance, **kwargs):
+    before, after = media.instance_files(instance, Post.MEDIA_FIELDS, Post.media_files)
+    media.update_references(before, after)
+
+@receiver(post_delete, sender=Post)
+def release_post_media(sender, instance, **kwargs):
+    _, after = media.instance_files(instance, Post.MEDIA_FIELDS, Post.media_files)
+    media.release(after)
+
+
+# Every worker reloads its category registry after a category is added,
+# renamed or deleted
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_registry(sender, **kwargs):
+    category_registry.invalidate()
+
+# Cards show their category's name, so renaming it makes them stale
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cards(sender, instance, **kwargs):
+    card_cache.bump_category(instance.pk)
+
+# Any change to a post makes its cached cards stale
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_cards(sender, instance, **kwargs):
+    card_cache.bump_post(instance.pk)
+
+# Publishing, editing or deleting a post, or changing a category, changes
+# what anonymous visitors see on the cached public pages
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_page_cache(sender, **kwargs):
+    page_cache.bump()
@@ -0,0 +1,113 @@
+"""
+Full-page cache for anonymous visitors.
+
+Logged-out visitors all see the same HTML on the public pages, so the
+rendered response is cached under a key made of a site-wide content version
+and the request path. Publishing, editing or deleting a post (or changing a
+category, or an author's profile or username) bumps the version, which
+orphans every cached page at once. Like and comment counters change
+without a bump and can lag by up to PAGE_CACHE_TIMEOUT.
+
+Responses carry a strong ETag (a hash of the body), so browsers and reverse
+proxies revalidating a cached page get a 304 without a render. There is no
+Last-Modified: no timestamp on the page moves forward when a post is
+unpublished, deleted or moved, so If-Modified-Since would answer 304 for
+a page that changed.
+
+The cache is opt-in: set ANONYMOUS_PAGE_CACHE = True in settings.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+PAGE_CACHE_TIMEOUT = 60 * 5
+VERSION_KEY = 'page_cache:version'
+
+
+def is_enabled():
+    return getattr(settings, 'ANONYMOUS_PAGE_CACHE', False)
+
+
+def bump():
+    """Invalidate every cached page"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Start from the clock so a recreated key never matches old pages
+        cache.set(VERSION_KEY, int(time.time() * 1000), None)
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(VERSION_KEY, version, None):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def _page_key(scope, request):
+    path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'page_cache:{_version()}:{scope}:{path_hash}'
+
+
+def _is_cacheable_request(request):
+    return (
+        is_enabled()
+        and request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+    )
+
+
+def _is_cacheable_response(response):
+    # Never store a response that sets cookies (a CSRF token, a session)
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not response.has_header('Cache-Control')
+    )
+
+
+def _validated_response(request, entry):
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response.headers['ETag'] = entry['etag']
+    # Let browsers and proxies store the page but revalidate it every time
+    patch_cache_control(response, no_cache=True)
+    return get_conditional_response(
+        request,
+        etag=entry['etag'],
+        response=response,
+    )
+
+
+def anonymous_page_cache(scope):
+    """Cache a view's response for anonymous GET requests"""
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            if not _is_cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+
+            key = _page_key(scope, request)
+            entry = cache.get(key)
+            if entry is None:
+                response = view_func(request, *args, **kwargs)
+                if not _is_cacheable_response(response):
+                    return response
+
+                entry = {
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                    'etag': '"%s"' % hashlib.sha1(response.content).hexdigest(),
+                }
+                cache.set(key, entry, PAGE_CACHE_TIMEOUT)
+
+            return _validated_response(request, entry)
+        return wrapped
+    return decorator
@@ -0,0 +1,84 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(obj):
+    """Encode the (created_at, id) position of an object as an opaque token"""
+    raw = f'{obj.created_at.isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a token produced by encode_cursor into (created_at, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        created_at, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(str(e))
+
+
+class KeysetPage:
+    """
+    One page of a queryset walked newest-first on (created_at, id).
+
+    Unlike OFFSET paging, each page is a single range scan starting right
+    after the previous page's last row, so deep pages cost the same as the
+    first one.
+    """
+
+    def __init__(self, queryset, cursor=None, per_page=10):
+        queryset = queryset.order_by('-created_at', '-id')
+
+        if cursor:
+            created_at, pk = decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) |
+                Q(created_at=created_at, id__lt=pk)
+            )
+
+        # Fetch one extra row to know whether another page exists
+        rows = list(queryset[:per_page + 1])
+        self.object_list = rows[:per_page]
+        self.has_next = len(rows) > per_page
+        self.next_cursor = encode_cursor(self.object_list[-1]) if self.has_next else None
+        # Where NewerPage starts when polling for rows added above this page
+        self.newest_cursor = encode_cursor(self.object_list[0]) if self.object_list else cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class NewerPage(KeysetPage):
+    """
+    Rows added after the cursor's position, newest first.
+
+    For polling: pass the newest_cursor of what is already shown. At most
+    per_page rows come back, the ones right after the cursor; when there are
+    more (has_newer), poll again with the new newest_cursor.
+    """
+
+    def __init__(self, queryset, cursor, per_page=10):
+        created_at, pk = decode_cursor(cursor)
+        rows = list(
+            queryset.filter(
+                Q(created_at__gt=created_at) |
+                Q(created_at=created_at, id__gt=pk)
+            ).order_by('created_at', 'id')[:per_page + 1]
+        )
+        self.has_newer = len(rows) > per_page
+        self.object_list = rows[:per_page][::-1]
+        self.has_next = False
+        self.next_cursor = None
+        self.newest_cursor = encode_cursor(self.object_list[0]) if self.object_list else cursor
@@ -0,0 +1,214 @@
+"""
+Sanitizing and rendering post bodies.
+
+Post.content holds whatever HTML the rich text editor (or a crafted
+request) sent. render_content() turns it into the HTML the detail page
+shows:
+
+- only tags and attributes in ALLOWED_TAGS survive; script, style and
+  similar elements are dropped with their contents, other unknown tags are
+  dropped but their text kept, and unclosed tags are closed;
+- links may only use http(s), mailto or relative URLs and get
+  rel="nofollow noopener noreferrer"; images may also use the inline
+  data:image URLs the editor produces, and load lazily;
+- inline styles keep only ALLOWED_STYLES properties;
+- headings get id anchors ("content-<slug>", unique per post).
+
+Post.save() stores the result with RENDERER_VERSION whenever the content
+changes. Bump RENDERER_VERSION when these rules change and run
+`manage.py rerender_posts` to refresh stored HTML; until then, outdated
+posts are rendered on the fly.
+"""
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.utils.text import slugify
+
+RENDERER_VERSION = 1
+
+GLOBAL_ATTRIBUTES = {'style'}
+
+ALLOWED_TAGS = {
+    'p': set(), 'div': set(), 'span': set(), 'br': set(), 'hr': set(),
+    'b': set(), 'strong': set(), 'i': set(), 'em': set(), 'u': set(),
+    's': set(), 'strike': set(), 'sub': set(), 'sup': set(),
+    'blockquote': set(), 'pre': set(), 'code': set(),
+    'ul': set(), 'ol': set(), 'li': set(),
+    'h1': set(), 'h2': set(), 'h3': set(), 'h4': set(), 'h5': set(), 'h6': set(),
+    'figure': set(), 'figcaption': set(),
+    'font': {'size', 'color'},
+    'a': {'href', 'title', 'target'},
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+}
+
+VOID_TAGS = {'br', 'hr', 'img'}
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+# Start tags that end an open element the way browsers do, e.g. <li>a<li>b
+BLOCK_TAGS = {'p', 'div', 'blockquote', 'pre', 'ul', 'ol', 'hr', 'figure'} | HEADING_TAGS
+IMPLICITLY_CLOSED = {'li': {'li'}, **{tag: {'p'} for tag in BLOCK_TAGS}}
+
+# Dropped together with everything inside them
+DROPPED_TAGS = {
+    'script', 'style', 'iframe', 'object', 'embed', 'template', 'noscript',
+    'svg', 'math', 'textarea', 'select', 'title', 'head',
+}
+
+ALLOWED_STYLES = {
+    'color', 'background-color', 'font-size', 'font-weight', 'font-style',
+    'text-align', 'text-decoration', 'max-width', 'width', 'height',
+    'margin', 'border-radius',
+}
+
+LINK_SCHEMES = {'http', 'https', 'mailto'}
+IMAGE_SCHEMES = {'http', 'https'}
+DATA_IMAGE_RE = re.compile(r'^data:image/(png|jpe?g|gif|webp);base64,[a-z0-9+/=\s]*$', re.IGNORECASE)
+
+# Browsers ignore these inside URLs, so "java\tscript:" is still javascript:
+URL_IGNORED_CHARS_RE = re.compile(r'[\x00-\x20]')
+UNSAFE_STYLE_RE = re.compile(r'url\(|expression|\\|/\*|[<>"]', re.IGNORECASE)
+
+
+def _safe_url(value, schemes, allow_data_image=False):
+    value = value.strip()
+    if allow_data_image and DATA_IMAGE_RE.match(value):
+        return value
+    scheme = urlsplit(URL_IGNORED_CHARS_RE.sub('', value)).scheme.lower()
+    if scheme and scheme not in schemes:
+        return None
+    return value
+
+
+def _safe_style(value):
+    declarations = []
+    for declaration in value.split(';'):
+        prop, _, val = declaration.partition(':')
+        prop, val = prop.strip().lower(), val.strip()
+        if prop in ALLOWED_STYLES and val and not UNSAFE_STYLE_RE.search(val):
+            declarations.append(f'{prop}: {val}')
+    return '; '.join(declarations)
+
+
+class _ContentRenderer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+        self.dropping = 0
+        # While inside a heading: (index of its start tag in parts, its text
+        # so far, open_tags depth, attributes)
+        self.heading = None
+        self.heading_ids = set()
+
+    def _attributes(self, tag, attrs):
+        allowed = ALLOWED_TAGS[tag] | GLOBAL_ATTRIBUTES
+        cleaned = {}
+        for name, value in attrs:
+            name = name.lower()
+            if name not in allowed or value is None:
+                continue
+            if name == 'style':
+                value = _safe_style(value)
+            elif name == 'href':
+                value = _safe_url(value, LINK_SCHEMES)
+            elif name == 'src':
+                value = _safe_url(value, IMAGE_SCHEMES, allow_data_image=True)
+            elif name == 'target':
+                value = '_blank' if value == '_blank' else None
+            elif name in ('width', 'height', 'size'):
+                value = value if value.strip().isdigit() else None
+            if value:
+                cleaned[name] = value
+
+        if tag == 'a':
+            if 'href' in cleaned:
+                cleaned['rel'] = 'nofollow noopener noreferrer'
+            else:
+                cleaned.pop('target', None)
+        if tag == 'img':
+            if 'src' not in cleaned:
+                return None
+            cleaned['loading'] = 'lazy'
+            cleaned['decoding'] = 'async'
+        return cleaned
+
+    @staticmethod
+    def _start_tag(tag, attributes):
+        rendered = ''.join(f' {name}="{escape(value)}"' for name, value in attributes.items())
+        return f'<{tag}{rendered}>'
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        attributes = self._attributes(tag, attrs)
+        if attributes is None:
+            return
+        if self.open_tags and self.open_tags[-1] in IMPLICITLY_CLOSED.get(tag, ()):
+            self._close_through(self.open_tags[-1])
+        if tag in HEADING_TAGS:
+            # Headings don't nest; a new one closes the open one
+            if self.heading is not None:
+                self._close_through(self.open_tags[self.heading[2]])
+            self.heading = (len(self.parts), [], len(self.open_tags), attributes)
+        self.parts.append(self._start_tag(tag, attributes))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and tag in ALLOWED_TAGS and not self.dropping:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        self._close_through(tag)
+
+    def _close_through(self, tag):
+        """Close open tags down to and including the innermost tag"""
+        while self.open_tags:
+            closing = self.open_tags.pop()
+            self.parts.append(f'</{closing}>')
+            if self.heading is not None and len(self.open_tags) == self.heading[2]:
+                self._finish_heading()
+            if closing == tag:
+                break
+
+    def _finish_heading(self):
+        index, text, _, attributes = self.heading
+        self.heading = None
+        base = f'content-{slugify("".join(text)) or "section"}'
+        anchor, number = base, 1
+        while anchor in self.heading_ids:
+            number += 1
+            anchor = f'{base}-{number}'
+        self.heading_ids.add(anchor)
+        tag = self.parts[index][1:3]
+        self.parts[index] = self._start_tag(tag, {**attributes, 'id': anchor})
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        if self.heading is not None:
+            self.heading[1].append(data)
+        self.parts.append(escape(data, quote=False))
+
+    def render(self, content):
+        self.feed(content)
+        self.close()
+        if self.open_tags:
+            self._close_through(self.open_tags[0])
+        return ''.join(self.parts)
+
+
+def render_content(content):
+    """Sanitized, normalized HTML for a post body"""
+    return _ContentRenderer().render(content or '')
@@ -0,0 +1,111 @@
+"""
+Unique slug allocation for posts.
+
+A slug is a base made from the title, plus "-N" when the base is taken.
+Instead of probing base-2, base-3, ... one query at a time, the allocator
+asks for the highest N in use among slugs of the form base or base-N in a
+single indexed prefix query, and hands out the next one. The database does
+the MAX, so the query returns one row however many slugs share the prefix
+("my-trip-to-rome" is not read for base "my-trip"). A whole batch of
+titles (a bulk import) is allocated with one query per 200 distinct titles.
+
+Allocation alone cannot stop two concurrent requests from picking the same
+slug; the unique index on Post.slug does, and Post.save() reallocates and
+retries when it loses that race.
+
+The functions take the model as an argument so data migrations can pass
+the historical model from apps.get_model().
+"""
+import re
+
+from django.db.models import Case, IntegerField, Max, Q, Value, When
+from django.db.models.functions import Cast, Substr
+from django.utils import timezone
+from django.utils.text import slugify
+
+SLUG_MAX_LENGTH = 255
+# Leaves room for a "-N" suffix
+BASE_MAX_LENGTH = 240
+# Distinct bases looked up per query; keeps the OR list well under SQLite's
+# expression depth limit
+BASES_PER_QUERY = 200
+
+
+def slug_base(title, fallback=None):
+    """Slugified title, trimmed to BASE_MAX_LENGTH, or fallback if nothing is left"""
+    base = slugify(re.sub(r'\s+', ' ', (title or '').strip()))
+    if not base:
+        # Empty titles or titles made only of special characters
+        base = fallback or f'post-{timezone.now().strftime("%Y%m%d%H%M%S")}'
+    if len(base) > BASE_MAX_LENGTH:
+        base = base[:BASE_MAX_LENGTH].rstrip('-')
+    return base
+
+
+def _with_suffix(base, number):
+    if number == 1:
+        return base
+    suffix = f'-{number}'
+    return f'{base[:SLUG_MAX_LENGTH - len(suffix)].rstrip("-")}{suffix}'
+
+
+def _highest_numbers(model, bases, exclude_pk, field):
+    """{base: highest N in use as base-N} for each base; the bare base counts as 1, none as 0"""
+    highest = {}
+    for start in range(0, len(bases), BASES_PER_QUERY):
+        chunk = bases[start:start + BASES_PER_QUERY]
+        taken = Q()
+        numbers = {}
+        for position, base in enumerate(chunk):
+            # The prefix keeps the lookup on the slug index; the pattern
+            # drops longer slugs that only share it
+            numbered = Q(**{
+                f'{field}__startswith': f'{base}-',
+                f'{field}__regex': rf'^{re.escape(base)}-[0-9]+$',
+            })
+            taken |= Q(**{field: base}) | numbered
+            numbers[f'base_{position}'] = Max(Case(
+                When(Q(**{field: base}), then=Value(1)),
+                When(numbered, then=Cast(Substr(field, len(base) + 2), IntegerField())),
+                output_field=IntegerField(),
+            ))
+        rows = model._default_manager.filter(taken)
+        if exclude_pk is not None:
+            rows = rows.exclude(pk=exclude_pk)
+        found = rows.aggregate(**numbers)
+        for position, base in enumerate(chunk):
+            highest[base] = found[f'base_{position}'] or 0
+    return highest
+
+
+def allocate_slugs(model, bases, exclude_pk=None, field='slug'):
+    """
+    Return one unused slug for each base in bases, in order.
+
+    Costs one query per BASES_PER_QUERY distinct bases. Repeated bases in
+    the batch get consecutive suffixes, so the result can be bulk-inserted
+    as is.
+    """
+    bases = list(bases)
+    if not bases:
+        return []
+
+    highest = _highest_numbers(model, list(dict.fromkeys(bases)), exclude_pk, field)
+    used = set()
+    slugs = []
+    for base in bases:
+        highest[base] += 1
+        slug = _with_suffix(base, highest[base])
+        # Only when one base in the batch looks like another with a suffix
+        # ("tips" and "tips-2") can the next number already be used
+        while slug in used:
+            highest[base] += 1
+            slug = _with_suffix(base, highest[base])
+        used.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def allocate_slug(model, base, exclude_pk=None, field='slug'):
+    """Return an unused slug for base with one query"""
+    return allocate_slugs(model, [base], exclude_pk=exclude_pk, field=field)[0]
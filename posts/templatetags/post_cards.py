@@ -0,0 +1,30 @@
+from django import template
+from django.utils.safestring import mark_safe
+from interactions import likes
+from posts import card_cache
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts, template_name):
+    """
+    Render a list of post cards from the card cache.
+
+    Cached card HTML is shared by all viewers; the like button (which
+    depends on the current user) is rendered live into each card's slot.
+    """
+    posts = list(posts)
+    # Counts include likes still waiting for a write-behind flush
+    likes.merge_pending_likes(posts)
+    cards = card_cache.render_cards(posts, template_name)
+    like_button = context.template.engine.get_template('interactions/like_button.html')
+
+    output = []
+    for post in posts:
+        html = cards[post.pk]
+        if card_cache.LIKE_BUTTON_SLOT in html:
+            with context.push(post=post):
+                html = html.replace(card_cache.LIKE_BUTTON_SLOT, like_button.render(context))
+        output.append(html)
+    return mark_safe(''.join(output))
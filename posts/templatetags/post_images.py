@@ -0,0 +1,40 @@
+from django import template
+from django.utils.html import format_html
+from posts import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_image(post, variant, css_class=''):
+    """
+    Render a post's featured image for one use ('card', 'hero' or 'related').
+
+    Outputs a <picture> with a WebP source and a JPEG srcset, sized by the
+    derivatives' width and height so the layout does not shift while they
+    load. Falls back to the original upload until the derivatives exist.
+    Callers handle posts without an image.
+    """
+    image = post.featured_image
+    # Hero images are above the fold; everything else can wait for scrolling
+    loading = 'eager' if variant == 'hero' else 'lazy'
+    entries = post.image_variants.get(variant) if post.image_variants.get('source') == image.name else None
+
+    if not entries:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="{}" decoding="async">',
+            image.url, post.title, css_class, loading,
+        )
+
+    storage = image.storage
+    sizes = images.SIZES[variant]
+    smallest = entries[0]
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" loading="{}" decoding="async">'
+        '</picture>',
+        images.srcset(entries, 'webp', storage), sizes,
+        storage.url(smallest['jpeg']), images.srcset(entries, 'jpeg', storage), sizes,
+        smallest['width'], smallest['height'], post.title, css_class, loading,
+    )
@@ -1,3 +1,733 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+import time
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from django.utils.http import http_date
+
+from freespaces.query_budget import QueryBudgetMixin
+from feeds import search
+from freespaces.storage import serve_media
+from interactions.models import Comment, Like, liked_post_ids, path_segment
+from PIL import Image
+from . import card_cache, category_registry
+from .forms import PostForm
+from .models import Category, MediaFile, Post
+from .rendering import RENDERER_VERSION, render_content
+from .slugs import allocate_slugs
+from .text import EXCERPT_MAX_LENGTH, EXCERPT_WORDS, WORDS_PER_MINUTE, content_metadata, make_excerpt
+from .views import SEARCH_RESULTS_LIMIT
+
+
+class PostQueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'author_{i}', password='x') for i in range(4)]
+        cls.category = Category.objects.create(name='Travel')
+        cls.posts = [
+            Post.objects.create(
+                title=f'Trip {i}', content='<p>on the road</p>',
+                author=cls.users[i % 4], category=cls.category, status='published',
+            )
+            for i in range(20)
+        ]
+        for post in cls.posts[-10:]:
+            for user in cls.users:
+                Like.objects.create(user=user, post=post)
+                Comment.objects.create(user=user, post=post, content='nice')
+
+    def setUp(self):
+        # Budgets must hold with a cold card cache
+        cache.clear()
+        self.client.force_login(self.users[0])
+
+    def test_post_list(self):
+        self.assertWithinQueryBudget(reverse('posts:list'))
+
+    def test_post_list_search(self):
+        self.assertWithinQueryBudget(reverse('posts:list'), data={'search': 'trip'})
+
+    def test_post_detail(self):
+        self.assertWithinQueryBudget(self.posts[-1].get_absolute_url())
+
+    def test_my_posts(self):
+        self.assertWithinQueryBudget(reverse('posts:my_posts'))
+
+    def test_category_posts(self):
+        self.assertWithinQueryBudget(reverse('posts:category', kwargs={'category_name': 'Travel'}))
+
+
+class CategoryLeaderboardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('writer', password='x')
+        cls.travel = Category.objects.create(name='Travel')
+        cls.food = Category.objects.create(name='Food')
+
+    def setUp(self):
+        cache.clear()
+
+    def _counts(self):
+        return dict(Category.objects.values_list('name', 'post_count'))
+
+    def create(self, **kwargs):
+        return Post.objects.create(title='Trip', content='<p>x</p>', author=self.author, **kwargs)
+
+    def test_publish_and_unpublish(self):
+        post = self.create(category=self.travel)
+        self.create(category=self.travel, status='published')
+        self.assertEqual(self._counts(), {'Travel': 1, 'Food': 0})
+
+        post.status = 'published'
+        post.save()
+        self.assertEqual(self._counts(), {'Travel': 2, 'Food': 0})
+
+        post.status = 'draft'
+        post.save()
+        self.assertEqual(self._counts(), {'Travel': 1, 'Food': 0})
+
+    def test_recategorize(self):
+        post = self.create(category=self.travel, status='published')
+        post.category = self.food
+        post.save()
+        self.assertEqual(self._counts(), {'Travel': 0, 'Food': 1})
+
+        post.category = None
+        post.save()
+        self.assertEqual(self._counts(), {'Travel': 0, 'Food': 0})
+
+        # Drafts are not counted wherever they move
+        draft = self.create(category=self.travel)
+        draft.category = self.food
+        draft.save()
+        self.assertEqual(self._counts(), {'Travel': 0, 'Food': 0})
+
+    def test_delete(self):
+        published = self.create(category=self.food, status='published')
+        draft = self.create(category=self.food)
+        draft.delete()
+        self.assertEqual(self._counts(), {'Travel': 0, 'Food': 1})
+        published.delete()
+        self.assertEqual(self._counts(), {'Travel': 0, 'Food': 0})
+
+    def test_reconcile_fixes_drift(self):
+        self.create(category=self.food, status='published')
+        Category.objects.filter(pk=self.food.pk).update(post_count=0)
+        Category.objects.filter(pk=self.travel.pk).update(post_count=5)
+        category_registry.bump()
+        self.assertEqual(category_registry.popular(1)[0].name, 'Travel')
+
+        out = io.StringIO()
+        call_command('reconcile_category_counts', dry_run=True, stdout=out)
+        self.assertIn('Found 2 categories with drifted counts.', out.getvalue())
+        self.assertEqual(self._counts(), {'Travel': 5, 'Food': 0})
+
+        out = io.StringIO()
+        call_command('reconcile_category_counts', stdout=out)
+        self.assertIn('Travel: 5 -> 0', out.getvalue())
+        self.assertEqual(self._counts(), {'Travel': 0, 'Food': 1})
+        self.assertEqual(category_registry.popular(1)[0].name, 'Food')
+
+
+class PostCardCacheTests(TestCase):
+    CARDS = Template("{% load post_cards %}{% post_cards posts 'feeds/post_card.html' %}")
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('writer', password='x')
+        cls.reader = User.objects.create_user('reader', password='x')
+        cls.posts = [
+            Post.objects.create(title=f'Card {i}', content='<p>x</p>', author=cls.author, status='published')
+            for i in range(3)
+        ]
+        Like.objects.create(user=cls.reader, post=cls.posts[0])
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, user):
+        posts = list(Post.objects.filter(pk__in=[post.pk for post in self.posts]).select_related('author__profile'))
+        return self.CARDS.render(Context({
+            'posts': posts, 'user': user, 'liked_post_ids': liked_post_ids(user, posts),
+        }))
+
+    def test_cards_are_shared_and_like_buttons_are_per_viewer(self):
+        author_html = self.render(self.author)
+        self.assertEqual(card_cache.stats()['misses'], 3)
+        reader_html = self.render(self.reader)
+        self.assertEqual((card_cache.stats()['hits'], card_cache.stats()['misses']), (3, 3))
+
+        self.assertNotIn(card_cache.LIKE_BUTTON_SLOT, reader_html)
+        self.assertNotIn('fill-current', author_html)
+        self.assertEqual(reader_html.count('fill-current'), 1)
+        self.assertIn('Unlike this post', reader_html)
+
+    def test_bump_post_invalidates_its_card(self):
+        self.render(self.reader)
+        Post.objects.filter(pk=self.posts[1].pk).update(title='Renamed card')
+        self.assertNotIn('Renamed card', self.render(self.reader))
+
+        card_cache.reset_stats()
+        card_cache.bump_post(self.posts[1].pk)
+        self.assertIn('Renamed card', self.render(self.reader))
+        self.assertEqual((card_cache.stats()['hits'], card_cache.stats()['misses']), (2, 1))
+
+    def test_renaming_a_category_rerenders_its_cards(self):
+        category = Category.objects.create(name='Education')
+        Post.objects.filter(pk=self.posts[0].pk).update(category=category)
+        self.assertIn('data-category="education"', self.render(self.reader))
+
+        card_cache.reset_stats()
+        category.name = 'Science'
+        category.save()
+        html = self.render(self.reader)
+        self.assertIn('data-category="science"', html)
+        self.assertNotIn('data-category="education"', html)
+        self.assertEqual((card_cache.stats()['hits'], card_cache.stats()['misses']), (2, 1))
+
+
+class ContentMetadataTests(TestCase):
+    def test_plain_text_of_html(self):
+        metadata = content_metadata('<p>Tea &amp; <b>cake</b></p>\n<ul>\n<li>scones</li>\n</ul>')
+        self.assertEqual(metadata, {'excerpt': 'Tea & cake scones', 'word_count': 4, 'reading_time': 1})
+        self.assertEqual(content_metadata(None), {'excerpt': '', 'word_count': 0, 'reading_time': 1})
+
+    def test_dropped_elements_leave_no_text(self):
+        metadata = content_metadata('<p>hi <script>x</script></p><style>p { color: red }</style><p>there</p>')
+        self.assertEqual((metadata['excerpt'], metadata['word_count']), ('hi there', 2))
+
+    def test_excerpt_truncation(self):
+        words = [f'word{i}' for i in range(50)]
+        excerpt = make_excerpt(' '.join(words))
+        self.assertEqual(excerpt, ' '.join(words[:EXCERPT_WORDS]) + '…')
+        self.assertEqual(make_excerpt('short text'), 'short text')
+
+        long_words = ' '.join(['x' * 20] * EXCERPT_WORDS)
+        excerpt = make_excerpt(long_words)
+        self.assertEqual(len(excerpt), EXCERPT_MAX_LENGTH)
+        self.assertTrue(excerpt.endswith('…'))
+
+    def test_reading_time_rounds_up(self):
+        html = '<p>' + 'word ' * (WORDS_PER_MINUTE * 2 + 1) + '</p>'
+        metadata = content_metadata(html)
+        self.assertEqual((metadata['word_count'], metadata['reading_time']), (WORDS_PER_MINUTE * 2 + 1, 3))
+        self.assertEqual(content_metadata('<p>' + 'word ' * WORDS_PER_MINUTE + '</p>')['reading_time'], 1)
+
+    def test_backfill_post_metadata(self):
+        author = User.objects.create_user('writer', password='x')
+        posts = [
+            Post.objects.create(title=f'Old {i}', content='<p>one two three</p>', author=author)
+            for i in range(3)
+        ]
+        Post.objects.filter(pk__in=[posts[0].pk, posts[1].pk]).update(excerpt='', word_count=0, reading_time=0)
+        Post.objects.filter(pk=posts[2].pk).update(word_count=99)
+
+        out = io.StringIO()
+        call_command('backfill_post_metadata', missing_only=True, batch_size=1, stdout=out)
+        self.assertIn('Checked 2 posts. Updated 2.', out.getvalue())
+        self.assertEqual(
+            list(Post.objects.order_by('id').values_list('excerpt', 'word_count', 'reading_time')),
+            [('one two three', 3, 1), ('one two three', 3, 1), ('one two three', 99, 1)],
+        )
+
+        out = io.StringIO()
+        call_command('backfill_post_metadata', stdout=out)
+        self.assertIn('Checked 3 posts. Updated 1.', out.getvalue())
+        self.assertEqual(Post.objects.get(pk=posts[2].pk).word_count, 3)
+
+
+@override_settings(ANONYMOUS_PAGE_CACHE=True)
+class AnonymousPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('writer', password='x')
+        cls.post = Post.objects.create(title='Cached page', content='<p>x</p>', author=cls.author, status='published')
+
+    def setUp(self):
+        cache.clear()
+        self.url = self.post.get_absolute_url()
+
+    def test_cached_page_is_validated(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('no-cache', first['Cache-Control'])
+        self.assertFalse(first.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+        self.assertEqual((cached.content, cached['ETag']), (first.content, first['ETag']))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_logged_in_requests_bypass_the_cache(self):
+        self.client.get(self.url)
+        self.client.force_login(self.author)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='*').status_code, 200)
+
+    def test_post_save_bumps_the_cache(self):
+        first = self.client.get(self.url)
+        self.post.title = 'Renamed page'
+        self.post.save()
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Renamed page')
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_unpublishing_the_newest_post_changes_the_validator(self):
+        older = Post.objects.create(title='Older page', content='<p>x</p>', author=self.author, status='published')
+        home = reverse('feeds:home')
+        first = self.client.get(home)
+        self.post.status = 'draft'
+        self.post.save()
+        response = self.client.get(home, HTTP_IF_NONE_MATCH=first['ETag'],
+                                   HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 3600))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Cached page')
+        self.assertContains(response, older.title)
+
+
+class SlugAllocationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('writer', password='x')
+
+    def create(self, title):
+        return Post.objects.create(title=title, content='<p>x</p>', author=self.author)
+
+    def test_suffixes(self):
+        slugs = [self.create('Popular title').slug for _ in range(3)]
+        self.assertEqual(slugs, ['popular-title', 'popular-title-2', 'popular-title-3'])
+        self.assertEqual(self.create('!!!').slug[:5], 'post-')
+
+    def test_query_count_does_not_grow_with_duplicates(self):
+        for _ in range(20):
+            self.create('Same again')
+        with self.assertNumQueries(1):
+            self.assertEqual(allocate_slugs(Post, ['same-again']), ['same-again-21'])
+
+    def test_only_numbered_slugs_of_the_base_count(self):
+        for title in ('My trip', 'My trip to Rome', 'My trip 2024 recap', 'My trip to Rome'):
+            self.create(title)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(allocate_slugs(Post, ['my-trip', 'my-trip-to-rome']), ['my-trip-2', 'my-trip-to-rome-3'])
+        self.assertEqual(len(queries), 1)
+        # One aggregate row, not every slug sharing the prefix
+        self.assertIn('MAX(', queries[0]['sql'])
+
+    def test_batch(self):
+        self.create('Tips')
+        self.assertEqual(
+            allocate_slugs(Post, ['tips', 'tips', 'tips-2', 'fresh']),
+            ['tips-2', 'tips-3', 'tips-2-2', 'fresh'],
+        )
+
+    def test_retries_when_slug_is_taken_concurrently(self):
+        self.create('Race')
+        post = Post(title='Race', content='<p>x</p>', author=self.author)
+        stale = iter(['race'])
+        post._generate_unique_slug = lambda: next(stale, 'race-2')
+        post.save()
+        self.assertEqual(post.slug, 'race-2')
+
+
+class PostListSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        search.reset_index()
+        self.addCleanup(search.reset_index)
+        author = User.objects.create_user('searcher', password='x')
+        self.travel = Category.objects.create(name='Travel')
+        self.title_match = Post.objects.create(title='Tram lines', content='<p>maps</p>', author=author,
+                                               category=self.travel, status='published')
+        self.body_match = Post.objects.create(title='Lisbon', content='<p>old tram rides</p>', author=author,
+                                              category=self.travel, status='published')
+        self.elsewhere = Post.objects.create(title='Tram museum', content='<p>x</p>', author=author,
+                                             status='published')
+        Post.objects.create(title='Tram draft', content='<p>x</p>', author=author)
+
+    def _titles(self, **params):
+        return [post.title for post in self.client.get(reverse('posts:list'), params).context['posts']]
+
+    def test_results_keep_the_ranking(self):
+        self.assertEqual(self._titles(search='tram'), ['Tram museum', 'Tram lines', 'Lisbon'])
+        self.assertEqual(self._titles(search='tram', category='Travel'), ['Tram lines', 'Lisbon'])
+
+    def test_only_the_best_matches_are_listed(self):
+        author = User.objects.get(username='searcher')
+        for i in range(SEARCH_RESULTS_LIMIT):
+            Post.objects.create(title=f'Bus {i}', content='<p>tram stop</p>', author=author, status='published')
+        titles = self._titles(search='tram')
+        self.assertEqual(len(titles), SEARCH_RESULTS_LIMIT)
+        self.assertEqual(titles[:2], ['Tram museum', 'Tram lines'])
+
+
+class CategoryRegistryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.art = Category.objects.create(name='Art')
+        cls.music = Category.objects.create(name='Music')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reads_skip_the_database_once_loaded(self):
+        category_registry.categories()
+        with self.assertNumQueries(0):
+            self.assertEqual([c.name for c in category_registry.categories()], ['Art', 'Music'])
+            self.assertEqual(category_registry.get_by_name('Music').pk, self.music.pk)
+            self.assertEqual(category_registry.get(self.art.pk).name, 'Art')
+            self.assertIsNone(category_registry.get_by_name('Nope'))
+
+    def test_version_bump_reloads(self):
+        category_registry.categories()
+        # Another worker's change: the row changes, then the shared version
+        Category.objects.filter(pk=self.art.pk).update(name='Painting')
+        self.assertIsNotNone(category_registry.get_by_name('Art'))
+        category_registry.bump()
+        self.assertEqual(category_registry.get(self.art.pk).name, 'Painting')
+
+        Category.objects.create(name='Books')
+        self.assertEqual([c.name for c in category_registry.categories()], ['Books', 'Music', 'Painting'])
+
+    def test_post_counts_refresh_popular(self):
+        author = User.objects.create_user('counted', password='x')
+        Post.objects.create(title='Song', content='<p>la</p>', author=author, category=self.music, status='published')
+        self.assertEqual(category_registry.popular(1)[0].name, 'Music')
+
+    def test_post_form_uses_registry(self):
+        category_registry.categories()
+        with self.assertNumQueries(0):
+            form = PostForm(data={'title': 'T', 'content': '<p>x</p>', 'category': self.music.pk, 'status': 'draft'})
+            self.assertTrue(form.is_valid(), form.errors)
+            self.assertIn('Select a category (optional)', str(form['category']))
+        self.assertEqual(form.cleaned_data['category'].pk, self.music.pk)
+        self.assertIsNot(form.cleaned_data['category'], category_registry.get(self.music.pk))
+
+        author = User.objects.create_user('former', password='x')
+        post = form.save(commit=False)
+        post.author = author
+        post.save()
+        self.assertEqual(Post.objects.get(pk=post.pk).category_id, self.music.pk)
+
+        form = PostForm(instance=post)
+        self.assertIn(f'<option value="{self.music.pk}" selected>', str(form['category']))
+        form = PostForm(data={'title': 'T', 'content': '<p>x</p>', 'category': '', 'status': 'draft'}, instance=post)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertIsNone(Post.objects.get(pk=post.pk).category_id)
+
+        form = PostForm(data={'title': 'T', 'content': '<p>x</p>', 'category': 999, 'status': 'draft'})
+        self.assertIn('category', form.errors)
+
+
+class ChangeTrackingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('writer', password='x')
+        cls.category = Category.objects.create(name='Art')
+        cls.post = Post.objects.create(
+            title='First draft', content='<p>one two</p>', author=cls.author, category=cls.category,
+        )
+
+    def test_changed_fields(self):
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.changed_fields(), set())
+        post.title = 'Second draft'
+        self.assertEqual(post.changed_fields(), {'title'})
+        self.assertEqual(post.original_value('title'), 'First draft')
+        self.assertFalse(post.has_changed('author_id'))
+
+    def test_update_statement(self):
+        post = Post.objects.get(pk=self.post.pk)
+        post.title = 'Second draft'
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        update = next(query['sql'] for query in queries if query['sql'].startswith('UPDATE "posts_post"'))
+        self.assertIn('"title"', update)
+        self.assertNotIn('"content"', update)
+        # The old title comes from the snapshot, not from re-reading the row
+        self.assertFalse(any(query['sql'].startswith('SELECT "posts_post"') for query in queries))
+        self.assertEqual(post.changed_fields(), set())
+
+    def test_unchanged_save_is_skipped(self):
+        post = Post.objects.get(pk=self.post.pk)
+        with self.assertNumQueries(0):
+            post.save()
+
+    def test_content_change_refreshes_metadata(self):
+        post = Post.objects.get(pk=self.post.pk)
+        post.content = '<p>' + 'word ' * 10 + '</p>'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.word_count, 10)
+
+    def test_publishing_updates_leaderboard(self):
+        post = Post.objects.get(pk=self.post.pk)
+        post.status = 'published'
+        post.save()
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.post_count, 1)
+        post.delete()
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.post_count, 0)
+
+
+def jpeg_upload(name, size):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 120, 40)).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class ContentRenderingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('renderer', password='x')
+
+    def test_sanitizes_and_normalizes(self):
+        html = render_content(
+            '<h2>Intro</h2><p onclick="steal()">Hi<script>alert(1)</script></p>'
+            '<a href="javascript:alert(1)" target="_blank">x</a>'
+            '<img src="data:image/png;base64,AAAA" style="max-width: 100%; background: url(x)">'
+            '<h2>Intro</h2><ul><li>unclosed'
+        )
+        self.assertEqual(
+            html,
+            '<h2 id="content-intro">Intro</h2><p>Hi</p><a>x</a>'
+            '<img src="data:image/png;base64,AAAA" style="max-width: 100%" loading="lazy" decoding="async">'
+            '<h2 id="content-intro-2">Intro</h2><ul><li>unclosed</li></ul>'
+        )
+
+    def test_detail_serves_stored_html(self):
+        post = Post.objects.create(
+            title='Rendered', content='<p>safe<script>alert(1)</script></p>',
+            author=self.author, status='published',
+        )
+        self.assertEqual(post.content_html, '<p>safe</p>')
+        self.assertEqual(post.content_html_version, RENDERER_VERSION)
+        response = self.client.get(post.get_absolute_url())
+        self.assertContains(response, '<p>safe</p>')
+        self.assertNotContains(response, 'alert(1)')
+
+    def test_rerender_outdated_posts(self):
+        post = Post.objects.create(title='Old rules', content='<h1>Title</h1>', author=self.author)
+        Post.objects.filter(pk=post.pk).update(content_html='<h1>Title</h1>', content_html_version=0)
+        # Outdated rows are rendered on the fly until re-rendered
+        self.assertIn('id="content-title"', Post.objects.get(pk=post.pk).rendered_content)
+
+        call_command('rerender_posts', stdout=io.StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.content_html, '<h1 id="content-title">Title</h1>')
+        self.assertEqual(post.content_html_version, RENDERER_VERSION)
+
+
+@override_settings(BACKGROUND_JOBS_SYNC=True)
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.author = User.objects.create_user('photographer', password='x')
+
+    def create_post(self, size=(1200, 900)):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                title='Harbour', content='<p>boats</p>', author=self.author,
+                featured_image=jpeg_upload('harbour.jpg', size),
+            )
+        post.refresh_from_db()
+        return post
+
+    def test_variants_are_built_after_commit(self):
+        post = self.create_post()
+        variants = post.image_variants
+        self.assertEqual(variants['source'], post.featured_image.name)
+        # Never upscaled: the 1600px hero is capped at the original width
+        self.assertEqual([entry['width'] for entry in variants['hero']], [960, 1200])
+        self.assertEqual(variants['card'][0]['height'], 300)
+        storage = post.featured_image.storage
+        with storage.open(variants['card'][0]['webp']) as f, Image.open(f) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (400, 300)))
+
+    def test_replacing_the_image_releases_old_variants(self):
+        post = self.create_post()
+        old_file = post.image_variants['card'][0]['jpeg']
+        self.assertEqual(MediaFile.objects.get(name=old_file).ref_count, 1)
+
+        post.featured_image = jpeg_upload('lighthouse.jpg', (500, 500))
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        post.refresh_from_db()
+
+        self.assertEqual(MediaFile.objects.get(name=old_file).ref_count, 0)
+        self.assertEqual(post.image_variants['source'], post.featured_image.name)
+        self.assertEqual([entry['width'] for entry in post.image_variants['card']], [400, 500])
+
+    def test_template_tag_renders_srcset(self):
+        post = self.create_post()
+        html = Template("{% load post_images %}{% post_image post 'card' 'cover' %}").render(Context({'post': post}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(' 800w', html)
+        self.assertIn('width="400" height="300"', html)
+
+        # Until derivatives exist the original is served
+        post.image_variants = {}
+        html = Template("{% load post_images %}{% post_image post 'card' %}").render(Context({'post': post}))
+        self.assertIn(f'src="{post.featured_image.url}"', html)
+        self.assertNotIn('srcset', html)
+
+
+@override_settings(BACKGROUND_JOBS_SYNC=True)
+class MediaStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.author = User.objects.create_user('archivist', password='x')
+
+    def create_post(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Post.objects.create(title='Dunes', content='<p>sand</p>', author=self.author, featured_image=upload)
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.create_post(jpeg_upload('dunes.jpg', (300, 200)))
+        second = self.create_post(jpeg_upload('copy of dunes.JPG', (300, 200)))
+        name = first.featured_image.name
+        self.assertEqual(second.featured_image.name, name)
+        self.assertRegex(name, r'^post_images/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(MediaFile.objects.get(name=name).ref_count, 2)
+
+        first.delete()
+        self.assertEqual(MediaFile.objects.get(name=name).ref_count, 1)
+        call_command('gc_media', grace_hours=0, stdout=io.StringIO())
+        self.assertTrue(first.featured_image.storage.exists(name))
+
+        second.delete()
+        call_command('gc_media', grace_hours=0, stdout=io.StringIO())
+        self.assertFalse(first.featured_image.storage.exists(name))
+        self.assertFalse(MediaFile.objects.filter(name=name).exists())
+
+    def test_recount_and_grace_period(self):
+        post = self.create_post(jpeg_upload('dunes.jpg', (300, 200)))
+        post.refresh_from_db()
+        variant = post.image_variants['card'][0]['webp']
+        MediaFile.objects.all().delete()
+
+        call_command('gc_media', recount=True, stdout=io.StringIO())
+        self.assertEqual(MediaFile.objects.get(name=post.featured_image.name).ref_count, 1)
+        # The same derivative serves card, hero and related for a small image
+        self.assertEqual(MediaFile.objects.get(name=variant).ref_count, 3)
+
+        Post.objects.filter(pk=post.pk).delete()
+        # Released just now, so still inside the default grace period
+        call_command('gc_media', stdout=io.StringIO())
+        self.assertTrue(post.featured_image.storage.exists(variant))
+
+    def test_hashed_files_are_served_immutable(self):
+        post = self.create_post(jpeg_upload('dunes.jpg', (300, 200)))
+        request = RequestFactory().get(post.featured_image.url)
+        response = serve_media(request, post.featured_image.name, document_root=self.media_root)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+
+class TransferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('exporter', password='x')
+        cls.reader = User.objects.create_user('reader', password='x')
+        category = Category.objects.create(name='Travel')
+        cls.post = Post.objects.create(
+            title='Lisbon', content='<h2>Trams</h2><p>Yellow</p>', author=cls.author,
+            category=category, status='published',
+        )
+        Post.objects.filter(pk=cls.post.pk).update(created_at='2020-01-02T03:04:05Z')
+        Like.objects.create(user=cls.reader, post=cls.post)
+        comment = Comment.objects.create(user=cls.reader, post=cls.post, content='Lovely')
+        reply = Comment.objects.create(user=cls.author, post=cls.post, parent=comment, content='Thanks')
+        Comment.objects.create(user=cls.reader, post=cls.post, parent=reply, content='Welcome')
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = f'{directory}/posts.jsonl'
+        call_command('export_posts', self.path, stderr=io.StringIO())
+        Post.objects.all().delete()
+
+    def _import(self, *args):
+        call_command('import_posts', self.path, '--skip-search-index', *args, stdout=io.StringIO())
+
+    def test_round_trip(self):
+        self._import()
+        post = Post.objects.get(slug='lisbon')
+        self.assertEqual(post.created_at.year, 2020)
+        self.assertEqual((post.author, post.category.name), (self.author, 'Travel'))
+        self.assertEqual((post.like_count, post.comment_count), (1, 3))
+        self.assertIn('id="content-trams"', post.content_html)
+
+        # Threads come back with their paths and reply counts
+        comment, reply, nested = post.comments.order_by('path')
+        self.assertEqual((comment.user, comment.root, comment.reply_count), (self.reader, None, 2))
+        self.assertEqual(
+            [(c.content, c.parent_id, c.root_id, c.depth) for c in (reply, nested)],
+            [('Thanks', comment.id, comment.id, 1), ('Welcome', reply.id, comment.id, 2)],
+        )
+        self.assertEqual(nested.path, path_segment(comment.id) + path_segment(reply.id) + path_segment(nested.id))
+
+        # Importing again keeps the existing post and allocates a new slug
+        self._import()
+        self.assertEqual(sorted(Post.objects.values_list('slug', flat=True)), ['lisbon', 'lisbon-2'])
+
+    def test_version_1_comments_import_as_top_level(self):
+        with open(self.path) as f:
+            records = [json.loads(line) for line in f]
+        for record in records:
+            if record['type'] == 'header':
+                record['version'] = 1
+            for entry in record.get('comments', ()):
+                del entry['parent']
+        with open(self.path, 'w') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+
+        self._import()
+        comments = Comment.objects.order_by('id')
+        self.assertEqual([(c.root_id, c.depth, c.path) for c in comments], [
+            (None, 0, path_segment(c.id)) for c in comments
+        ])
+
+    def test_resume_skips_committed_batches(self):
+        self._import('--batch-size', '1')
+        self._import('--resume')
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_resume_skips_posts_committed_after_the_checkpoint(self):
+        self._import('--batch-size', '1')
+        # A crash between committing the post batch and writing its checkpoint
+        with open(f'{self.path}.checkpoint') as f:
+            checkpoint = json.load(f)
+        checkpoint.update(offset=0, line=0)
+        with open(f'{self.path}.checkpoint', 'w') as f:
+            json.dump(checkpoint, f)
+
+        self._import('--resume')
+        self.assertEqual(list(Post.objects.values_list('slug', flat=True)), ['lisbon'])
+        self.assertEqual((Like.objects.count(), Comment.objects.count()), (1, 3))
@@ -0,0 +1,72 @@
+"""
+Plain-text helpers for rich-text post content.
+
+Post bodies are HTML from the editor. Anything shown in lists (excerpts,
+word counts, reading time) is derived from them once, when the post is
+saved, so list pages never have to load or parse the full content.
+"""
+import math
+import re
+from html.parser import HTMLParser
+
+from django.utils.text import Truncator
+
+from .rendering import DROPPED_TAGS
+
+EXCERPT_WORDS = 40
+EXCERPT_MAX_LENGTH = 300
+WORDS_PER_MINUTE = 200
+
+
+class _TextExtractor(HTMLParser):
+    """Collects text outside the elements rendering drops with their contents"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+
+    def handle_startendtag(self, tag, attrs):
+        pass
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(data)
+
+
+def html_to_text(content):
+    """Plain text of editor HTML, with entities decoded and whitespace collapsed"""
+    parser = _TextExtractor()
+    parser.feed(content or '')
+    parser.close()
+    return re.sub(r'\s+', ' ', ''.join(parser.parts)).strip()
+
+
+def make_excerpt(text):
+    """First EXCERPT_WORDS words of plain text, never longer than EXCERPT_MAX_LENGTH"""
+    excerpt = Truncator(text).words(EXCERPT_WORDS, truncate='…')
+    return Truncator(excerpt).chars(EXCERPT_MAX_LENGTH, truncate='…')
+
+
+def reading_time(word_count):
+    """Whole minutes to read word_count words, at least one"""
+    return max(1, math.ceil(word_count / WORDS_PER_MINUTE))
+
+
+def content_metadata(content):
+    """Return the stored excerpt, word_count and reading_time for post content"""
+    text = html_to_text(content)
+    word_count = len(text.split())
+    return {
+        'excerpt': make_excerpt(text),
+        'word_count': word_count,
+        'reading_time': reading_time(word_count),
+    }
@@ -0,0 +1,99 @@
+"""
+Change tracking for model instances.
+
+Models using ChangeTrackingMixin remember their field values as loaded from
+the database, so code that needs to know what an edit changed (slug
+regeneration, the admin's author check, cache invalidation) can ask the
+instance instead of fetching the row again. Saving an existing instance
+writes only the changed columns.
+"""
+
+
+class ChangeTrackingMixin:
+    """Model mixin snapshotting loaded field values; must come before models.Model"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_fields()
+        return instance
+
+    def _snapshot_fields(self, attnames=None):
+        if attnames is None:
+            self._loaded_values = {}
+            attnames = [field.attname for field in self._meta.concrete_fields]
+        for attname in attnames:
+            # Read through __dict__ so deferred fields are not fetched
+            if attname in self.__dict__:
+                self._loaded_values[attname] = self._comparable(self.__dict__[attname])
+
+    @staticmethod
+    def _comparable(value):
+        # File fields hold a name, or a FieldFile once accessed
+        return getattr(value, 'name', value) if hasattr(value, 'storage') else value
+
+    def _attname(self, field_name):
+        return self._meta.get_field(field_name).attname
+
+    @property
+    def is_tracked(self):
+        """Whether this instance has a snapshot to compare against"""
+        return hasattr(self, '_loaded_values')
+
+    def loaded_values(self):
+        """{attname: value} as last loaded from or saved to the database"""
+        return dict(getattr(self, '_loaded_values', {}))
+
+    def original_value(self, field_name, default=None):
+        return getattr(self, '_loaded_values', {}).get(self._attname(field_name), default)
+
+    def changed_fields(self):
+        """Names of fields whose value differs from the snapshot"""
+        if not self.is_tracked:
+            return {field.name for field in self._meta.concrete_fields}
+        changed = set()
+        for field in self._meta.concrete_fields:
+            if field.attname not in self.__dict__:
+                continue
+            if field.attname not in self._loaded_values:
+                # Deferred when loaded, then assigned
+                changed.add(field.name)
+            elif self._comparable(self.__dict__[field.attname]) != self._loaded_values[field.attname]:
+                changed.add(field.name)
+        return changed
+
+    def has_changed(self, field_name):
+        """Whether one field changed; accepts a name or attname ('author' or 'author_id')"""
+        return self._meta.get_field(field_name).name in self.changed_fields()
+
+    def save(self, *args, **kwargs):
+        if (
+            self.is_tracked
+            and not self._state.adding
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+        ):
+            changed = self.changed_fields()
+            if changed:
+                # auto_now fields are set in pre_save and must go along
+                changed |= {
+                    field.name for field in self._meta.concrete_fields
+                    if getattr(field, 'auto_now', False)
+                }
+            # An empty list skips the save (and its signals) entirely
+            kwargs['update_fields'] = changed
+
+        super().save(*args, **kwargs)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or not self.is_tracked:
+            self._snapshot_fields()
+        else:
+            self._snapshot_fields([self._attname(name) for name in update_fields])
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if fields is None or not self.is_tracked:
+            self._snapshot_fields()
+        else:
+            self._snapshot_fields([self._attname(name) for name in fields])
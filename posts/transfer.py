@@ -0,0 +1,61 @@
+"""
+JSON Lines format shared by the export_posts and import_posts commands.
+
+One JSON object per line, each with a "type":
+
+    {"type": "header", "version": 2, "exported_at": "..."}
+    {"type": "user", "username": "...", "email": "...", "first_name": "...",
+     "last_name": "...", "date_joined": "...", "bio": "..."}
+    {"type": "category", "name": "...", "created_at": "..."}
+    {"type": "post", "title": "...", "slug": "...", "content": "<p>...</p>",
+     "status": "published", "author": "<username>", "category": "<name>" or null,
+     "featured_image": "<storage name>" or "", "created_at": "...",
+     "updated_at": "...", "published_at": "..." or null,
+     "likes": [{"user": "<username>", "created_at": "..."}, ...],
+     "comments": [{"user": "<username>", "content": "...", "created_at": "...",
+                   "updated_at": "...", "parent": <index> or null}, ...]}
+
+Users and categories come before the posts that refer to them. A post's
+comments are listed oldest first, and a reply's "parent" is the index of
+the comment it answers in that list, so it always points back; version 1
+files have no "parent" and import as top-level comments. Posts refer
+to users and categories by username and name, not by id, so a file can be
+imported into a database that already has content. Derived fields
+(excerpt, rendered HTML, counters, search documents) are not exported; the
+importer recomputes them.
+"""
+import json
+from contextlib import contextmanager
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+FORMAT_VERSION = 2
+
+
+def dump_record(record_type, **fields):
+    """One line of the export file, newline included"""
+    return json.dumps({'type': record_type, **fields}, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Let bulk_create write the created_at/updated_at values set on objects.
+
+    auto_now and auto_now_add fields overwrite any value with the current
+    time when a row is inserted. Only for single-threaded commands: the
+    flags are switched off on the shared model fields while this is active.
+    """
+    switched = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            flags = {flag: getattr(field, flag, False) for flag in ('auto_now', 'auto_now_add')}
+            if any(flags.values()):
+                switched.append((field, flags))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, flags in switched:
+            for flag, value in flags.items():
+                setattr(field, flag, value)
@@ -7,6 +7,7 @@ urlpatterns = [
     path('', views.post_list, name='list'),
     path('create/', views.post_create, name='create'),
     path('my-posts/', views.my_posts, name='my_posts'),
+    path('card-cache/stats/', views.card_cache_stats, name='card_cache_stats'),
     path('<slug:slug>/', views.post_detail, name='detail'),
     path('<slug:slug>/edit/', views.post_edit, name='edit'),
     path('<slug:slug>/delete/', views.post_delete, name='delete'),
@@ -1,52 +1,67 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
-from django.http import Http404, HttpResponsePermanentRedirect
-from .models import Post, Category
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponsePermanentRedirect, JsonResponse
+from freespaces.query_budget import query_budget
+from interactions.likes import post_like_count
+from interactions.models import liked_post_ids
+from feeds.related import related_posts_for
+from feeds.search import search_post_ids
+from .models import Post
 from .forms import PostForm
+from . import card_cache, category_registry
+from .page_cache import anonymous_page_cache
+
+# Search matches listed on post_list
+SEARCH_RESULTS_LIMIT = 48
+
 
 # Create your views here.
+@query_budget(10)
 def post_list(request):
     """Display all published posts"""
-    posts = Post.objects.filter(status='published').select_related('author', 'category')
-    categories = Category.objects.all()
+    posts = Post.objects.filter(status='published').select_related('author__profile', 'category').defer('content', 'content_html')
+    categories = category_registry.categories()
     
     # Filter by category if specified
     category_name = request.GET.get('category')
     if category_name:
-        posts = posts.filter(category__name=category_name)
+        category = category_registry.get_by_name(category_name)
+        posts = posts.filter(category_id=category.pk) if category else posts.none()
     
-    # Search functionality
+    # Search functionality: the best matches, most relevant first. Only
+    # their ids go to the database, and in_bulk skips the ORDER BY
     search_query = request.GET.get('search')
     if search_query:
-        posts = posts.filter(
-            Q(title__icontains=search_query) | 
-            Q(category__name__icontains=search_query)
-        )
+        ranked_ids = list(search_post_ids(search_query)[:SEARCH_RESULTS_LIMIT])
+        posts_by_id = posts.order_by().in_bulk(ranked_ids)
+        posts = [posts_by_id[pk] for pk in ranked_ids if pk in posts_by_id]
     
     context = {
         'posts': posts,
         'categories': categories,
         'current_category': category_name,
         'search_query': search_query,
+        'liked_post_ids': liked_post_ids(request.user, posts),
     }
     return render(request, 'posts/post_list.html', context)
 
+@query_budget(10)
+@anonymous_page_cache('post_detail')
 def post_detail(request, slug):
-    """Display single post with related posts from same author"""
+    """Display single post with its precomputed related posts"""
     try:
-        post = Post.objects.select_related('author', 'category').get(slug=slug)
-
-        # Get related posts from the same author (excluding current post)
-        related_posts = Post.objects.filter(
-            author=post.author,
-            status='published'
-        ).exclude(id=post.id).select_related('category') # Exclude current post
+        # The page shows the stored rendering; content is only read if it is outdated
+        post = Post.objects.select_related('author__profile', 'category').defer('content').get(slug=slug)
+        # Includes likes still waiting for a write-behind flush
+        post.like_count = post_like_count(post)
 
         context = {
             'post': post,
-            'related_posts': related_posts,
+            # Only shown on published posts
+            'related_posts': related_posts_for(post) if post.status == 'published' else [],
+            'liked_post_ids': liked_post_ids(request.user, [post]),
         }
 
         # If post is published, anyone can view it
@@ -107,24 +122,40 @@ def post_delete(request, slug):
 
     return render(request, 'posts/post_delete.html', {'post': post})
 
+@query_budget(8)
 @login_required
 def my_posts(request):
     """Display user's own posts"""
-    posts = Post.objects.filter(author=request.user).select_related('category')
-    return render(request, 'posts/my_posts.html', {'posts': posts})
+    posts = Post.objects.filter(author=request.user).select_related('category').defer('content', 'content_html')
+    context = {
+        'posts': posts,
+        'liked_post_ids': liked_post_ids(request.user, posts),
+    }
+    return render(request, 'posts/my_posts.html', context)
 
+@query_budget(10)
+@anonymous_page_cache('category_posts')
 def category_posts(request, category_name):
     """Display posts by category"""
-    category = get_object_or_404(Category, name=category_name)
-    posts = Post.objects.filter(category=category, status='published').select_related('author')
+    category = category_registry.get_by_name(category_name)
+    if category is None:
+        raise Http404("No Category matches the given query.")
+    posts = Post.objects.filter(category=category, status='published').select_related('author__profile').defer('content', 'content_html')
     
     context = {
         'posts': posts,
         'category': category,
+        'liked_post_ids': liked_post_ids(request.user, posts),
     }
     return render(request, 'posts/category_posts.html', context)
 
 
+@staff_member_required
+def card_cache_stats(request):
+    """Hit/miss counters of the rendered post card cache"""
+    return JsonResponse(card_cache.stats())
+
+
 # Backward compatibility redirect views
 def post_detail_redirect(request, pk):
     """Redirect old ID-based URLs to new slug-based URLs"""
@@ -19,7 +19,6 @@ const csrftoken = getCookie('csrftoken');
 
 document.addEventListener('DOMContentLoaded', function() {
     const filterButtons = document.querySelectorAll('.category-filter-btn');
-    const postItems = document.querySelectorAll('.post-item');
     const postsContainer = document.getElementById('posts-container');
     const loadingIndicator = document.getElementById('loading-indicator');
     const noPostsMessage = document.getElementById('no-posts-message');
@@ -64,7 +63,8 @@ document.addEventListener('DOMContentLoaded', function() {
     function filterPosts(category) {
         let visiblePostsCount = 0;
         
-        postItems.forEach(post => {
+        // Query on every call so cards appended by infinite scroll are included
+        document.querySelectorAll('.post-item').forEach(post => {
             const postCategory = post.getAttribute('data-category');
             
             if (category === 'all' || postCategory === category) {
@@ -128,19 +128,42 @@ function initLikeButtons() {
     });
 }
 
+// One key per click, reused by its retries, so the server toggles once
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
+function postLike(postId, key, retries) {
+    return fetch(`/interactions/like/${postId}/`, {
+        method: 'POST',
+        headers: {
+            'X-CSRFToken': csrftoken,
+            'Content-Type': 'application/json',
+            'Idempotency-Key': key,
+        },
+    })
+    .then(response => {
+        if (response.status >= 500 && retries > 0) {
+            return postLike(postId, key, retries - 1);
+        }
+        return response.json();
+    }, error => {
+        if (retries > 0) {
+            return postLike(postId, key, retries - 1);
+        }
+        throw error;
+    });
+}
+
 function handleLikeClick(button) {
     const postId = button.dataset.postId;
     
     // If we have a post ID, make AJAX request
     if (postId) {
-        fetch(`/interactions/like/${postId}/`, {
-            method: 'POST',
-            headers: {
-                'X-CSRFToken': csrftoken,
-                'Content-Type': 'application/json',
-            },
-        })
-        .then(response => response.json())
+        postLike(postId, newIdempotencyKey(), 2)
         .then(data => {
             updateLikeButton(button, data.liked, data.like_count);
             createFloatingHeart(button);
@@ -314,13 +337,27 @@ function initCommentSystem() {
             handleCommentDelete(commentId);
         }
         
+        // Handle replies
+        if (e.target.closest('.reply-comment-btn')) {
+            e.preventDefault();
+            openReplyForm(e.target.closest('.reply-comment-btn'));
+        }
+        
+        // Handle loading a thread, a page of replies at a time
+        if (e.target.closest('.load-thread')) {
+            e.preventDefault();
+            const btn = e.target.closest('.load-thread');
+            const postId = document.querySelector('.comment-toggle-btn').dataset.postId;
+            loadThread(postId, btn.dataset.rootId, btn.dataset.cursor);
+        }
+        
         // Handle load more comments
         if (e.target.closest('.load-more-comments')) {
             e.preventDefault();
             const btn = e.target.closest('.load-more-comments');
-            const nextPage = btn.dataset.nextPage;
+            const nextCursor = btn.dataset.nextCursor;
             const postId = document.querySelector('.comment-toggle-btn').dataset.postId;
-            loadMoreComments(postId, nextPage);
+            loadMoreComments(postId, nextCursor);
         }
     });
 }
@@ -341,35 +378,43 @@ function hideCommentsSection() {
     }
 }
 
-function loadComments(postId, page = 1) {
+function loadComments(postId, cursor = null) {
     const commentsLoading = document.getElementById('comments-loading');
     const commentsList = document.getElementById('comments-list');
     
     if (commentsLoading) commentsLoading.classList.remove('hidden');
     
-    fetch(`/interactions/comments/${postId}/?page=${page}`)
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+    fetch(`/interactions/comments/${postId}/${query}`)
         .then(response => response.json())
         .then(data => {
             if (commentsLoading) commentsLoading.classList.add('hidden');
             
-            if (page === 1) {
+            commentsList.dataset.viewerId = data.viewer_id || '';
+            if (!cursor) {
                 commentsList.innerHTML = data.comments_html;
+                applyCommentViewer(commentsList);
+                // Polling asks for comments newer than the first page
+                commentsList.dataset.newestCursor = data.newest_cursor || '';
+                startCommentPolling(postId);
             } else {
-                // Append new comments for pagination
+                // Append new comments for pagination, above the load more button
+                const container = commentsList.querySelector('.comments-list') || commentsList;
+                const loadMoreBtn = commentsList.querySelector('.load-more-comments');
+                const anchor = loadMoreBtn ? loadMoreBtn.parentElement : null;
                 const tempDiv = document.createElement('div');
                 tempDiv.innerHTML = data.comments_html;
-                const newComments = tempDiv.querySelectorAll('.comment-item');
-                newComments.forEach(comment => {
-                    commentsList.appendChild(comment);
+                applyCommentViewer(tempDiv);
+                tempDiv.querySelectorAll('.comment-item').forEach(comment => {
+                    container.insertBefore(comment, anchor);
                 });
                 
                 // Update load more button
-                const loadMoreBtn = commentsList.querySelector('.load-more-comments');
                 if (loadMoreBtn) {
                     if (data.has_next) {
-                        loadMoreBtn.dataset.nextPage = data.current_page + 1;
+                        loadMoreBtn.dataset.nextCursor = data.next_cursor;
                     } else {
-                        loadMoreBtn.remove();
+                        anchor.remove();
                     }
                 }
             }
@@ -381,8 +426,202 @@ function loadComments(postId, page = 1) {
         });
 }
 
-function loadMoreComments(postId, page) {
-    loadComments(postId, page);
+function loadMoreComments(postId, cursor) {
+    loadComments(postId, cursor);
+}
+
+// Comment HTML is cached and shared by every viewer: show delete buttons on
+// the viewer's own comments and turn timestamps into relative times here
+function applyCommentViewer(container) {
+    const viewerId = document.getElementById('comments-list').dataset.viewerId;
+    container.querySelectorAll('.delete-comment-btn').forEach(btn => {
+        if (viewerId && btn.dataset.authorId === viewerId) {
+            btn.classList.remove('hidden');
+        }
+    });
+    container.querySelectorAll('.reply-comment-btn').forEach(btn => {
+        btn.classList.toggle('hidden', !viewerId);
+    });
+    container.querySelectorAll('time.comment-time').forEach(time => {
+        time.textContent = relativeTime(new Date(time.getAttribute('datetime')));
+    });
+}
+
+function relativeTime(date) {
+    const seconds = Math.max(0, Math.floor((Date.now() - date.getTime()) / 1000));
+    const units = [
+        ['year', 31536000], ['month', 2592000], ['week', 604800],
+        ['day', 86400], ['hour', 3600], ['minute', 60],
+    ];
+    for (const [name, size] of units) {
+        const count = Math.floor(seconds / size);
+        if (count >= 1) {
+            return `${count}\u00a0${name}${count === 1 ? '' : 's'} ago`;
+        }
+    }
+    return '0\u00a0minutes ago';
+}
+
+// Check for comments posted since the list was loaded
+const COMMENT_POLL_INTERVAL = 30000;
+let commentPollTimer = null;
+
+function startCommentPolling(postId) {
+    if (commentPollTimer) clearInterval(commentPollTimer);
+    commentPollTimer = setInterval(() => {
+        if (document.hidden) return;
+        pollNewComments(postId);
+        applyCommentViewer(document.getElementById('comments-list'));
+    }, COMMENT_POLL_INTERVAL);
+}
+
+function pollNewComments(postId) {
+    const commentsList = document.getElementById('comments-list');
+    const since = commentsList.dataset.newestCursor;
+    if (!since) {
+        // Nothing to count from yet; reload the first page instead
+        loadComments(postId);
+        return;
+    }
+    
+    fetch(`/interactions/comments/${postId}/?since=${encodeURIComponent(since)}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) return;
+            const container = commentsList.querySelector('.comments-list') || commentsList;
+            const tempDiv = document.createElement('div');
+            tempDiv.innerHTML = data.comments_html;
+            applyCommentViewer(tempDiv);
+            // Newest first; the user's own comments are already shown
+            Array.from(tempDiv.querySelectorAll('.comment-item')).reverse().forEach(comment => {
+                if (!commentsList.querySelector(`[data-comment-id="${comment.dataset.commentId}"]`)) {
+                    container.insertBefore(comment, container.firstChild);
+                }
+            });
+            commentsList.dataset.newestCursor = data.newest_cursor;
+            updateCommentCount(data.comment_count);
+            if (data.has_newer) pollNewComments(postId);
+        })
+        .catch(error => console.error('Error polling comments:', error));
+}
+
+function loadThread(postId, rootId, cursor) {
+    let url = `/interactions/comments/${postId}/?thread=${encodeURIComponent(rootId)}`;
+    if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+    fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            const replies = document.querySelector(`.comment-replies[data-root-id="${rootId}"]`);
+            if (!replies || data.error) return;
+            const tempDiv = document.createElement('div');
+            tempDiv.innerHTML = data.comments_html;
+            applyCommentViewer(tempDiv);
+            // The first page replaces the replies shown under the comment
+            if (!cursor) replies.innerHTML = '';
+            const loadThreadBtn = replies.querySelector(':scope > .load-thread');
+            if (loadThreadBtn) loadThreadBtn.remove();
+            Array.from(tempDiv.children).forEach(reply => {
+                if (!replies.querySelector(`[data-comment-id="${reply.dataset.commentId}"]`)) {
+                    replies.appendChild(reply);
+                }
+            });
+            if (data.has_next) {
+                const more = document.createElement('button');
+                more.className = 'load-thread text-xs text-purple-600 hover:text-purple-800';
+                more.dataset.rootId = rootId;
+                more.dataset.cursor = data.next_cursor;
+                more.textContent = 'Show more replies';
+                replies.appendChild(more);
+            }
+        })
+        .catch(error => {
+            console.error('Error loading replies:', error);
+            showNotification('Error loading replies', 'error');
+        });
+}
+
+// The comment with this id and every reply below it, in document order
+function commentSubtree(commentItem) {
+    const items = [commentItem];
+    const path = commentItem.dataset.path;
+    let next = commentItem.nextElementSibling;
+    while (path && next && next.dataset.path && next.dataset.path.startsWith(path)) {
+        items.push(next);
+        next = next.nextElementSibling;
+    }
+    return items;
+}
+
+function openReplyForm(button) {
+    const commentItem = button.closest('.comment-item');
+    const existing = commentItem.querySelector(':scope > .reply-form');
+    if (existing) {
+        existing.remove();
+        return;
+    }
+    
+    const form = document.createElement('form');
+    form.className = 'reply-form mt-3';
+    form.innerHTML = `
+        <textarea name="content" rows="2" maxlength="1000" required
+                  class="w-full p-2 text-sm border border-gray-200 rounded-xl focus:outline-none focus:ring-2 focus:ring-purple-400"
+                  placeholder="Write a reply..."></textarea>
+        <div class="flex justify-end mt-2">
+            <button type="submit" class="bg-gradient-to-r from-purple-400 to-blue-400 text-white px-4 py-1 rounded-full text-sm font-semibold">Reply</button>
+        </div>`;
+    form.addEventListener('submit', function(e) {
+        e.preventDefault();
+        handleReplySubmit(form, commentItem, button.dataset.commentId);
+    });
+    commentItem.appendChild(form);
+    form.querySelector('textarea').focus();
+}
+
+function handleReplySubmit(form, parentItem, parentId) {
+    const postId = document.querySelector('.comment-toggle-btn').dataset.postId;
+    const formData = new FormData(form);
+    formData.append('parent_id', parentId);
+    const submitBtn = form.querySelector('button[type="submit"]');
+    submitBtn.disabled = true;
+    
+    fetch(`/interactions/comment/add/${postId}/`, {
+        method: 'POST',
+        body: formData,
+        headers: {
+            'X-CSRFToken': csrftoken
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (!data.success) {
+            showNotification(data.error || 'Error posting reply', 'error');
+            return;
+        }
+        form.remove();
+        const tempDiv = document.createElement('div');
+        tempDiv.innerHTML = data.comment_html;
+        applyCommentViewer(tempDiv);
+        const reply = tempDiv.firstElementChild;
+        
+        // Replies go right after the replied-to comment's own replies
+        const replies = document.querySelector(`.comment-replies[data-root-id="${data.root_id}"]`);
+        if (parentItem.parentElement === replies) {
+            const subtree = commentSubtree(parentItem);
+            subtree[subtree.length - 1].after(reply);
+        } else if (replies) {
+            const loadThreadBtn = replies.querySelector(':scope > .load-thread');
+            replies.insertBefore(reply, loadThreadBtn);
+        }
+        updateCommentCount(data.comment_count);
+        showNotification('Reply posted!', 'success');
+    })
+    .catch(error => {
+        console.error('Error posting reply:', error);
+        showNotification('Error posting reply', 'error');
+    })
+    .finally(() => {
+        submitBtn.disabled = false;
+    });
 }
 
 function handleCommentSubmit(form) {
@@ -414,6 +653,8 @@ function handleCommentSubmit(form) {
             const tempDiv = document.createElement('div');
             tempDiv.innerHTML = data.comment_html;
             const newComment = tempDiv.firstElementChild;
+            commentsList.dataset.viewerId = data.viewer_id;
+            applyCommentViewer(tempDiv);
             
             // Insert at the beginning of comments list
             const commentsContainer = commentsList.querySelector('.comments-list') || commentsList;
@@ -470,15 +711,17 @@ function handleCommentDelete(commentId) {
             .then(response => response.json())
             .then(data => {
                 if (data.success) {
-                    // Remove comment from DOM
-                    const commentItem = document.querySelector(`[data-comment-id="${commentId}"]`);
+                    // Remove comment from DOM, with the replies deleted along with it
+                    const commentItem = document.querySelector(`.comment-item[data-comment-id="${commentId}"]`);
                     if (commentItem) {
-                        commentItem.style.transition = 'all 0.3s ease';
-                        commentItem.style.opacity = '0';
-                        commentItem.style.transform = 'translateX(-20px)';
-                        setTimeout(() => {
-                            commentItem.remove();
-                        }, 300);
+                        commentSubtree(commentItem).forEach(item => {
+                            item.style.transition = 'all 0.3s ease';
+                            item.style.opacity = '0';
+                            item.style.transform = 'translateX(-20px)';
+                            setTimeout(() => {
+                                item.remove();
+                            }, 300);
+                        });
                     }
 
                     // Update comment count
@@ -695,6 +938,7 @@ document.addEventListener('DOMContentLoaded', function() {
     initLikeButtons();
     initCommentSystem();
     initAccountSettings();
+    initInfiniteScroll();
 
     // Add CSS animation for floating heart
     if (!document.getElementById('heart-animation-css')) {
@@ -842,8 +1086,60 @@ function filterByCategory(category) {
     }
 }
 
-// Infinite scroll functionality removed - no Load More buttons exist
-// This was incomplete placeholder code that referenced non-existent buttons
+// Infinite scroll for the home feed
+function initInfiniteScroll() {
+    const sentinel = document.getElementById('feed-sentinel');
+    const grid = document.getElementById('feed-grid');
+    if (!sentinel || !grid) return;
+
+    let loading = false;
+
+    const observer = new IntersectionObserver((entries) => {
+        if (entries[0].isIntersecting && !loading) {
+            loadNextFeedPage();
+        }
+    }, { rootMargin: '0px 0px 400px 0px' });
+
+    function loadNextFeedPage() {
+        const cursor = sentinel.dataset.nextCursor;
+        if (!cursor) return;
+
+        loading = true;
+        fetch(`${sentinel.dataset.url}?cursor=${encodeURIComponent(cursor)}`)
+            .then(response => response.json())
+            .then(data => {
+                const tempDiv = document.createElement('div');
+                tempDiv.innerHTML = data.posts_html;
+
+                // Respect the category filter that is currently active
+                const activeButton = document.querySelector('.category-filter-btn.active');
+                const activeCategory = activeButton ? activeButton.dataset.category : 'all';
+
+                tempDiv.querySelectorAll('.post-item').forEach(post => {
+                    if (activeCategory !== 'all' && post.dataset.category !== activeCategory) {
+                        post.style.display = 'none';
+                    }
+                    grid.appendChild(post);
+                });
+
+                if (data.has_next) {
+                    sentinel.dataset.nextCursor = data.next_cursor;
+                } else {
+                    observer.disconnect();
+                    sentinel.remove();
+                }
+            })
+            .catch(error => {
+                console.error('Error loading posts:', error);
+                showNotification('Error loading more posts', 'error');
+            })
+            .finally(() => {
+                loading = false;
+            });
+    }
+
+    observer.observe(sentinel);
+}
 
 // Animation initialization
 function initAnimations() {